@@ -13,13 +13,23 @@ echo.
 REM Get the current directory
 set "SCRIPT_DIR=%~dp0"
 
+REM Run the packed bridge, or the print-server source when set up from a repository checkout
+set "BRIDGE=%SCRIPT_DIR%ezdine-print-bridge.pyz"
+if not exist "%BRIDGE%" if exist "%SCRIPT_DIR%..\..\print-server\__main__.py" set "BRIDGE=%SCRIPT_DIR%..\..\print-server"
+if not exist "%BRIDGE%" (
+    echo Error: ezdine-print-bridge.pyz is missing from %SCRIPT_DIR%
+    echo Build it with: python print-server\build_bridge.py
+    pause
+    exit /b 1
+)
+
 REM Create VBS script to run Python silently
 set "VBS_FILE=%SCRIPT_DIR%start-silent.vbs"
 
 echo Creating startup script...
 (
 echo Set WshShell = CreateObject^("WScript.Shell"^)
-echo WshShell.Run "python ""%SCRIPT_DIR%server.py""", 0, False
+echo WshShell.Run "python ""%BRIDGE%""", 0, False
 ) > "%VBS_FILE%"
 
 REM Create shortcut in Startup folder
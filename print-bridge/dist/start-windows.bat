@@ -11,8 +11,21 @@ echo.
 echo    Starting print bridge...
 echo.
 
+REM Run from this folder even when started from elsewhere
+cd /d "%~dp0"
+
+REM Run the packed bridge, or the print-server source when started from a repository checkout
+set "BRIDGE=ezdine-print-bridge.pyz"
+if not exist "%BRIDGE%" if exist "..\..\print-server\__main__.py" set "BRIDGE=..\..\print-server"
+if not exist "%BRIDGE%" (
+    echo Error: ezdine-print-bridge.pyz is missing from %~dp0
+    echo Build it with: python print-server\build_bridge.py
+    pause
+    exit /b 1
+)
+
 REM Start the server
-python server.py
+python "%BRIDGE%"
 
 REM Keep window open if there's an error
 if errorlevel 1 (
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""
+EZDine Print Bridge entry point
+Runs the print server from the source folder (python3 print-server) or a built
+ezdine-print-bridge.pyz (python3 ezdine-print-bridge.pyz [port])
+"""
+
+import sys
+
+if len(sys.argv) > 1 and sys.argv[1] == '--check':
+    # Cold start probe for build_bridge.py: import everything the server needs, then exit
+    import server  # noqa: F401
+else:
+    from server import main
+    main()
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+App Paths Module for EZDine Print Server
+Where the bridge keeps its config and output files, whether run from source or a zipapp
+"""
+
+import os
+
+
+def _app_dir() -> str:
+    here = os.path.dirname(os.path.abspath(__file__))
+    # Inside ezdine-print-bridge.pyz, __file__ is a path within the archive; use the folder holding it
+    if os.path.isfile(here):
+        return os.path.dirname(here)
+    return here
+
+
+# Folder for printer_groups.json, profiles and other files that live beside the bridge
+APP_DIR = os.environ.get('EZDINE_APP_DIR') or _app_dir()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+EZDine Print Bridge Builder
+Packs the print server into a single ezdine-print-bridge.pyz with precompiled bytecode,
+then measures how long it takes to start
+
+Usage:
+    python3 build_bridge.py [--output ../print-bridge/dist/ezdine-print-bridge.pyz]
+                            [--target 0.5] [--runs 5]
+"""
+
+import argparse
+import glob
+import os
+import py_compile
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipapp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_OUTPUT = os.path.join(HERE, '..', 'print-bridge', 'dist', 'ezdine-print-bridge.pyz')
+
+# Developer tools that aren't part of the bridge
+EXCLUDED = {'build_bridge.py', 'bulk_print.py', 'central_queue.py', 'replay_jobs.py'}
+
+# Longest acceptable cold start in seconds (the bridge restarts on every PC boot)
+DEFAULT_TARGET = float(os.environ.get('EZDINE_COLD_START_TARGET', 0.5))
+
+
+def bridge_modules():
+    return sorted(path for path in glob.glob(os.path.join(HERE, '*.py'))
+                  if os.path.basename(path) not in EXCLUDED
+                  and not os.path.basename(path).startswith('test_'))
+
+
+def build(output: str) -> int:
+    """Build the zipapp, returns the number of modules packed"""
+    modules = bridge_modules()
+    with tempfile.TemporaryDirectory() as stage:
+        for path in modules:
+            name = os.path.basename(path)
+            shutil.copy2(path, os.path.join(stage, name))
+            # zipimport only looks for module.pyc next to module.py, not in __pycache__.
+            # Unchecked hash-based pycs skip the source timestamp comparison; on another
+            # Python version the magic number won't match and the .py is used instead
+            py_compile.compile(path, cfile=os.path.join(stage, name + 'c'), doraise=True,
+                               invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        # Stored uncompressed: a few hundred KB, and nothing to inflate at startup
+        zipapp.create_archive(stage, output, interpreter='/usr/bin/env python3')
+
+    # Receipt templates go beside the .pyz so they can be edited there; edited ones are kept
+    template_dir = os.path.join(os.path.dirname(os.path.abspath(output)), 'templates')
+    os.makedirs(template_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(HERE, 'templates', '*.json')):
+        target = os.path.join(template_dir, os.path.basename(path))
+        if not os.path.exists(target):
+            shutil.copy2(path, target)
+    return len(modules)
+
+
+def measure_cold_start(archive: str, runs: int) -> float:
+    """Median wall time to start Python and import the whole server from the archive"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, archive, '--check'], check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the EZDine print bridge zipapp')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='where to write the .pyz')
+    parser.add_argument('--target', type=float, default=DEFAULT_TARGET,
+                        help=f'cold start budget in seconds (default {DEFAULT_TARGET})')
+    parser.add_argument('--runs', type=int, default=5, help='cold starts to time')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    count = build(output)
+    print(f"📦 Packed {count} modules into {output} ({os.path.getsize(output) // 1024} KB)")
+
+    cold_start = measure_cold_start(output, max(1, args.runs))
+    print(f"⏱️ Cold start: {cold_start * 1000:.0f}ms (target {args.target * 1000:.0f}ms)")
+    if cold_start > args.target:
+        print("❌ Cold start is over target, check `python3 -X importtime` for slow imports")
+        sys.exit(1)
+    print("✅ Bridge ready")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+EZDine Bulk Printing
+Streams newline-delimited JSON print jobs from a file or stdin to the printers, for
+migrations, load tests and overnight batches (menus, labels, reports)
+
+Usage:
+    python3 bulk_print.py jobs.ndjson [--window 32] [--output results.ndjson]
+    python3 ip_printer.py --bulk - < jobs.ndjson
+
+Each input line is a /print body:
+    {"id": "menu-1", "printerId": "192.168.1.50", "lines": [...], "width": 80}
+(or "template" and "data" in place of "lines"). Jobs for the same printer print in input
+order; different printers print at the same time. One result per job is written as
+NDJSON, in the order jobs finish:
+    {"line": 1, "id": "menu-1", "printer": "192.168.1.50", "success": true,
+     "message": "...", "seconds": 0.41}
+At most --window jobs are read ahead of the printers, so memory stays flat however long
+the input is. Progress goes to stderr, so stdout carries only results.
+"""
+
+import argparse
+import functools
+import json
+import sys
+import threading
+import time
+from typing import IO, Any, Dict, Optional
+
+from app_paths import APP_DIR
+from print_queue import PrintDispatcher, PrintTask, load_default_groups
+from printer_registry import load_default_registry
+from request_body import PayloadError, expand_lines, json_loads
+from templates import apply_template
+
+# Jobs read ahead of the printers by default
+DEFAULT_WINDOW = 32
+
+
+class ResultWriter:
+    """Writes one NDJSON result per job as jobs finish, from any printer thread"""
+
+    def __init__(self, output: IO[str]):
+        self.output = output
+        self.succeeded = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def write(self, result: Dict[str, Any]):
+        with self._lock:
+            if result['success']:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            self.output.write(json.dumps(result) + '\n')
+            self.output.flush()
+
+
+def bulk_print(source: IO[bytes], output: IO[str], window: int = DEFAULT_WINDOW,
+               dispatcher: Optional[PrintDispatcher] = None) -> ResultWriter:
+    """
+    Print every job in source, at most window at a time; returns the result counts
+
+    source is read as bytes and each line decoded on its own, so a line that isn't
+    UTF-8 fails as that one job rather than ending the run.
+    """
+    dispatcher = dispatcher or PrintDispatcher()
+    results = ResultWriter(output)
+    slots = threading.BoundedSemaphore(window)
+
+    def finished(task: PrintTask, job_id: Any, started: float):
+        results.write({'line': task.job_id, 'id': job_id, 'printer': task.printer, 'success': task.success,
+                       'message': task.message, 'seconds': round(time.monotonic() - started, 3)})
+        slots.release()
+
+    for line_number, data in enumerate(source, 1):
+        if not data.strip():
+            continue
+        job = None
+        try:
+            job = json_loads(data.decode('utf-8'))
+            if not isinstance(job, dict) or not job.get('printerId'):
+                raise ValueError('job must be an object with a printerId')
+            job = apply_template(job, job.get('width', 80))
+            lines = expand_lines(job.get('lines', []))
+        except (ValueError, PayloadError) as e:
+            job_id = job.get('id', line_number) if isinstance(job, dict) else None
+            results.write({'line': line_number, 'id': job_id, 'printer': None, 'success': False,
+                           'message': f"Invalid job: {e}", 'seconds': 0})
+            continue
+
+        # Wait for a job to finish before reading further ahead
+        slots.acquire()
+        on_done = functools.partial(finished, job_id=job.get('id', line_number), started=time.monotonic())
+        task = PrintTask(line_number, lines, job.get('width', 80), on_done=on_done)
+        dispatcher.submit(job['printerId'], task)
+
+    # Every slot back means every job has finished
+    for _ in range(window):
+        slots.acquire()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print a stream of NDJSON jobs')
+    parser.add_argument('jobs', help="NDJSON job file ('-' for stdin)")
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW,
+                        help=f'most jobs in flight at once (default {DEFAULT_WINDOW})')
+    parser.add_argument('--output', help='write results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    # The printing modules report progress with print(); keep it off the results stream
+    sys.stdout = sys.stderr
+
+    try:
+        load_default_registry(APP_DIR)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not load printer registry: {e}")
+
+    # Group names in printerId work as they do through the server
+    dispatcher = PrintDispatcher()
+    try:
+        group_count = load_default_groups(dispatcher, APP_DIR)
+        if group_count:
+            print(f"👥 Loaded {group_count} printer group(s)")
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not load printer groups: {e}")
+
+    started = time.monotonic()
+    source = sys.stdin.buffer if args.jobs == '-' else open(args.jobs, 'rb')
+    try:
+        results = bulk_print(source, output, max(1, args.window), dispatcher)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if args.output:
+            output.close()
+
+    print(f"\n✅ {results.succeeded} printed, ❌ {results.failed} failed "
+          f"in {time.monotonic() - started:.1f}s")
+    return 0 if results.failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+EZDine Central Queue Stand-in
+A small in-memory job queue speaking the pull mode protocol (see pull_worker.py), for
+trying pull mode and testing bridges without the cloud service
+
+Usage:
+    python3 central_queue.py [port]
+    curl -X POST localhost:8090/jobs -d '{"printerId": "192.168.1.50", "lines": ["Hello"]}'
+    EZDINE_PULL_URL=http://localhost:8090 python3 server.py
+"""
+
+import itertools
+import json
+import sys
+import threading
+import time
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Claimed jobs not acknowledged within this time are handed out again
+LEASE_SECONDS = 60
+
+
+class CentralQueue:
+    def __init__(self):
+        self.pending = deque()
+        self.leased = {}
+        self.done = {}
+        self._ids = itertools.count(1)
+        self._ready = threading.Condition()
+
+    def add(self, job):
+        with self._ready:
+            job = {**job, 'id': job.get('id') or f'j{next(self._ids)}'}
+            self.pending.append(job)
+            self._ready.notify_all()
+            return job['id']
+
+    def claim(self, worker, count, wait):
+        deadline = time.monotonic() + wait
+        with self._ready:
+            while True:
+                self._expire()
+                if self.pending or time.monotonic() >= deadline:
+                    break
+                self._ready.wait(min(1.0, deadline - time.monotonic()))
+            jobs = [self.pending.popleft() for _ in range(min(count, len(self.pending)))]
+            for job in jobs:
+                self.leased[job['id']] = (worker, time.monotonic() + LEASE_SECONDS, job)
+            return jobs
+
+    def ack(self, results):
+        with self._ready:
+            for result in results:
+                lease = self.leased.pop(result.get('id'), None)
+                if lease is None:
+                    continue
+                if result.get('retry'):
+                    self.pending.append(lease[2])
+                    self._ready.notify_all()
+                else:
+                    self.done[result['id']] = result
+
+    def _expire(self):
+        now = time.monotonic()
+        for job_id, (worker, until, job) in list(self.leased.items()):
+            if until < now:
+                del self.leased[job_id]
+                self.pending.appendleft(job)
+
+    def status(self):
+        with self._ready:
+            return {'pending': len(self.pending), 'leased': len(self.leased), 'done': len(self.done)}
+
+
+central = CentralQueue()
+
+
+class QueueHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._send_json(200, {**central.status(), 'results': list(central.done.values())[-20:]})
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.path == '/jobs':
+            jobs = body if isinstance(body, list) else [body]
+            self._send_json(200, {'ids': [central.add(job) for job in jobs]})
+        elif self.path == '/claim':
+            jobs = central.claim(body.get('worker', '?'), int(body.get('max', 1)),
+                                 min(float(body.get('wait', 0)), 60))
+            self._send_json(200, {'jobs': jobs})
+        elif self.path == '/ack':
+            central.ack(body.get('results', []))
+            self._send_json(200, {'ok': True})
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8090
+    print(f"📬 Central queue stand-in on http://localhost:{port}")
+    ThreadingHTTPServer(('', port), QueueHandler).serve_forever()
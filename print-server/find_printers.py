@@ -1,13 +1,45 @@
 #!/usr/bin/env python3
 """
 Find thermal printers on local network
-Scans common IP ranges for devices listening on port 9100
+Scans the local networks for devices listening on port 9100, starting with hosts
+the computer has recently talked to, without needing internet access, then asks each
+device what it is so only ESC/POS thermal printers are offered
 """
 
+import argparse
+import ipaddress
+import json
+import os
+import re
 import socket
+import subprocess
+import sys
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app_paths import APP_DIR
+from ip_printer import ESCPOSCommands
+
+# Networks larger than this are only swept around the computer's own address
+MAX_SWEEP_PREFIX = 24
+
+# Matches IPv4 and MAC addresses in `arp -a`, `ifconfig` and `ipconfig` output
+IPV4_PATTERN = re.compile(r'(\d{1,3}(?:\.\d{1,3}){3})')
+MAC_PATTERN = re.compile(r'\b[0-9a-fA-F]{1,2}(?:[:-][0-9a-fA-F]{1,2}){5}\b')
+
+# Fingerprinting: seconds allowed to connect, and to answer each status or ID query
+FINGERPRINT_CONNECT_TIMEOUT = 1.0
+FINGERPRINT_REPLY_TIMEOUT = 0.5
+
+# Devices already classified, keyed by MAC address (or IP when the MAC is unknown)
+FINGERPRINT_CACHE = os.path.join(APP_DIR, 'printer_fingerprints.json')
+
+# Seconds until a device is asked again: ESC/POS printers are kept until --refresh, a device
+# that answered like something else is rechecked after a day, and one that didn't answer
+# at all (as a printer busy with another connection doesn't) on the next scan after 10 minutes
+FINGERPRINT_OTHER_TTL = 86400
+FINGERPRINT_UNKNOWN_TTL = 600
 
 def test_printer_port(ip, port=9100, timeout=2):
     """Test if a device responds on printer port"""
@@ -20,64 +52,332 @@ def test_printer_port(ip, port=9100, timeout=2):
     except:
         return False
 
-def scan_network_range(base_ip, start=1, end=254):
-    """Scan IP range for printers"""
-    print(f"🔍 Scanning {base_ip}.{start}-{end} for thermal printers...")
-    print("This may take a minute...")
+def _usable(interface):
+    address = interface.ip
+    return not (address.is_loopback or address.is_link_local or address.is_unspecified)
+
+def _linux_interfaces():
+    """Interface addresses and prefixes via ioctl, no external tools needed"""
+    import fcntl
+    import struct
+    SIOCGIFADDR, SIOCGIFNETMASK = 0x8915, 0x891b
+    interfaces = []
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for _, name in socket.if_nameindex():
+            request = struct.pack('256s', name.encode()[:15])
+            try:
+                address = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)[20:24])
+                netmask = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFNETMASK, request)[20:24])
+            except OSError:
+                continue  # interface without an IPv4 address
+            interfaces.append(ipaddress.IPv4Interface(f"{address}/{netmask}"))
+    finally:
+        sock.close()
+    return interfaces
+
+def _parsed_interfaces():
+    """Interface addresses and prefixes from ifconfig (macOS) or ipconfig (Windows)"""
+    command = ['ipconfig'] if sys.platform == 'win32' else ['ifconfig']
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, timeout=5).stdout
+    except (OSError, subprocess.SubprocessError):
+        return []
+    interfaces = []
+    if sys.platform == 'win32':
+        # "IPv4 Address. . . : 192.168.1.5" followed by "Subnet Mask . . . : 255.255.255.0"
+        address = None
+        for line in output.splitlines():
+            match = IPV4_PATTERN.search(line)
+            if not match:
+                continue
+            if 'IPv4' in line:
+                address = match.group(1)
+            elif 'Subnet' in line and address:
+                interfaces.append(ipaddress.IPv4Interface(f"{address}/{match.group(1)}"))
+                address = None
+    else:
+        # "inet 192.168.1.5 netmask 0xffffff00 broadcast 192.168.1.255"
+        for match in re.finditer(r'inet (\d+\.\d+\.\d+\.\d+) netmask (0x[0-9a-f]+|[\d.]+)', output):
+            netmask = match.group(2)
+            if netmask.startswith('0x'):
+                netmask = socket.inet_ntoa(int(netmask, 16).to_bytes(4, 'big'))
+            interfaces.append(ipaddress.IPv4Interface(f"{match.group(1)}/{netmask}"))
+    return interfaces
+
+def local_interfaces():
+    """IPv4 address and prefix of every local interface that could reach a printer"""
+    try:
+        interfaces = _linux_interfaces() if sys.platform.startswith('linux') else _parsed_interfaces()
+    except (ImportError, OSError, ValueError):
+        interfaces = []
+    if not interfaces:
+        # Last resort: the host name's addresses, assuming the usual /24
+        try:
+            addresses = socket.gethostbyname_ex(socket.gethostname())[2]
+        except OSError:
+            addresses = []
+        interfaces = [ipaddress.IPv4Interface(f"{address}/24") for address in addresses]
+    return [interface for interface in interfaces if _usable(interface)]
+
+def _normalize_mac(mac):
+    """aa:bb:cc:dd:ee:ff from the 0:1b:... and AA-BB-... forms arp prints"""
+    return ':'.join(part.zfill(2) for part in re.split('[:-]', mac.lower()))
+
+def arp_neighbors():
+    """Hosts in the kernel neighbor table with their MAC addresses, i.e. devices seen recently"""
+    neighbors = {}
+    try:
+        with open('/proc/net/arp') as f:
+            next(f)  # header
+            for line in f:
+                fields = line.split()
+                # Flags 0x0 are incomplete entries for hosts that never answered
+                if len(fields) >= 4 and fields[2] != '0x0' and fields[3] != '00:00:00:00:00:00':
+                    neighbors[fields[0]] = fields[3]
+        return neighbors
+    except OSError:
+        pass
+    try:
+        output = subprocess.run(['arp', '-a'], capture_output=True, text=True, timeout=5).stdout
+    except (OSError, subprocess.SubprocessError):
+        return {}
+    for line in output.splitlines():
+        address, mac = IPV4_PATTERN.search(line), MAC_PATTERN.search(line)
+        if address and mac:
+            neighbors[address.group(1)] = _normalize_mac(mac.group(0))
+    return neighbors
+
+def sweep_network(interface):
+    """The network to sweep for an interface, narrowed to its /24 when the prefix is wider"""
+    if interface.network.prefixlen < MAX_SWEEP_PREFIX:
+        return ipaddress.ip_interface(f"{interface.ip}/{MAX_SWEEP_PREFIX}").network
+    return interface.network
+
+def scan_order(networks, neighbors, own_addresses=()):
+    """Hosts to probe, neighbors on the scanned networks first, then the rest of each sweep"""
+    skip = set(own_addresses)
+    ordered = []
+    for address in neighbors:
+        host = ipaddress.ip_address(address)
+        if host not in skip and any(host in network for network in networks):
+            ordered.append(address)
+            skip.add(host)
+    for network in networks:
+        for host in network.hosts():
+            if host not in skip:
+                ordered.append(str(host))
+                skip.add(host)
+    return ordered
+
+def _read_reply(sock, size=1):
+    """Read a fixed-size reply, or up to the NUL ending an extended GS I reply (size=None)"""
+    sock.settimeout(FINGERPRINT_REPLY_TIMEOUT)
+    reply = b''
+    try:
+        while True:
+            data = sock.recv(1 if size is None else size - len(reply))
+            if not data:
+                return None
+            reply += data
+            if size is None and reply.endswith(b'\0'):
+                # Extended replies are '_' + text + NUL
+                return reply[1:-1].decode('ascii', errors='replace').strip() if reply[:1] == b'_' else None
+            if size is not None and len(reply) == size:
+                return reply
+    except OSError:
+        return None
+
+def fingerprint(ip, port=9100):
+    """
+    Ask a port 9100 device what it is with queries that print nothing
     
-    found_printers = []
+    Only DLE EOT is sent until the device answers like an ESC/POS printer, so NAS boxes,
+    label and laser printers get three bytes they ignore. kind is 'escpos', 'other' for a
+    reply that isn't a printer status, or 'unknown' when the device didn't let us in or
+    didn't answer in time, which a single-session printer busy printing also does.
+    """
+    result = {'ip': ip, 'kind': 'unknown', 'manufacturer': None, 'model': None, 'capabilities': {}}
+    try:
+        sock = socket.create_connection((ip, port), timeout=FINGERPRINT_CONNECT_TIMEOUT)
+    except OSError:
+        return result
+    try:
+        sock.sendall(ESCPOSCommands.STATUS_PRINTER)
+        status = _read_reply(sock)
+        if status is None:
+            return result
+        # Printer status byte: bits 1 and 4 always set, bits 0 and 7 always clear
+        if status[0] & 0x93 != 0x12:
+            result['kind'] = 'other'
+            return result
+        result['kind'] = 'escpos'
+        capabilities = result['capabilities']
+        capabilities['online'] = not status[0] & 0x08
+        
+        sock.sendall(ESCPOSCommands.PRINTER_ID + b'\x02')
+        type_id = _read_reply(sock)
+        if type_id is not None:
+            capabilities['twoByteCharacters'] = bool(type_id[0] & 0x01)
+            capabilities['autocutter'] = bool(type_id[0] & 0x02)
+        sock.sendall(ESCPOSCommands.PRINTER_ID + b'B')
+        result['manufacturer'] = _read_reply(sock, None)
+        sock.sendall(ESCPOSCommands.PRINTER_ID + b'C')
+        result['model'] = _read_reply(sock, None)
+        
+        sock.sendall(ESCPOSCommands.STATUS_ROLL)
+        roll = _read_reply(sock)
+        if roll is not None:
+            capabilities['paper'] = 'out' if roll[0] & 0x60 else 'low' if roll[0] & 0x0c else 'ok'
+    except OSError:
+        pass
+    finally:
+        sock.close()
+    return result
+
+def describe_device(device):
+    """One line summary, e.g. 'EPSON TM-T20II (autocutter)'"""
+    if device['kind'] == 'unknown':
+        return "did not answer a status query (a printer busy with another connection?)"
+    if device['kind'] != 'escpos':
+        return "not an ESC/POS printer (NAS, label or laser printer?)"
+    name = ' '.join(part for part in (device.get('manufacturer'), device.get('model')) if part)
+    features = [key for key in ('autocutter',) if device['capabilities'].get(key)]
+    paper = device['capabilities'].get('paper')
+    if paper and paper != 'ok':
+        features.append(f"paper {paper}")
+    return f"{name or 'ESC/POS thermal printer'}{' (' + ', '.join(features) + ')' if features else ''}"
+
+class FingerprintCache:
+    """Classified devices from earlier scans, so they aren't queried again"""
     
-    def check_ip(i):
-        ip = f"{base_ip}.{i}"
-        if test_printer_port(ip):
-            print(f"✅ Found printer at: {ip}:9100")
-            found_printers.append(ip)
-            return ip
+    def __init__(self, path=FINGERPRINT_CACHE):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.devices = json.load(f)
+        except (OSError, ValueError):
+            self.devices = {}
+    
+    def get(self, ip, mac=None):
+        with self._lock:
+            device = self.devices.get(mac or ip)
+        # Anything but an ESC/POS printer is asked again once its answer expires (or, from
+        # caches written before answers expired, straight away)
+        if device and device.get('kind') != 'escpos' and device.get('expires', 0) <= time.time():
+            return None
+        # A MAC seen at a new address (DHCP) is the same device; a bare IP must still match
+        if device and (mac or device.get('ip') == ip):
+            return {**device, 'ip': ip}
         return None
     
-    # Use threading for faster scanning
-    with ThreadPoolExecutor(max_workers=50) as executor:
-        futures = [executor.submit(check_ip, i) for i in range(start, end + 1)]
-        
-        # Show progress
-        for i, future in enumerate(futures):
-            if i % 50 == 0:
-                print(f"📡 Scanned {i + start} IPs...")
-            future.result()
+    def put(self, device):
+        """Keep a device's answer, for good if it is an ESC/POS printer and for a while otherwise"""
+        if device['kind'] != 'escpos':
+            ttl = FINGERPRINT_OTHER_TTL if device['kind'] == 'other' else FINGERPRINT_UNKNOWN_TTL
+            device = {**device, 'expires': time.time() + ttl}
+        with self._lock:
+            self.devices[device.get('mac') or device['ip']] = device
+    
+    def save(self):
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.devices, f, indent=2)
+        except OSError as e:
+            print(f"⚠️ Could not save fingerprint cache: {e}")
+
+def check_host(ip, cache=None):
+    """Port check, then fingerprint unless the device is already in the cache; None if port closed"""
+    if not test_printer_port(ip):
+        return None
+    # Connecting just refreshed the neighbor table, so the MAC is known now if it ever will be
+    mac = arp_neighbors().get(ip)
+    device = cache.get(ip, mac) if cache else None
+    if device is None:
+        device = {**fingerprint(ip), 'mac': mac, 'checked': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        if cache:
+            cache.put(device)
+    return device
+
+def scan_hosts(hosts, expect=0, workers=50, cache=None):
+    """Probe hosts in order for printers, stopping once expect thermal printers are found"""
+    print(f"🔍 Probing {len(hosts)} addresses for thermal printers...")
+    
+    found_printers = []
+    # Submitting in order means the likely hosts at the front are probed first
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {executor.submit(check_host, ip, cache): ip for ip in hosts}
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            device = future.result()
+            if device:
+                ip = device['ip']
+                if device['kind'] == 'escpos':
+                    print(f"✅ Found printer at: {ip}:9100 - {describe_device(device)}")
+                elif device['kind'] == 'unknown':
+                    print(f"❔ {ip}:9100 is open but {describe_device(device)}")
+                else:
+                    print(f"⚪ {ip}:9100 is open but {describe_device(device)}")
+                found_printers.append(device)
+                if expect and sum(d['kind'] == 'escpos' for d in found_printers) >= expect:
+                    print(f"⏹️ Found the {expect} expected printer(s), stopping early")
+                    break
+            if done % 50 == 0:
+                print(f"📡 Scanned {done} IPs...")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
     
     return found_printers
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find thermal printers on the local network")
+    parser.add_argument('network', nargs='*', help="networks to sweep instead of the local ones, e.g. 10.0.0.0/24")
+    parser.add_argument('--expect', type=int, default=0, help="stop once this many printers are found")
+    parser.add_argument('--refresh', action='store_true', help="query every device again, ignoring the cache")
+    args = parser.parse_args(argv)
+    
     print("🖨️ EZDine Printer Scanner")
     print("=" * 30)
     
-    # Get local IP to determine network range
-    try:
-        # Connect to a remote address to get local IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-        
-        print(f"Your computer IP: {local_ip}")
-        
-        # Extract network base (e.g., 192.168.1.x -> 192.168.1)
-        base_ip = '.'.join(local_ip.split('.')[:-1])
-        print(f"Scanning network: {base_ip}.1-254")
-        print()
-        
-    except:
+    interfaces = local_interfaces()
+    for interface in interfaces:
+        print(f"Your computer IP: {interface.ip} ({interface.network})")
+    if args.network:
+        networks = [ipaddress.ip_network(network, strict=False) for network in args.network]
+    elif interfaces:
+        networks = list(dict.fromkeys(sweep_network(interface) for interface in interfaces))
+    else:
         print("Could not determine local IP, using default ranges")
-        base_ip = "192.168.1"
+        networks = [ipaddress.ip_network('192.168.1.0/24')]
+    
+    neighbors = arp_neighbors()
+    hosts = scan_order(networks, neighbors, [interface.ip for interface in interfaces])
+    print(f"Scanning network: {', '.join(str(network) for network in networks)}")
+    print(f"Recently seen devices checked first: {len(set(neighbors) & set(hosts))}")
+    print()
     
     # Scan for printers
-    printers = scan_network_range(base_ip)
+    cache = FingerprintCache()
+    if args.refresh:
+        cache.devices = {}
+    devices = scan_hosts(hosts, args.expect, cache=cache)
+    cache.save()
+    printers = [device['ip'] for device in devices if device['kind'] == 'escpos']
+    others = [device['ip'] for device in devices if device['kind'] == 'other']
+    unknown = [device['ip'] for device in devices if device['kind'] == 'unknown']
     
     print("\n" + "=" * 30)
+    if others:
+        print(f"⚪ Skipped {len(others)} other port 9100 device(s): {', '.join(others)}")
+    if unknown:
+        print(f"❔ No answer from {len(unknown)} port 9100 device(s), maybe printers busy printing: "
+              f"{', '.join(unknown)} (scan again when they are idle)")
     if printers:
         print(f"🎉 Found {len(printers)} thermal printer(s):")
-        for printer in printers:
-            print(f"   📍 {printer}")
+        for device in devices:
+            if device['kind'] == 'escpos':
+                print(f"   📍 {device['ip']} - {describe_device(device)}")
         
         print("\n📋 Next steps:")
         print("1. Test each printer:")
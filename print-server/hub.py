@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+"""
+EZDine Print Hub
+One HTTP front end driving many printers, for cloud kitchens running several brands.
+Printers are sharded across worker processes by consistent hash of printer id; each
+worker owns its printers' connections and queues, and tenants get in-flight quotas
+
+Usage:
+    python3 hub.py [port] [--workers 4] [--tenants tenants.json]
+
+tenants.json: {"default": 50, "tenants": {"burger-brand": 80, "pizza-brand": 40}}
+Jobs name their tenant in an X-Tenant-Id header or a "tenant" field.
+"""
+
+import argparse
+import bisect
+import datetime
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from app_paths import APP_DIR
+from job_trace import trace_id_from_headers
+from printer_registry import load_default_registry, registry
+from request_body import PayloadError, read_payload
+from templates import apply_template
+from transports import lookup_transport
+
+# How long /print waits for a worker to report the job printed
+PRINT_WAIT_TIMEOUT = 60
+
+# Jobs a tenant may have queued or printing at once, unless tenants.json says otherwise
+DEFAULT_TENANT_QUOTA = int(os.environ.get('EZDINE_TENANT_QUOTA', 50))
+
+# Virtual nodes per worker on the hash ring, so printers spread evenly
+RING_REPLICAS = 64
+
+# Seconds between checks that every worker process is still alive
+MONITOR_INTERVAL = 1.0
+
+# Seconds a reply reader waits on its worker before checking whether to stop
+REPLY_POLL = 0.5
+
+# Seconds to wait for a dead worker's reader to finish (it can be stuck on a reply the
+# worker died halfway through writing)
+READER_STOP_TIMEOUT = 5.0
+
+CORS_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type, Content-Encoding, X-Request-Id, X-Tenant-Id, traceparent'),
+    ('Access-Control-Expose-Headers', 'X-Request-Id, Retry-After'),
+)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hash of printer keys onto worker indexes"""
+
+    def __init__(self, shards: int, replicas: int = RING_REPLICAS):
+        points = sorted((_hash(f'{shard}:{replica}'), shard)
+                        for shard in range(shards) for replica in range(replicas))
+        self._keys = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard(self, key: str) -> int:
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._shards[index]
+
+
+def load_groups_config(base_dir: str) -> Dict[str, Any]:
+    """Printer groups config (same file as the print server), {} if there is none"""
+    path = os.environ.get('EZDINE_PRINTER_GROUPS') or os.path.join(base_dir, 'printer_groups.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('groups', {})
+
+
+def shard_keys(groups: Dict[str, Any]) -> Dict[str, str]:
+    """Map every group and group member to its group name, so a whole group lands on one worker"""
+    keys = {}
+    for name, spec in groups.items():
+        keys[name] = name
+        for member in spec.get('members', []):
+            keys.setdefault(member, name)
+    return keys
+
+
+def _worker_main(index: int, inbox: 'multiprocessing.Queue', outbox: 'multiprocessing.Queue',
+                 groups: Dict[str, Any]):
+    """Worker process: owns a shard of printers and prints whatever the front end routes to it"""
+    from print_queue import STRATEGY_EARLIEST_FINISH, PrintDispatcher, PrintTask, QueueFull
+
+    # Each worker watches the registry itself, so re-pointing a printer needs no restart
+    try:
+        load_default_registry(APP_DIR)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Worker {index} could not load printer registry: {e}")
+    dispatcher = PrintDispatcher()
+    for name, spec in groups.items():
+        dispatcher.add_group(name, spec.get('members', []), spec.get('strategy', STRATEGY_EARLIEST_FINISH))
+
+    def finished(task):
+        outbox.put(('result', task.job_id, (task.success, task.message, task.printer, None)))
+
+    while True:
+        kind, request_id, body = inbox.get()
+        if kind == 'print':
+            target, lines, width = body
+            # Every new target gets a queue and a thread that live for good, so only real printers do
+            if not dispatcher.is_target(target):
+                outbox.put(('result', request_id, (False, f"Unknown printer {target}", None, None)))
+                continue
+            try:
+                dispatcher.admit(target)
+            except QueueFull as e:
+                outbox.put(('result', request_id, (False, str(e), None, e.retry_after)))
+                continue
+            dispatcher.submit(target, PrintTask(request_id, lines, width, on_done=finished))
+        elif kind == 'status':
+            outbox.put(('status', request_id, {'worker': index, 'pid': os.getpid(), **dispatcher.status()}))
+
+
+class Pending:
+    """A request waiting on a worker's reply"""
+
+    def __init__(self, worker: int, tenant: Optional[str] = None):
+        self.worker = worker
+        # Tenant charged for the job until the worker reports it done
+        self.tenant = tenant
+        self.result: Any = None
+        self._ready = threading.Event()
+
+    def resolve(self, result: Any):
+        self.result = result
+        self._ready.set()
+
+    def wait(self, timeout: float) -> bool:
+        return self._ready.wait(timeout)
+
+
+class Worker:
+    """Front end's handle on one worker process"""
+
+    def __init__(self, index: int, groups: Dict[str, Any], context):
+        self.index = index
+        self.groups = groups
+        self.context = context
+        self.restarts = 0
+        self.reader: Optional[threading.Thread] = None
+        self.reader_stop = threading.Event()
+        self.start()
+
+    def start(self):
+        self.inbox = self.context.Queue()
+        self.outbox = self.context.Queue()
+        self.process = self.context.Process(target=_worker_main, name=f'ezdine-hub-worker-{self.index}',
+                                            args=(self.index, self.inbox, self.outbox, self.groups), daemon=True)
+        self.process.start()
+
+
+class PrintHub:
+    """Routes jobs to worker processes and enforces per-tenant quotas"""
+
+    def __init__(self, workers: int, groups: Dict[str, Any], quotas: Dict[str, int],
+                 default_quota: int = DEFAULT_TENANT_QUOTA):
+        self.ring = HashRing(workers)
+        self.groups = groups
+        self.keys = shard_keys(groups)
+        self.quotas = quotas
+        self.default_quota = default_quota
+        self.shed = 0
+        context = multiprocessing.get_context('spawn')
+        self.workers = [Worker(index, groups, context) for index in range(workers)]
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, Pending] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        for worker in self.workers:
+            self._start_reader(worker)
+        threading.Thread(target=self._monitor, name='hub-monitor', daemon=True).start()
+
+    def is_target(self, target: str) -> bool:
+        """True if target is a group, a named printer or a printer address, as the workers check it"""
+        return target in self.groups or registry.get(target) is not None or lookup_transport(target) is not None
+
+    def worker_for(self, target: str) -> 'Worker':
+        return self.workers[self.ring.shard(self.keys.get(target, target))]
+
+    def _start_reader(self, worker: Worker):
+        worker.reader_stop = threading.Event()
+        worker.reader = threading.Thread(target=self._read_replies, args=(worker.outbox, worker.reader_stop),
+                                         name=f'hub-reader-{worker.index}', daemon=True)
+        worker.reader.start()
+
+    def _stop_reader(self, worker: Worker):
+        """End a dead worker's reader once it has taken the replies the worker left, and close its queues"""
+        # The front end holds both ends of the queue, so the reader never sees EOF. Nothing is
+        # put on it to wake the reader either: a worker killed mid-reply can leave its write lock held
+        worker.reader_stop.set()
+        worker.reader.join(READER_STOP_TIMEOUT)
+        for worker_queue in (worker.inbox, worker.outbox):
+            worker_queue.close()
+            worker_queue.cancel_join_thread()
+
+    def _read_replies(self, outbox, stop: threading.Event):
+        while True:
+            try:
+                _, request_id, result = outbox.get(timeout=REPLY_POLL)
+            except queue.Empty:
+                if stop.is_set():
+                    return
+                continue
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                pending = self._pending.pop(request_id, None)
+            if pending is not None:
+                self._resolve(pending, result)
+
+    def _resolve(self, pending: Pending, result: Any):
+        pending.resolve(result)
+        if pending.tenant is not None:
+            self.release(pending.tenant)
+
+    def _monitor(self):
+        while True:
+            time.sleep(MONITOR_INTERVAL)
+            for worker in self.workers:
+                if worker.process.is_alive():
+                    continue
+                print(f"⚠️ Hub worker {worker.index} exited (code {worker.process.exitcode}), restarting")
+                self._stop_reader(worker)
+                with self._lock:
+                    lost = [(request_id, pending) for request_id, pending in self._pending.items()
+                            if pending.worker == worker.index]
+                    for request_id, _ in lost:
+                        del self._pending[request_id]
+                for _, pending in lost:
+                    self._resolve(pending, (False, f"Hub worker {worker.index} restarted", None, None))
+                worker.restarts += 1
+                worker.start()
+                self._start_reader(worker)
+
+    def _request(self, worker: Worker, kind: str, body: Any, tenant: Optional[str] = None) -> Tuple[int, Pending]:
+        request_id = next(self._ids)
+        pending = Pending(worker.index, tenant)
+        with self._lock:
+            self._pending[request_id] = pending
+        try:
+            worker.inbox.put((kind, request_id, body))
+        except (ValueError, OSError):
+            # The worker is being restarted and its queue closed; the request never reached it
+            self._forget(request_id)
+            if tenant is not None:
+                self.release(tenant)
+            raise
+        return request_id, pending
+
+    def _forget(self, request_id: int):
+        with self._lock:
+            self._pending.pop(request_id, None)
+
+    def acquire(self, tenant: str) -> bool:
+        """Count a job against its tenant's quota, False if the tenant is at its limit"""
+        quota = self.quotas.get(tenant, self.default_quota)
+        with self._lock:
+            if self._in_flight.get(tenant, 0) >= quota:
+                self.shed += 1
+                return False
+            self._in_flight[tenant] = self._in_flight.get(tenant, 0) + 1
+            return True
+
+    def release(self, tenant: str):
+        with self._lock:
+            self._in_flight[tenant] -= 1
+
+    def print_job(self, target: str, lines: List[Dict[str, Any]], width: int, tenant: str,
+                  timeout: float = PRINT_WAIT_TIMEOUT) -> Optional[Tuple[bool, str, Optional[str], Optional[int]]]:
+        """
+        Send a job acquired for tenant to the worker owning target
+
+        Returns (success, message, printer, retry_after), or None if the worker hasn't
+        finished it within timeout. The tenant's quota is released when the worker reports
+        the job done (or dies), not when the caller stops waiting, so jobs still queued
+        on a slow printer keep counting against it.
+        """
+        worker = self.worker_for(target)
+        try:
+            _, pending = self._request(worker, 'print', (target, lines, width), tenant)
+        except (ValueError, OSError):
+            return False, f"Hub worker {worker.index} is restarting", None, None
+        if not pending.wait(timeout):
+            return None
+        return pending.result
+
+    def status(self) -> Dict[str, Any]:
+        replies = []
+        for worker in self.workers:
+            try:
+                replies.append((worker, *self._request(worker, 'status', None)))
+            except (ValueError, OSError):
+                replies.append((worker, None, None))
+        workers = []
+        for worker, request_id, pending in replies:
+            if pending is not None and pending.wait(2.0):
+                workers.append({**pending.result, 'restarts': worker.restarts})
+            else:
+                self._forget(request_id)
+                workers.append({'worker': worker.index, 'alive': worker.process.is_alive(),
+                                'restarts': worker.restarts})
+        with self._lock:
+            tenants = {tenant: {'inFlight': count, 'quota': self.quotas.get(tenant, self.default_quota)}
+                       for tenant, count in self._in_flight.items()}
+        return {'shed': self.shed, 'tenants': tenants, 'workers': workers}
+
+
+hub: Optional[PrintHub] = None
+
+
+class HubServer(ThreadingHTTPServer):
+    # Many terminals across brands connect at once; the default backlog of 5 resets them
+    request_queue_size = 128
+
+
+class HubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _send_json_response(self, status_code, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in list(CORS_HEADERS) + list((headers or {}).items()):
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        for name, value in CORS_HEADERS:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self._send_json_response(200, {
+                'status': 'ok',
+                'message': 'EZDine Print Hub is running',
+                'timestamp': datetime.datetime.now().isoformat(),
+                **hub.status()
+            })
+        else:
+            self._send_json_response(404, {'success': False, 'error': 'Endpoint not found'})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/print':
+            self.close_connection = True
+            self._send_json_response(404, {'success': False, 'error': 'Endpoint not found'})
+            return
+
+        trace_id = trace_id_from_headers(self.headers)
+        try:
+            job = read_payload(self.rfile, self.headers)
+            job = apply_template(job, job.get('width', 80))
+        except PayloadError as e:
+            if not e.body_consumed:
+                self.close_connection = True
+            self._send_json_response(e.status_code, {'success': False, 'error': 'Invalid print job',
+                                                     'message': str(e)})
+            return
+
+        target = job.get('printerId', '')
+        tenant = self.headers.get('X-Tenant-Id') or job.get('tenant') or 'default'
+        if not target:
+            self._send_json_response(400, {'success': False, 'error': 'printerId is required'})
+            return
+        if not hub.is_target(target):
+            self._send_json_response(400, {
+                'success': False,
+                'error': 'printerId must be a printer address, a named printer or a printer group'
+            })
+            return
+        if not hub.acquire(tenant):
+            self._send_json_response(429, {
+                'success': False,
+                'error': 'Tenant quota reached',
+                'message': f"Tenant {tenant} already has {hub.quotas.get(tenant, hub.default_quota)} jobs in flight",
+                'retryAfter': 1
+            }, headers={'Retry-After': '1'})
+            return
+
+        result = hub.print_job(target, job.get('lines', []), job.get('width', 80), tenant)
+
+        if result is None:
+            success, message, printer, retry_after = False, f"Print job still queued for {target}", None, None
+        else:
+            success, message, printer, retry_after = result
+        if retry_after:
+            self._send_json_response(429, {'success': False, 'error': 'Print queue full', 'message': message,
+                                           'retryAfter': retry_after}, headers={'Retry-After': str(retry_after)})
+            return
+
+        self._send_json_response(200 if success else 502, {
+            'success': success,
+            'message': message,
+            'printer': printer,
+            'tenant': tenant,
+            'traceId': trace_id
+        }, headers={'X-Request-Id': trace_id})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def load_tenant_quotas(path: Optional[str]) -> Tuple[Dict[str, int], int]:
+    """Per-tenant quotas and the default from tenants.json"""
+    path = path or os.path.join(APP_DIR, 'tenants.json')
+    if not os.path.exists(path):
+        return {}, DEFAULT_TENANT_QUOTA
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    return {name: int(quota) for name, quota in config.get('tenants', {}).items()}, \
+        int(config.get('default', DEFAULT_TENANT_QUOTA))
+
+
+def main(argv=None):
+    global hub
+    parser = argparse.ArgumentParser(description='Run the EZDine print hub')
+    parser.add_argument('port', nargs='?', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                        help='printer worker processes (default: one per CPU core)')
+    parser.add_argument('--tenants', help='tenant quota file (default tenants.json next to the hub)')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    quotas, default_quota = load_tenant_quotas(args.tenants)
+    # The front end checks printer ids against the registry before routing them
+    try:
+        load_default_registry(APP_DIR)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not load printer registry: {e}")
+    hub = PrintHub(max(1, args.workers), load_groups_config(APP_DIR), quotas, default_quota)
+    httpd = HubServer(('', args.port), HubHandler)
+
+    print('\n🚀 ' + '=' * 32)
+    print('🏭 EZDINE PRINT HUB STARTED')
+    print('=' * 32)
+    print('🌐 Hub URL:', f'http://localhost:{args.port}')
+    print('⚙️ Worker processes:', len(hub.workers))
+    print('🏷️ Tenant quotas:', quotas or f'{default_quota} jobs each')
+    print('=' * 32 + '\n')
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print('\n\n🛑 Hub stopped by user')
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,49 @@ Direct IP Printer Module for EZDine
 Sends ESC/POS commands directly to thermal printers via IP address
 """
 
+import os
 import socket
+import threading
 import time
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional
+
+# Bytes moved per socket write when streaming raw ESC/POS data
+STREAM_CHUNK_SIZE = 16384
+
+# Rendered ESC/POS is yielded in chunks of about this size
+RENDER_CHUNK_SIZE = 1024
+
+# Conservative starting estimate of how fast a printer consumes data (bytes/sec)
+DEFAULT_DRAIN_RATE = float(os.environ.get('EZDINE_PRINTER_DRAIN_RATE', 4096))
+
+# Data allowed in flight beyond what the printer has drained (cheap units buffer ~4 KB)
+PRINTER_BUFFER_SIZE = int(os.environ.get('EZDINE_PRINTER_BUFFER_SIZE', 4096))
+
+# Confirm progress with a status query after this many bytes (when enabled)
+STATUS_CONFIRM_INTERVAL = 8192
+
+# How long to wait for a status reply before giving up on confirmations
+STATUS_REPLY_TIMEOUT = 5.0
+
+# A send blocked at least this long (seconds) means the printer's buffer is full
+BACKPRESSURE_SECONDS = 0.05
+
+# Without status replies, a paced stretch the printer kept up with raises the drain
+# estimate towards this multiple of itself, so a fast printer isn't paced slow forever
+DRAIN_PROBE = 1.25
+
+# Character code tables selectable with ESC t n (Epson numbering, shared by most thermal printers)
+CODEPAGES = {
+    'cp437': 0,
+    'cp850': 2,
+    'cp860': 3,
+    'cp863': 4,
+    'cp865': 5,
+    'cp1252': 16,
+    'cp866': 17,
+    'cp852': 18,
+    'cp858': 19,
+}
 
 class ESCPOSCommands:
     """ESC/POS command constants for thermal printers"""
@@ -14,10 +54,14 @@ class ESCPOSCommands:
     # Basic commands
     ESC = b'\x1b'
     GS = b'\x1d'
+    DLE = b'\x10'
     
     # Initialize printer
     INIT = ESC + b'@'
     
+    # Select character code table (followed by the table number)
+    CODE_TABLE = ESC + b't'
+    
     # Text formatting
     BOLD_ON = ESC + b'E\x01'
     BOLD_OFF = ESC + b'E\x00'
@@ -39,6 +83,99 @@ class ESCPOSCommands:
     DOUBLE_HEIGHT = GS + b'!\x10'
     DOUBLE_WIDTH = GS + b'!\x20'
     DOUBLE_SIZE = GS + b'!\x30'
+    
+    # Transmit paper sensor status (answered in order, after preceding data is processed)
+    STATUS_PAPER = GS + b'r\x01'
+    
+    # Real-time status (answered at once, even mid-job): printer state and paper roll sensor
+    STATUS_PRINTER = DLE + b'\x04\x01'
+    STATUS_ROLL = DLE + b'\x04\x04'
+    
+    # Transmit printer ID (followed by n: 2 = type flags, 'B' = maker, 'C' = model name)
+    PRINTER_ID = GS + b'I'
+
+def ignore_stage(stage: str):
+    pass
+
+class DrainRate:
+    """Running estimate of how fast a printer consumes data"""
+    
+    def __init__(self, bytes_per_sec: float = DEFAULT_DRAIN_RATE):
+        self.bytes_per_sec = bytes_per_sec
+        self._lock = threading.Lock()
+    
+    def observe(self, byte_count: int, seconds: float):
+        """Fold in a measured drain (exponentially weighted)"""
+        if byte_count <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            self.bytes_per_sec = 0.7 * self.bytes_per_sec + 0.3 * (byte_count / seconds)
+
+def iter_escpos(lines: Iterable[Dict[str, Any]], paper_width: int = 80,
+                chunk_size: int = RENDER_CHUNK_SIZE, codepage: Optional[str] = None) -> Iterator[bytes]:
+    """
+    Render print lines to ESC/POS, yielding chunks so long documents use constant memory
+
+    Text is sent as UTF-8 unless a codepage from CODEPAGES is given, in which case that
+    table is selected and characters outside it print as '?'
+    """
+    # Build ESC/POS command sequence
+    commands = bytearray()
+    
+    # Initialize printer
+    commands.extend(ESCPOSCommands.INIT)
+    if codepage:
+        commands.extend(ESCPOSCommands.CODE_TABLE + bytes([CODEPAGES[codepage]]))
+        encoding, errors = codepage, 'replace'
+    else:
+        encoding, errors = 'utf-8', 'ignore'
+    
+    # Process each line
+    for line in lines:
+        text = line.get('text', '')
+        align = line.get('align', 'left')
+        bold = line.get('bold', False)
+        
+        # Set alignment
+        if align == 'center':
+            commands.extend(ESCPOSCommands.ALIGN_CENTER)
+        elif align == 'right':
+            commands.extend(ESCPOSCommands.ALIGN_RIGHT)
+        else:
+            commands.extend(ESCPOSCommands.ALIGN_LEFT)
+        
+        # Set bold
+        if bold:
+            commands.extend(ESCPOSCommands.BOLD_ON)
+        
+        # Add text (encode to bytes)
+        commands.extend(text.encode(encoding, errors=errors))
+        
+        # Turn off bold
+        if bold:
+            commands.extend(ESCPOSCommands.BOLD_OFF)
+        
+        # Add line feed
+        commands.extend(ESCPOSCommands.LF)
+        
+        if len(commands) >= chunk_size:
+            yield bytes(commands)
+            commands.clear()
+    
+    # Add extra line feeds and cut
+    commands.extend(ESCPOSCommands.LF * 3)
+    commands.extend(ESCPOSCommands.CUT_PARTIAL)
+    
+    yield bytes(commands)
+
+def build_escpos(lines: List[Dict[str, Any]], paper_width: int = 80) -> bytes:
+    """Convert print lines to an ESC/POS command sequence"""
+    return b''.join(iter_escpos(lines, paper_width))
+
+def mark_rendered(chunks: Iterable[bytes], on_stage: Callable[[str], None]) -> Iterator[bytes]:
+    """Pass chunks through, reporting 'rendered' once the renderer is exhausted"""
+    yield from chunks
+    on_stage('rendered')
 
 class IPPrinter:
     """Direct IP printer communication"""
@@ -53,12 +190,8 @@ class IPPrinter:
         try:
             print(f"🔌 Connecting to printer at {self.ip_address}:{self.port}")
             
-            # Create socket connection
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(self.timeout)
-            
-            # Connect to printer
-            sock.connect((self.ip_address, self.port))
+            # Connect to printer (IPv4 or IPv6)
+            sock = socket.create_connection((self.ip_address, self.port), timeout=self.timeout)
             print(f"✅ Connected to printer")
             
             # Send data
@@ -84,64 +217,155 @@ class IPPrinter:
             print(f"❌ Printer communication error: {e}")
             return False
     
-    def print_lines(self, lines: List[Dict[str, Any]], paper_width: int = 80) -> bool:
-        """Convert print lines to ESC/POS and send to printer"""
+    def send_stream(self, readinto: Callable[[memoryview], int], chunk_size: int = STREAM_CHUNK_SIZE,
+                    on_stage: Callable[[str], None] = ignore_stage) -> bool:
+        """Stream raw bytes to printer, refilling one reused buffer via readinto"""
+        buffer = memoryview(bytearray(chunk_size))
         try:
-            # Build ESC/POS command sequence
-            commands = bytearray()
-            
-            # Initialize printer
-            commands.extend(ESCPOSCommands.INIT)
+            print(f"🔌 Connecting to printer at {self.ip_address}:{self.port}")
             
-            # Process each line
-            for line in lines:
-                text = line.get('text', '')
-                align = line.get('align', 'left')
-                bold = line.get('bold', False)
+            with socket.create_connection((self.ip_address, self.port), timeout=self.timeout) as sock:
+                print(f"✅ Connected to printer")
+                on_stage('connected')
                 
-                # Set alignment
-                if align == 'center':
-                    commands.extend(ESCPOSCommands.ALIGN_CENTER)
-                elif align == 'right':
-                    commands.extend(ESCPOSCommands.ALIGN_RIGHT)
-                else:
-                    commands.extend(ESCPOSCommands.ALIGN_LEFT)
+                total = 0
+                while True:
+                    count = readinto(buffer)
+                    if not count:
+                        break
+                    sock.sendall(buffer[:count])
+                    total += count
                 
-                # Set bold
-                if bold:
-                    commands.extend(ESCPOSCommands.BOLD_ON)
+                on_stage('sent')
+                print(f"📤 Streamed {total} bytes to printer")
+            
+            return True
+            
+        except socket.timeout:
+            print(f"❌ Timeout streaming to printer at {self.ip_address}:{self.port}")
+            return False
+        except ConnectionRefusedError:
+            print(f"❌ Connection refused by printer at {self.ip_address}:{self.port}")
+            return False
+        except Exception as e:
+            print(f"❌ Printer communication error: {e}")
+            return False
+    
+    def send_paced(self, chunks: Iterable[bytes], drain: Optional[DrainRate] = None,
+                   confirm: bool = False, on_stage: Callable[[str], None] = ignore_stage) -> bool:
+        """
+        Send rendered chunks without outrunning the printer's input buffer
+        
+        Data is only allowed PRINTER_BUFFER_SIZE bytes ahead of what the printer
+        should have drained at the estimated rate. With confirm, a status query is
+        sent every STATUS_CONFIRM_INTERVAL bytes; its reply means everything before
+        it was processed, which re-syncs pacing and refines the drain estimate. A last
+        query after the job reports 'acknowledged' when the printer has processed it all.
+        Without it the estimate is refined from the socket: once sends block the
+        printer is full and they go at its pace, and while pacing sends never block
+        the printer is at least as fast as the estimate.
+        """
+        drain = drain or DrainRate()
+        try:
+            print(f"🔌 Connecting to printer at {self.ip_address}:{self.port}")
+            
+            with socket.create_connection((self.ip_address, self.port), timeout=self.timeout) as sock:
+                print(f"✅ Connected to printer")
+                on_stage('connected')
+                if not confirm:
+                    # Keep little queued in the kernel, so a full printer blocks sendall
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, PRINTER_BUFFER_SIZE)
                 
-                # Add text (encode to bytes)
-                commands.extend(text.encode('utf-8', errors='ignore'))
+                total = 0
+                window_start = time.monotonic()
+                window_bytes = 0
+                # Socket measurement of the drain, used when confirm is off
+                measure_start, measure_bytes = window_start, 0
+                paced = blocked = False
                 
-                # Turn off bold
-                if bold:
-                    commands.extend(ESCPOSCommands.BOLD_OFF)
+                for chunk in chunks:
+                    # Hold back while the printer is still working through earlier data
+                    ahead = window_bytes - (time.monotonic() - window_start) * drain.bytes_per_sec
+                    if ahead > PRINTER_BUFFER_SIZE:
+                        time.sleep((ahead - PRINTER_BUFFER_SIZE) / drain.bytes_per_sec)
+                        paced = True
+                    
+                    send_start = time.monotonic()
+                    sock.sendall(chunk)
+                    now = time.monotonic()
+                    total += len(chunk)
+                    window_bytes += len(chunk)
+                    
+                    if confirm:
+                        if window_bytes >= STATUS_CONFIRM_INTERVAL:
+                            if self._confirm_drained(sock):
+                                drain.observe(window_bytes, time.monotonic() - window_start)
+                                window_start, window_bytes = time.monotonic(), 0
+                            else:
+                                print(f"⚠️ No status reply from printer, pacing by estimate only")
+                                confirm = False
+                                measure_start, measure_bytes, paced = time.monotonic(), 0, False
+                    elif now - send_start >= BACKPRESSURE_SECONDS and not blocked:
+                        # The printer is full: measure from here, leaving out what its buffer soaked up
+                        measure_start, measure_bytes, blocked = now, 0, True
+                    else:
+                        measure_bytes += len(chunk)
+                        if measure_bytes >= STATUS_CONFIRM_INTERVAL:
+                            if blocked:
+                                drain.observe(measure_bytes, now - measure_start)
+                            elif paced:
+                                drain.observe(measure_bytes, (now - measure_start) / DRAIN_PROBE)
+                            measure_start, measure_bytes, paced, blocked = now, 0, False, False
                 
-                # Add line feed
-                commands.extend(ESCPOSCommands.LF)
-            
-            # Add extra line feeds and cut
-            commands.extend(ESCPOSCommands.LF * 3)
-            commands.extend(ESCPOSCommands.CUT_PARTIAL)
+                on_stage('sent')
+                print(f"📤 Sent {total} bytes to printer")
+                
+                # The reply to a last status query means the printer has worked through the job
+                if confirm and self._confirm_drained(sock):
+                    drain.observe(window_bytes, time.monotonic() - window_start)
+                    on_stage('acknowledged')
             
-            # Send to printer
-            return self.send_raw_data(bytes(commands))
+            return True
             
+        except socket.timeout:
+            print(f"❌ Timeout sending to printer at {self.ip_address}:{self.port}")
+            return False
+        except ConnectionRefusedError:
+            print(f"❌ Connection refused by printer at {self.ip_address}:{self.port}")
+            return False
         except Exception as e:
-            print(f"❌ Error building print commands: {e}")
+            print(f"❌ Printer communication error: {e}")
             return False
     
+    def _confirm_drained(self, sock: socket.socket) -> bool:
+        """Send an in-order status query and wait for the reply"""
+        sock.sendall(ESCPOSCommands.STATUS_PAPER)
+        sock.settimeout(STATUS_REPLY_TIMEOUT)
+        try:
+            return bool(sock.recv(1))
+        except socket.timeout:
+            return False
+        finally:
+            sock.settimeout(self.timeout)
+    
+    def print_lines(self, lines: List[Dict[str, Any]], paper_width: int = 80,
+                    drain: Optional[DrainRate] = None, confirm: bool = False,
+                    on_stage: Callable[[str], None] = ignore_stage, codepage: Optional[str] = None) -> bool:
+        """Convert print lines to ESC/POS and send to printer"""
+        return self.send_paced(mark_rendered(iter_escpos(lines, paper_width, codepage=codepage), on_stage),
+                               drain, confirm, on_stage)
+    
     def test_connection(self) -> bool:
         """Test if printer is reachable"""
         try:
             print(f"🧪 Testing connection to {self.ip_address}:{self.port}")
             
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5)  # Short timeout for test
-            
-            result = sock.connect_ex((self.ip_address, self.port))
-            sock.close()
+            try:
+                # Short timeout for test
+                socket.create_connection((self.ip_address, self.port), timeout=5).close()
+                result = 0
+            except OSError as e:
+                result = e.errno or -1
             
             if result == 0:
                 print(f"✅ Printer is reachable at {self.ip_address}:{self.port}")
@@ -154,7 +378,9 @@ class IPPrinter:
             print(f"❌ Connection test failed: {e}")
             return False
 
-def print_to_ip_printer(ip_address: str, lines: List[Dict[str, Any]], paper_width: int = 80) -> bool:
+def print_to_ip_printer(ip_address: str, lines: List[Dict[str, Any]], paper_width: int = 80,
+                        drain: Optional[DrainRate] = None, confirm: bool = False,
+                        on_stage: Callable[[str], None] = ignore_stage, codepage: Optional[str] = None) -> bool:
     """
     Main function to print directly to IP printer
     
@@ -162,6 +388,9 @@ def print_to_ip_printer(ip_address: str, lines: List[Dict[str, Any]], paper_widt
         ip_address: IP address of the thermal printer
         lines: List of print lines with text, align, bold properties
         paper_width: Paper width in mm (58 or 80)
+        drain: Shared drain rate estimate for this printer, used to pace long jobs
+        confirm: Confirm progress with status queries during long jobs
+        on_stage: Called with 'connected', 'rendered', 'sent' and (confirmed) 'acknowledged' as the job progresses
     
     Returns:
         bool: True if print successful, False otherwise
@@ -182,7 +411,7 @@ def print_to_ip_printer(ip_address: str, lines: List[Dict[str, Any]], paper_widt
         return False
     
     # Print the job
-    success = printer.print_lines(lines, paper_width)
+    success = printer.print_lines(lines, paper_width, drain, confirm, on_stage, codepage)
     
     if success:
         print(f"✅ Print job sent successfully to {ip_address}")
@@ -192,6 +421,34 @@ def print_to_ip_printer(ip_address: str, lines: List[Dict[str, Any]], paper_widt
     print(f"========================\n")
     return success
 
+def stream_to_ip_printer(ip_address: str, readinto: Callable[[memoryview], int],
+                         on_stage: Callable[[str], None] = ignore_stage) -> bool:
+    """
+    Stream pre-rendered ESC/POS bytes directly to an IP printer
+    
+    Args:
+        ip_address: IP address of the thermal printer
+        readinto: Fills the given buffer and returns the byte count, 0 at end of data
+        on_stage: Called with 'connected' and 'sent' as the job progresses
+    
+    Returns:
+        bool: True if all data was sent, False otherwise
+    """
+    
+    print(f"\n🖨️ === RAW IP PRINTING ===")
+    print(f"🎯 Target: {ip_address}")
+    
+    printer = IPPrinter(ip_address)
+    
+    # Test connection first so a dead printer fails before any data is consumed
+    if not printer.test_connection():
+        print(f"❌ Cannot connect to printer - check IP address and network")
+        return False
+    
+    success = printer.send_stream(readinto, on_stage=on_stage)
+    print(f"========================\n")
+    return success
+
 # Test function
 def test_ip_printer(ip_address: str):
     """Test function to verify IP printer connectivity"""
@@ -213,8 +470,14 @@ def test_ip_printer(ip_address: str):
 if __name__ == "__main__":
     import sys
     
+    if len(sys.argv) > 1 and sys.argv[1] == '--bulk':
+        # Stream NDJSON jobs to many printers (see bulk_print.py)
+        from bulk_print import main
+        sys.exit(main(sys.argv[2:]))
+    
     if len(sys.argv) < 2:
         print("Usage: python3 ip_printer.py <printer_ip_address>")
+        print("       python3 ip_printer.py --bulk <jobs.ndjson | -> [--window N] [--output results.ndjson]")
         print("Example: python3 ip_printer.py 192.168.1.100")
         sys.exit(1)
     
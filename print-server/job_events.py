@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Job Event Module for EZDine
+Fans out print job state transitions and printer status changes to subscribers
+"""
+
+import collections
+import itertools
+import queue
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Events kept for clients that reconnect with Last-Event-ID
+REPLAY_SIZE = 200
+
+# Events buffered per subscriber before it is considered too slow and dropped
+SUBSCRIBER_BUFFER = 256
+
+Event = Tuple[int, str, Dict[str, Any]]
+
+
+class Subscription:
+    """One client's view of the event stream"""
+
+    def __init__(self, maxsize: int = SUBSCRIBER_BUFFER):
+        self.overflowed = False
+        self._queue: 'queue.Queue[Event]' = queue.Queue(maxsize)
+
+    def push(self, event: Event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        """Next event, or None if nothing arrived before the timeout"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """Publishes compact job and printer events to all subscribers"""
+
+    def __init__(self, replay_size: int = REPLAY_SIZE):
+        self._subscribers: List[Subscription] = []
+        self._recent: Deque[Event] = collections.deque(maxlen=replay_size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def publish(self, kind: str, data: Dict[str, Any]):
+        with self._lock:
+            event = (next(self._ids), kind, {**data, 't': round(time.time(), 3)})
+            self._recent.append(event)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Subscription:
+        """Register a subscriber, replaying buffered events newer than last_event_id"""
+        subscription = Subscription()
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._recent:
+                    if event[0] > last_event_id:
+                        subscription.push(event)
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Job History Module for EZDine
+Keeps every print result in a local SQLite file for reconciliation and audits, written
+in batches off the request path and read back in time order by GET /jobs/export
+"""
+
+import csv
+import datetime
+import io
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from app_paths import APP_DIR
+
+# History file (set EZDINE_JOB_HISTORY empty to keep no history)
+HISTORY_PATH = os.environ.get('EZDINE_JOB_HISTORY', os.path.join(APP_DIR, 'job_history.sqlite'))
+
+# Days a job is kept before it is pruned
+RETENTION_DAYS = float(os.environ.get('EZDINE_JOB_HISTORY_DAYS', 90))
+
+# Most jobs written per transaction, and rows per chunk of an export
+WRITE_BATCH = 500
+EXPORT_BATCH = 500
+
+# Seconds between prunes of expired jobs
+PRUNE_INTERVAL = 3600
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+# Export fields, in CSV column order, and the column each comes from
+FIELDS = (('id', 'id'), ('jobId', 'job_id'), ('created', 'created'), ('finished', 'finished'),
+          ('printerId', 'target'), ('printer', 'printer'), ('type', 'type'), ('documentId', 'document_id'),
+          ('traceId', 'trace_id'), ('success', 'success'), ('message', 'message'), ('lines', 'lines'),
+          ('bytes', 'bytes'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER,
+    created REAL NOT NULL,
+    finished REAL NOT NULL,
+    target TEXT NOT NULL,
+    printer TEXT,
+    type TEXT,
+    document_id TEXT,
+    trace_id TEXT,
+    success INTEGER NOT NULL,
+    message TEXT,
+    lines INTEGER,
+    bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created);
+CREATE INDEX IF NOT EXISTS jobs_target ON jobs (target, created);
+CREATE INDEX IF NOT EXISTS jobs_printer ON jobs (printer, created);
+"""
+
+INSERT = ('INSERT INTO jobs (job_id, created, finished, target, printer, type, document_id, trace_id, '
+          'success, message, lines, bytes) VALUES (:job_id, :created, :finished, :target, :printer, :type, '
+          ':document_id, :trace_id, :success, :message, :lines, :bytes)')
+
+COLUMNS = ', '.join(column for _, column in FIELDS)
+
+
+class JobHistory:
+    """Print results in a SQLite file, appended by one writer thread and read by exports"""
+
+    def __init__(self, path: str = HISTORY_PATH, retention_days: float = RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self.written = 0
+        self._queue: 'queue.Queue[Dict[str, Any]]' = queue.Queue()
+        db = self._connect()
+        # WAL lets exports read while the writer appends
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(SCHEMA)
+        db.close()
+        self._writer = threading.Thread(target=self._run, name='job-history', daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def record(self, target: str, success: bool, created: float, printer: Optional[str] = None,
+               message: str = '', job_id: Optional[int] = None, job_type: Optional[str] = None,
+               document_id: Optional[str] = None, trace_id: Optional[str] = None,
+               lines: Optional[int] = None, size: Optional[int] = None):
+        """Queue a finished job for writing; never waits on the disk"""
+        self._queue.put({'job_id': job_id, 'created': created, 'finished': time.time(), 'target': target,
+                         'printer': printer, 'type': job_type, 'document_id': document_id,
+                         'trace_id': trace_id, 'success': int(success), 'message': message,
+                         'lines': lines, 'bytes': size})
+
+    def record_task(self, target: str, task: Any, created: float, job_type: Optional[str] = None,
+                    document_id: Any = None, size: Optional[int] = None, cancelled: Optional[str] = None):
+        """
+        Queue a print queue task's result, from its on_done once it has printed or failed
+
+        A task withdrawn before it was sent is recorded as failed with the cancelled
+        message instead, as it never reaches on_done.
+        """
+        self.record(target, task.success and cancelled is None, created,
+                    None if cancelled is not None else task.printer,
+                    f"Cancelled: {cancelled}" if cancelled is not None else task.message, task.job_id, job_type,
+                    None if document_id is None else str(document_id),
+                    task.trace.trace_id if task.trace is not None else None,
+                    len(task.lines) if task.lines else None, size)
+
+    def _run(self):
+        db = self._connect()
+        db.execute('PRAGMA synchronous=NORMAL')
+        last_prune = 0.0
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with db:
+                    db.execute('BEGIN')
+                    db.executemany(INSERT, batch)
+                self.written += len(batch)
+                if time.time() - last_prune >= PRUNE_INTERVAL:
+                    last_prune = time.time()
+                    db.execute('DELETE FROM jobs WHERE created < ?', (last_prune - self.retention_days * 86400,))
+            except sqlite3.Error as e:
+                print(f"⚠️ Could not write {len(batch)} jobs to history: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Wait until every recorded job is on disk"""
+        self._queue.join()
+
+    def query(self, since: float = 0.0, until: float = float('inf'),
+              printer: Optional[str] = None) -> Iterator[List[sqlite3.Row]]:
+        """
+        Batches of jobs created in [since, until), oldest first, optionally for one printer
+
+        printer matches the printerId a job was sent to or the printer that took it, so a
+        group member's jobs are found either way. Rows are fetched a batch at a time through
+        the time and printer indexes, so memory doesn't grow with the range.
+        """
+        db = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, timeout=10)
+        db.row_factory = sqlite3.Row
+        try:
+            if printer is None:
+                cursor = db.execute(f'SELECT {COLUMNS} FROM jobs WHERE created >= ? AND created < ? '
+                                    'ORDER BY created', (since, until))
+            else:
+                # Two index searches merged in time order, rather than OR and a sort
+                cursor = db.execute(
+                    f'SELECT {COLUMNS} FROM jobs WHERE target = ? AND created >= ? AND created < ? '
+                    f'UNION ALL SELECT {COLUMNS} FROM jobs WHERE printer = ? AND target != ? '
+                    'AND created >= ? AND created < ? ORDER BY created',
+                    (printer, since, until, printer, printer, since, until))
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            db.close()
+
+    def export(self, fmt: str, since: float = 0.0, until: float = float('inf'),
+               printer: Optional[str] = None) -> Iterator[bytes]:
+        """Jobs as NDJSON or CSV, one encoded chunk per batch"""
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(name for name, _ in FIELDS)
+            for rows in self.query(since, until, printer):
+                writer.writerows(_export_row(row).values() for row in rows)
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+            # The header alone, for a range with no jobs
+            if buffer.tell():
+                yield buffer.getvalue().encode('utf-8')
+        else:
+            for rows in self.query(since, until, printer):
+                yield ''.join(json.dumps(_export_row(row)) + '\n' for row in rows).encode('utf-8')
+
+    def status(self) -> Dict[str, Any]:
+        return {'path': self.path, 'written': self.written, 'pending': self._queue.qsize()}
+
+
+def _export_row(row: sqlite3.Row) -> Dict[str, Any]:
+    out = {name: row[column] for name, column in FIELDS}
+    out['created'] = _isoformat(out['created'])
+    out['finished'] = _isoformat(out['finished'])
+    out['success'] = bool(out['success'])
+    return out
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp).isoformat(timespec='milliseconds')
+
+
+def parse_time(value: str) -> float:
+    """Epoch seconds from epoch seconds or a local ISO 8601 date or time, raises ValueError"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.datetime.fromisoformat(value).timestamp()
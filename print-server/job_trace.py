@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Job Trace Module for EZDine
+Trace ids and per-stage timings for print jobs
+"""
+
+import os
+import re
+import time
+from typing import Dict, Mapping, Optional
+
+# Stages a print job passes through, in order
+STAGES = ('received', 'parsed', 'queued', 'dequeued', 'connected', 'rendered', 'sent', 'acknowledged')
+
+TRACEPARENT_PATTERN = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$')
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+
+def trace_id_from_headers(headers: Mapping[str, str]) -> str:
+    """Reuse the caller's W3C traceparent or X-Request-Id, or start a new trace"""
+    match = TRACEPARENT_PATTERN.match((headers.get('traceparent') or '').strip().lower())
+    if match and match.group(1) != '0' * 32:
+        return match.group(1)
+    request_id = (headers.get('X-Request-Id') or '').strip()
+    if REQUEST_ID_PATTERN.match(request_id):
+        return request_id
+    return os.urandom(16).hex()
+
+
+class JobTrace:
+    """Monotonic stage timestamps for one job, reported in ms since it was received"""
+
+    def __init__(self, trace_id: str, received: Optional[float] = None):
+        self.trace_id = trace_id
+        self.received = received if received is not None else time.monotonic()
+        # Shared with the job record so /jobs/{id} sees stages as they happen
+        self.stages: Dict[str, float] = {'received': 0.0}
+
+    def mark(self, stage: str):
+        self.stages[stage] = round((time.monotonic() - self.received) * 1000, 3)
+
+    def as_dict(self) -> Dict[str, object]:
+        return {'traceId': self.trace_id, 'stages': dict(self.stages)}
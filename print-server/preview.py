@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Receipt Preview Module for EZDine
+Decodes the ESC/POS bytes a job would send into plain text or a monochrome PNG at the
+printer's dot width, so layouts can be checked without wasting paper
+"""
+
+import collections
+import hashlib
+import os
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+from ip_printer import CODEPAGES
+
+# Printable dots per line at 203 dpi, by paper width in mm
+DOT_WIDTHS = {58: 384, 80: 576}
+
+# Font A character cell in dots, and the default line pitch (ESC 2)
+CHAR_WIDTH = 12
+CHAR_HEIGHT = 24
+LINE_PITCH = 30
+
+# Rendered previews kept for re-renders while settings are being tweaked
+PREVIEW_CACHE_ENTRIES = int(os.environ.get('EZDINE_PREVIEW_CACHE', 64))
+
+# TrueType font for PNG previews; otherwise the first system monospace font found, then Pillow's own
+PREVIEW_FONT = os.environ.get('EZDINE_PREVIEW_FONT', '')
+SYSTEM_FONTS = ('DejaVuSansMono.ttf', 'LiberationMono-Regular.ttf', 'Menlo.ttc', 'consola.ttf')
+
+PREVIEW_FORMATS = ('png', 'text')
+
+# Parameter bytes following the ESC and GS commands the decoder skips or interprets
+ESC_PARAMS = {b'@': 0, b'!': 1, b'-': 1, b'2': 0, b'3': 1, b'E': 1, b'G': 1, b'J': 1, b'M': 1,
+              b'a': 1, b'd': 1, b't': 1, b'p': 3, b'{': 1, b'R': 1, b'V': 1}
+GS_PARAMS = {b'!': 1, b'B': 1, b'H': 1, b'I': 1, b'L': 2, b'W': 2, b'a': 1, b'f': 1, b'h': 1,
+             b'r': 1, b'w': 1}
+ALIGNMENTS = {0: 'left', 1: 'center', 2: 'right', 48: 'left', 49: 'center', 50: 'right'}
+CODEPAGE_NAMES = {number: name for name, number in CODEPAGES.items()}
+
+
+class Run(NamedTuple):
+    text: str
+    bold: bool = False
+    width: int = 1
+    height: int = 1
+
+
+class PreviewUnavailable(Exception):
+    """PNG previews need Pillow, which the bridge doesn't require"""
+
+
+def paper_size(paper_width: int) -> int:
+    """The known paper width a requested width is laid out as"""
+    if paper_width in DOT_WIDTHS:
+        return paper_width
+    return 80 if paper_width >= 80 else 58
+
+
+def dot_width(paper_width: int) -> int:
+    return DOT_WIDTHS[paper_size(paper_width)]
+
+
+class _Decoder:
+    """Interprets an ESC/POS stream into lines of styled text runs, cuts and raster images"""
+
+    def __init__(self):
+        self.elements: List[Tuple[Any, ...]] = []
+        self._reset()
+        self._line_align = 'left'
+        self._runs: List[Run] = []
+        self._pending = bytearray()
+
+    def _reset(self):
+        self._bold = False
+        self._size = (1, 1)
+        self._encoding = 'utf-8'
+        self._align = 'left'
+
+    def _flush_text(self):
+        if self._pending:
+            text = bytes(self._pending).decode(self._encoding, errors='replace')
+            self._runs.append(Run(text, self._bold, *self._size))
+            self._pending.clear()
+
+    def _style(self):
+        # Style changes start a new run for the text that follows
+        self._flush_text()
+
+    def _line_feed(self):
+        self._flush_text()
+        self.elements.append(('line', self._line_align, self._runs))
+        self._runs = []
+        self._line_align = self._align
+
+    def decode(self, data: bytes) -> List[Tuple[Any, ...]]:
+        i, end = 0, len(data)
+        while i < end:
+            byte = data[i:i + 1]
+            if byte == b'\n':
+                self._line_feed()
+                i += 1
+            elif byte == b'\x1b' and i + 1 < end:
+                i = self._escape(data, i + 2, data[i + 1:i + 2])
+            elif byte == b'\x1d' and i + 1 < end:
+                i = self._group(data, i + 2, data[i + 1:i + 2])
+            elif byte == b'\x10' and i + 1 < end and data[i + 1] == 0x04:
+                i += 3  # real-time status query, prints nothing
+            elif byte[0] < 0x20:
+                i += 1  # other control bytes print nothing
+            else:
+                if not self._pending and not self._runs:
+                    self._line_align = self._align
+                self._pending.append(byte[0])
+                i += 1
+        if self._pending or self._runs:
+            self._line_feed()
+        return self.elements
+
+    def _escape(self, data: bytes, i: int, command: bytes) -> int:
+        count = ESC_PARAMS.get(command, 0)
+        params = data[i:i + count]
+        if len(params) < count:
+            return len(data)
+        if command == b'@':
+            self._style()
+            self._reset()
+        elif command == b'E' or command == b'G':
+            self._style()
+            self._bold = bool(params[0] & 1)
+        elif command == b'a':
+            self._align = ALIGNMENTS.get(params[0], 'left')
+        elif command == b't':
+            self._style()
+            self._encoding = CODEPAGE_NAMES.get(params[0], 'cp437')
+        elif command == b'!':
+            self._style()
+            self._bold = bool(params[0] & 0x08)
+            self._size = (2 if params[0] & 0x20 else 1, 2 if params[0] & 0x10 else 1)
+        elif command == b'd':
+            self._line_feed()
+            self.elements.extend(('line', 'left', []) for _ in range(params[0] - 1))
+        return i + count
+
+    def _group(self, data: bytes, i: int, command: bytes) -> int:
+        if command == b'V':
+            # GS V m, with a feed amount after m for the 'feed and cut' forms
+            self._flush_text()
+            if self._runs:
+                self._line_feed()
+            self.elements.append(('cut',))
+            return i + (2 if i < len(data) and data[i] >= 65 else 1)
+        if command == b'v' and data[i:i + 1] == b'0':
+            # GS v 0 m xL xH yL yH, then xL+xH*256 bytes by yL+yH*256 rows of raster data
+            header = data[i + 1:i + 6]
+            if len(header) < 5:
+                return len(data)
+            width_bytes, rows = header[1] + header[2] * 256, header[3] + header[4] * 256
+            start = i + 6
+            self._flush_text()
+            if self._runs:
+                self._line_feed()
+            self.elements.append(('image', width_bytes, rows, data[start:start + width_bytes * rows]))
+            return start + width_bytes * rows
+        count = GS_PARAMS.get(command, 0)
+        params = data[i:i + count]
+        if command == b'!' and params:
+            self._style()
+            self._size = ((params[0] >> 4 & 0x07) + 1, (params[0] & 0x07) + 1)
+        return i + count
+
+
+def decode_escpos(data: bytes) -> List[Tuple[Any, ...]]:
+    """('line', align, runs), ('cut',) and ('image', width_bytes, rows, bits) elements"""
+    return _Decoder().decode(data)
+
+
+def _wrap(runs: List[Run], columns: int) -> List[List[Run]]:
+    """Split a line where the printer would wrap it, counting double width characters twice"""
+    rows: List[List[Run]] = [[]]
+    used = 0
+    for run in runs:
+        text = run.text
+        while text:
+            fit = max(0, (columns - used) // run.width)
+            if fit == 0:
+                rows.append([])
+                used = 0
+                fit = max(1, columns // run.width)
+            rows[-1].append(run._replace(text=text[:fit]))
+            used += len(text[:fit]) * run.width
+            text = text[fit:]
+    return rows
+
+
+def _layout(elements: Iterable[Tuple[Any, ...]], columns: int):
+    """Wrapped rows as (align, runs, columns used), with cuts and images passed through"""
+    for element in elements:
+        if element[0] != 'line':
+            yield element
+            continue
+        for runs in _wrap(element[2], columns):
+            yield ('row', element[1], runs, sum(len(run.text) * run.width for run in runs))
+
+
+def render_text(data: bytes, paper_width: int = 80) -> str:
+    """Plain text preview, one character per column"""
+    columns = dot_width(paper_width) // CHAR_WIDTH
+    out = []
+    for element in _layout(decode_escpos(data), columns):
+        if element[0] == 'cut':
+            out.append(' cut '.center(columns, '-'))
+        elif element[0] == 'image':
+            out.append(f"[image {element[1] * 8}x{element[2]}]".center(columns))
+        else:
+            _, align, runs, used = element
+            text = ''.join(''.join(char * run.width for char in run.text) for run in runs)
+            pad = columns - used
+            out.append((' ' * (pad // 2 if align == 'center' else pad if align == 'right' else 0) + text).rstrip())
+    return '\n'.join(out) + '\n'
+
+
+def _load_font(ImageFont):
+    for name in ((PREVIEW_FONT,) if PREVIEW_FONT else SYSTEM_FONTS):
+        try:
+            return ImageFont.truetype(name, CHAR_HEIGHT - 4)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=CHAR_HEIGHT - 4)
+    except TypeError:
+        return ImageFont.load_default()  # Pillow before 10.1
+
+
+def render_png(data: bytes, paper_width: int = 80) -> bytes:
+    """Monochrome PNG preview at the printer's dot width (needs Pillow)"""
+    try:
+        from PIL import Image, ImageDraw, ImageFont
+    except ImportError:
+        raise PreviewUnavailable('PNG preview needs Pillow (pip install pillow); use format=text')
+    import io
+
+    width = dot_width(paper_width)
+    columns = width // CHAR_WIDTH
+    font = _load_font(ImageFont)
+    top = font.getbbox('Ay')[1]
+    glyphs: Dict[Tuple[str, bool, int, int], Any] = {}
+
+    def glyph(run: Run, char: str):
+        # Each character drawn centred in its own cell, so columns line up like on paper
+        key = (char, run.bold, run.width, run.height)
+        if key not in glyphs:
+            cell = Image.new('1', (CHAR_WIDTH, CHAR_HEIGHT), 1)
+            draw = ImageDraw.Draw(cell)
+            left, _, right, _ = font.getbbox(char)
+            x = (CHAR_WIDTH - (right - left)) // 2 - left
+            for offset in ((0, 1) if run.bold else (0,)):
+                draw.text((x + offset, 2 - top), char, font=font, fill=0)
+            if run.width > 1 or run.height > 1:
+                cell = cell.resize((CHAR_WIDTH * run.width, CHAR_HEIGHT * run.height), Image.NEAREST)
+            glyphs[key] = cell
+        return glyphs[key]
+
+    # Lay everything out first so the image is created at its final height
+    placed = []
+    y = LINE_PITCH // 2
+    for element in _layout(decode_escpos(data), columns):
+        if element[0] == 'cut':
+            placed.append((element, y))
+            y += LINE_PITCH
+        elif element[0] == 'image':
+            placed.append((element, y))
+            y += element[2]
+        else:
+            height = max((run.height for run in element[2]), default=1)
+            placed.append((element, y + (height - 1) * CHAR_HEIGHT))
+            y += LINE_PITCH + (height - 1) * CHAR_HEIGHT
+
+    image = Image.new('1', (width, y + LINE_PITCH // 2), 1)
+    draw = ImageDraw.Draw(image)
+    for element, y in placed:
+        if element[0] == 'cut':
+            for x in range(0, width, 16):
+                draw.line((x, y + LINE_PITCH // 2, x + 8, y + LINE_PITCH // 2), fill=0)
+        elif element[0] == 'image':
+            _, width_bytes, rows, bits = element
+            # ESC/POS raster bits are 1 for black, Pillow's '1' mode uses 1 for white
+            raster = Image.frombytes('1', (width_bytes * 8, rows), bytes(~b & 0xff for b in bits).ljust(
+                width_bytes * rows, b'\xff'))
+            image.paste(raster, (0, y))
+        else:
+            _, align, runs, used = element
+            pad = (width - used * CHAR_WIDTH)
+            x = pad // 2 if align == 'center' else pad if align == 'right' else 0
+            for run in runs:
+                for char in run.text:
+                    cell = glyph(run, char)
+                    image.paste(cell, (x, y - (run.height - 1) * CHAR_HEIGHT))
+                    x += cell.width
+
+    out = io.BytesIO()
+    image.save(out, 'PNG', optimize=True)
+    return out.getvalue()
+
+
+class PreviewCache:
+    """Rendered previews by content hash of the ESC/POS bytes, least recently used dropped first"""
+
+    def __init__(self, max_entries: int = PREVIEW_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'collections.OrderedDict[str, bytes]' = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, data: bytes, paper_width: int, fmt: str) -> Tuple[bytes, str, bool]:
+        """(body, content hash, cache hit) for a preview of data in fmt"""
+        key = hashlib.sha256(data).hexdigest()[:32] + f'-{dot_width(paper_width)}-{fmt}'
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return body, key, True
+        body = render_png(data, paper_width) if fmt == 'png' else render_text(data, paper_width).encode('utf-8')
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = body
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return body, key, False
+
+
+preview_cache = PreviewCache()
@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+"""
+Print Queue Module for EZDine
+Per-printer job queues, circuit breakers and load-balanced printer groups
+"""
+
+import itertools
+import json
+import math
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from ip_printer import RENDER_CHUNK_SIZE, iter_escpos, mark_rendered
+from printer_registry import registry
+from throughput import JobCost, ThroughputModel, line_cost, stream_cost
+from transports import describe_target, get_transport, lookup_transport
+
+# Group dispatch strategies
+STRATEGY_EARLIEST_FINISH = 'earliest-finish'
+STRATEGY_SHORTEST_QUEUE = 'shortest-queue'
+STRATEGY_ROUND_ROBIN = 'round-robin'
+STRATEGIES = (STRATEGY_EARLIEST_FINISH, STRATEGY_SHORTEST_QUEUE, STRATEGY_ROUND_ROBIN)
+
+# Backpressure: most jobs one printer may have waiting, and most across all printers
+MAX_PRINTER_QUEUE = int(os.environ.get('EZDINE_MAX_PRINTER_QUEUE', 20))
+MAX_TOTAL_QUEUE = int(os.environ.get('EZDINE_MAX_QUEUED_JOBS', 200))
+
+# Assumed seconds per job until a printer has completed some
+DEFAULT_JOB_SECONDS = 2.0
+
+# Callback receiving (kind, data) for job state transitions and printer status changes
+EventCallback = Callable[[str, Dict[str, Any]], None]
+
+
+def _ignore_event(kind: str, data: Dict[str, Any]):
+    pass
+
+
+class CircuitBreaker:
+    """Stops sending to a printer after repeated failures until it cools down"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        # The one job let through while half-open, and when it was let through
+        self._probe: Any = None
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.failures < self.failure_threshold:
+                return self.CLOSED
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self.OPEN
+
+    def allow(self, probe: Any = None) -> bool:
+        """
+        True if a job may be sent: always while closed, and while half-open only for one
+        probe at a time (the same probe may ask again). A probe that never reports back
+        is given up on after reset_timeout, so another can go.
+        """
+        with self._lock:
+            if self.failures < self.failure_threshold:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            if self._probe is not None and self._probe is not probe and now - self._probe_at < self.reset_timeout:
+                return False
+            self._probe, self._probe_at = probe if probe is not None else object(), now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probe = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe = None
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class QueueFull(Exception):
+    """Raised when a job is shed because a queue limit is reached"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PrintTask:
+    """A print job travelling through the printer queues"""
+
+    def __init__(self, job_id: int, lines: List[Dict[str, Any]], paper_width: int = 80,
+                 group: Optional[str] = None, raw_source: Any = None, trace: Any = None,
+                 on_done: Optional[Callable[['PrintTask'], None]] = None, cost: Optional[JobCost] = None,
+                 rendered: Optional[List[bytes]] = None):
+        self.job_id = job_id
+        self.lines = lines
+        self.paper_width = paper_width
+        self.group = group
+        # Pre-rendered ESC/POS source with readinto() and a consumed byte count
+        self.raw_source = raw_source
+        # Already rendered ESC/POS held in memory (a reprint), paced like lines and resent whole on retry
+        self.rendered = rendered
+        # JobTrace collecting stage timings, if the submitter wants them
+        self.trace = trace
+        # Called on the printer worker thread once the job has printed or failed
+        self.on_done = on_done
+        # What the job asks of the printer, for the throughput model (raw streams pass their own)
+        self.cost = cost or (line_cost(lines) if raw_source is None and rendered is None else stream_cost(0))
+        # Set to a list to collect the ESC/POS chunks of the attempt that printed the lines
+        self.sent: Optional[List[bytes]] = None
+        # Monotonic time each stage was last reached, for timing the printer itself
+        self.marks: Dict[str, float] = {}
+        # Expected seconds the printer itself takes, and seconds from queueing to finished
+        self.print_seconds = 0.0
+        self.eta_seconds = 0.0
+        self.attempted: List[str] = []
+        self.success = False
+        self.message = ''
+        self.printer: Optional[str] = None
+        self._done = threading.Event()
+        self._state_lock = threading.Lock()
+        self._started = False
+        self._cancelled = False
+
+    def mark(self, stage: str):
+        """Record that the job reached a stage"""
+        self.marks[stage] = time.monotonic()
+        if self.trace is not None:
+            self.trace.mark(stage)
+
+    @property
+    def retryable(self) -> bool:
+        """False once a raw stream has been partly sent and can't be replayed"""
+        return self.raw_source is None or not self.raw_source.consumed
+
+    def start(self) -> bool:
+        """Claim the task for sending; False if the submitter already gave up on it"""
+        with self._state_lock:
+            if self._cancelled:
+                return False
+            self._started = True
+            return True
+
+    def cancel(self) -> bool:
+        """Withdraw a task that hasn't started sending; False if it is already in flight"""
+        with self._state_lock:
+            if self._started:
+                return False
+            self._cancelled = True
+            return True
+
+    def finish(self, success: bool, printer: Optional[str], message: str):
+        self.success = success
+        self.printer = printer
+        self.message = message
+        self._done.set()
+        if self.on_done is not None:
+            self.on_done(self)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the job has printed or failed; False on timeout"""
+        return self._done.wait(timeout)
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+
+def send_task(address: str, task: PrintTask) -> bool:
+    """Send a task's lines, rendered bytes or raw stream through the printer's transport"""
+    # Named printers are resolved at send time, so queued jobs follow a re-pointed printer
+    entry = registry.get(address)
+    paper_width, codepage = task.paper_width, None
+    if entry is not None:
+        address, paper_width, codepage = entry.target, entry.width or paper_width, entry.codepage
+    transport = get_transport(address)
+    if transport is None:
+        raise ValueError(f"Unknown printer target {address}")
+    if task.raw_source is not None:
+        return transport.send_stream(task.raw_source.readinto, task.mark)
+    if task.rendered is not None:
+        return transport.send_chunks(_slices(task.rendered, RENDER_CHUNK_SIZE), task.mark)
+    if task.sent is not None:
+        # Render here so the exact bytes sent are kept; a failed-over retry starts afresh
+        task.sent.clear()
+        chunks = _keep(iter_escpos(task.lines, paper_width, codepage=codepage), task.sent)
+        return transport.send_chunks(mark_rendered(chunks, task.mark), task.mark)
+    return transport.print_lines(task.lines, paper_width, task.mark, codepage)
+
+
+def _slices(chunks: Iterable[bytes], size: int) -> Iterator[memoryview]:
+    """Cut chunks into pieces of at most size bytes without copying, so pacing sees each piece"""
+    for chunk in chunks:
+        view = memoryview(chunk)
+        for start in range(0, len(view), size):
+            yield view[start:start + size]
+
+
+def _keep(chunks: Iterable[bytes], kept: List[bytes]) -> Iterator[bytes]:
+    """Pass chunks through, adding each to kept"""
+    for chunk in chunks:
+        kept.append(chunk)
+        yield chunk
+
+
+class PrinterQueue:
+    """Serialises jobs for one printer on a dedicated worker thread"""
+
+    def __init__(self, address: str, send: Callable[[str, PrintTask], bool],
+                 on_failure: Optional[Callable[['PrintTask', 'PrinterQueue'], bool]] = None,
+                 on_event: EventCallback = _ignore_event):
+        self.address = address
+        self.label = describe_target(address)
+        self.breaker = CircuitBreaker()
+        self.sent = 0
+        self.failed = 0
+        self.shed = 0
+        # Moving average of how long one job occupies the printer
+        self.job_seconds = DEFAULT_JOB_SECONDS
+        # Per-job timing model, and the expected seconds of jobs waiting behind the current one
+        self.model = ThroughputModel()
+        self._waiting_seconds = 0.0
+        self._current_seconds = 0.0
+        self._current_started = 0.0
+        self._send = send
+        self._on_failure = on_failure
+        self._on_event = on_event
+        self._queue: 'queue.Queue[PrintTask]' = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name=f'printer-{address}', daemon=True)
+        self._worker.start()
+
+    @property
+    def depth(self) -> int:
+        """Jobs waiting or currently printing"""
+        with self._lock:
+            return self._pending
+
+    def drain_seconds(self, jobs: int) -> float:
+        """Estimated time for this printer to work through the given number of jobs"""
+        return jobs * self.job_seconds
+
+    def _backlog_seconds(self) -> float:
+        # Call with self._lock held
+        remaining = 0.0
+        if self._current_seconds:
+            remaining = max(0.0, self._current_seconds - (time.monotonic() - self._current_started))
+        return self._waiting_seconds + remaining
+
+    @property
+    def backlog_seconds(self) -> float:
+        """Expected seconds until the printer has finished every job it has now"""
+        with self._lock:
+            return self._backlog_seconds()
+
+    def expected_finish(self, cost: JobCost) -> float:
+        """Expected seconds until a job of this cost would finish if queued here now"""
+        return self.backlog_seconds + self.model.estimate(cost)
+
+    def submit(self, task: PrintTask):
+        task.print_seconds = self.model.estimate(task.cost)
+        with self._lock:
+            self._pending += 1
+            task.eta_seconds = self._backlog_seconds() + task.print_seconds
+            self._waiting_seconds += task.print_seconds
+        task.attempted.append(self.address)
+        task.mark('queued')
+        self._on_event('job', {'job': task.job_id, 'state': 'queued', 'printer': self.address,
+                               'etaSeconds': round(task.eta_seconds, 2)})
+        self._queue.put(task)
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            with self._lock:
+                self._waiting_seconds = max(0.0, self._waiting_seconds - task.print_seconds)
+                self._current_seconds, self._current_started = task.print_seconds, time.monotonic()
+            try:
+                self._process(task)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    self._current_seconds = 0.0
+
+    def _process(self, task: PrintTask):
+        if not task.start():
+            return
+        task.mark('dequeued')
+
+        breaker_state = self.breaker.state
+        if not self.breaker.allow(task):
+            success, message = False, f"Printer {self.address} circuit open, skipping"
+        else:
+            self._on_event('job', {'job': task.job_id, 'state': 'printing', 'printer': self.address})
+            started = time.monotonic()
+            try:
+                success = self._send(self.address, task)
+                message = (f"Successfully printed to {self.label}" if success
+                           else f"Failed to print to {self.label}")
+            except Exception as e:
+                success, message = False, f"IP printing error: {str(e)}"
+            elapsed = time.monotonic() - started
+            self.job_seconds = 0.8 * self.job_seconds + 0.2 * elapsed
+            printing = task.marks.get('acknowledged', 0.0) - task.marks.get('connected', started)
+            if success and 'acknowledged' in task.marks and printing > 0:
+                # Only a printer's own reply (status confirm) times the printer. Without one a send
+                # ends when pacing or the socket buffer lets it, and failures end at a timeout or
+                # refusal; neither says anything about print speed
+                self.model.observe(task.cost, printing)
+
+            if success:
+                self.breaker.record_success()
+                self.sent += 1
+            else:
+                self.breaker.record_failure()
+                self.failed += 1
+
+            if self.breaker.state != breaker_state:
+                self._on_event('printer', {'printer': self.address, 'breaker': self.breaker.state,
+                                           'queued': self.depth - 1})
+
+        if success:
+            if 'acknowledged' not in task.marks:
+                task.mark('acknowledged')
+            task.finish(True, self.address, message)
+            self._on_event('job', {'job': task.job_id, 'state': 'printed', 'printer': self.address})
+        elif not (self._on_failure and self._on_failure(task, self)):
+            task.finish(False, self.address, message)
+            self._on_event('job', {'job': task.job_id, 'state': 'failed', 'printer': self.address,
+                                   'error': message})
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'address': self.address,
+            'queued': self.depth,
+            'backlogSeconds': round(self.backlog_seconds, 2),
+            'model': self.model.status(),
+            'breaker': self.breaker.state,
+            'sent': self.sent,
+            'failed': self.failed,
+            'shed': self.shed
+        }
+
+
+class PrinterGroup:
+    """Named set of interchangeable printers"""
+
+    def __init__(self, name: str, members: List[str], strategy: str = STRATEGY_EARLIEST_FINISH):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown group strategy '{strategy}' for group '{name}'")
+        if not members:
+            raise ValueError(f"Printer group '{name}' has no members")
+        self.name = name
+        self.members = list(members)
+        self.strategy = strategy
+        self._rotation = itertools.cycle(range(len(self.members)))
+        self._lock = threading.Lock()
+
+    def pick(self, queues: List[PrinterQueue], exclude: List[str] = (),
+             cost: Optional[JobCost] = None, probe: Any = None) -> Optional[PrinterQueue]:
+        """
+        Choose the member queue for the next job, skipping excluded and tripped printers
+
+        A half-open member is only chosen if the job can be its one probe (see
+        CircuitBreaker.allow, given probe), otherwise the next best member is.
+        """
+        candidates = [q for q in queues if q.address not in exclude]
+        if not candidates:
+            return None
+
+        with self._lock:
+            start = next(self._rotation)
+        # Rotate so ties (and round-robin) spread across members
+        ordered = sorted(candidates, key=lambda q: (self.members.index(q.address) - start) % len(self.members))
+
+        if self.strategy == STRATEGY_EARLIEST_FINISH and cost is not None:
+            # A fast printer with a longer queue can still finish first
+            ordered.sort(key=lambda q: q.expected_finish(cost))
+        elif self.strategy != STRATEGY_ROUND_ROBIN:
+            ordered.sort(key=lambda q: q.depth)
+        # Sorting is stable, so ties keep the rotation
+        return next((q for q in ordered if q.breaker.allow(probe)), None)
+
+
+class PrintDispatcher:
+    """Routes print tasks to printer queues and printer groups"""
+
+    def __init__(self, send: Callable[[str, PrintTask], bool] = send_task,
+                 on_event: EventCallback = _ignore_event):
+        self._send = send
+        self._on_event = on_event
+        self._queues: Dict[str, PrinterQueue] = {}
+        self._groups: Dict[str, PrinterGroup] = {}
+        self._lock = threading.Lock()
+        self.max_printer_queue = MAX_PRINTER_QUEUE
+        self.max_total_queue = MAX_TOTAL_QUEUE
+        self.shed = 0
+
+    def queue_for(self, address: str) -> PrinterQueue:
+        with self._lock:
+            printer_queue = self._queues.get(address)
+            if printer_queue is None:
+                printer_queue = PrinterQueue(address, self._send, self._failover, self._on_event)
+                self._queues[address] = printer_queue
+            return printer_queue
+
+    def add_group(self, name: str, members: List[str], strategy: str = STRATEGY_EARLIEST_FINISH):
+        group = PrinterGroup(name, members, strategy)
+        with self._lock:
+            self._groups[name] = group
+        return group
+
+    def load_groups(self, path: str) -> int:
+        """Load printer groups from a JSON file, returns number of groups loaded"""
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+        groups = config.get('groups', {})
+        for name, spec in groups.items():
+            self.add_group(name, spec.get('members', []), spec.get('strategy', STRATEGY_EARLIEST_FINISH))
+        return len(groups)
+
+    def is_group(self, name: str) -> bool:
+        return name in self._groups
+
+    def is_target(self, target: str) -> bool:
+        """True if target is a group, a named printer or a printer address; nothing else gets a queue"""
+        return self.is_group(target) or registry.get(target) is not None or lookup_transport(target) is not None
+
+    def admit(self, target: str):
+        """Check queue limits before accepting a job for target, raises QueueFull to shed it"""
+        with self._lock:
+            queues = list(self._queues.values())
+        total = sum(q.depth for q in queues)
+
+        group = self._groups.get(target)
+        members = [self.queue_for(m) for m in group.members] if group else [self.queue_for(target)]
+        open_members = [q for q in members if q.depth < self.max_printer_queue]
+
+        if total >= self.max_total_queue:
+            # Busy printers drain in parallel, so combine their job rates
+            jobs_per_sec = sum(1 / q.job_seconds for q in queues if q.depth)
+            wait = (total - self.max_total_queue + 1) / jobs_per_sec if jobs_per_sec else DEFAULT_JOB_SECONDS
+            self._shed(members[0] if len(members) == 1 else None)
+            raise QueueFull(f"Print server is busy ({total} jobs queued)", _retry_after(wait))
+
+        if not open_members:
+            wait = min(q.drain_seconds(q.depth - self.max_printer_queue + 1) for q in members)
+            self._shed(members[0] if len(members) == 1 else None)
+            raise QueueFull(f"Print queue for {target} is full", _retry_after(wait))
+
+    def _shed(self, printer_queue: Optional[PrinterQueue]):
+        with self._lock:
+            self.shed += 1
+        if printer_queue is not None:
+            printer_queue.shed += 1
+
+    def submit(self, target: str, task: PrintTask) -> Optional[PrinterQueue]:
+        """Queue a task on a printer address or group; finishes the task if nothing can take it"""
+        group = self._groups.get(target)
+        if group is None:
+            printer_queue = self.queue_for(target)
+            if not printer_queue.breaker.allow(task):
+                self._reject(task, target, f"Printer {target} circuit open, skipping")
+                return None
+            printer_queue.submit(task)
+            return printer_queue
+
+        task.group = group.name
+        printer_queue = group.pick([self.queue_for(m) for m in group.members], task.attempted, task.cost, task)
+        if printer_queue is None:
+            self._reject(task, None, f"No available printer in group {group.name}")
+            return None
+        printer_queue.submit(task)
+        return printer_queue
+
+    def _reject(self, task: PrintTask, printer: Optional[str], message: str):
+        task.finish(False, printer, message)
+        self._on_event('job', {'job': task.job_id, 'state': 'failed', 'printer': printer, 'error': message})
+
+    def _failover(self, task: PrintTask, failed: PrinterQueue) -> bool:
+        """Re-route a failed group task to another member, True if re-queued"""
+        group = self._groups.get(task.group) if task.group else None
+        if group is None or not task.retryable:
+            return False
+
+        printer_queue = group.pick([self.queue_for(m) for m in group.members], task.attempted, task.cost, task)
+        if printer_queue is None:
+            return False
+
+        print(f"🔁 Job #{task.job_id}: {failed.address} failed, failing over to {printer_queue.address}")
+        printer_queue.submit(task)
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            queues = list(self._queues.values())
+            groups = list(self._groups.values())
+        return {
+            'shed': self.shed,
+            'printers': [q.status() for q in queues],
+            'groups': [{'name': g.name, 'strategy': g.strategy, 'members': g.members} for g in groups]
+        }
+
+
+def _retry_after(seconds: float) -> int:
+    """Whole seconds for a Retry-After header"""
+    return max(1, math.ceil(seconds))
+
+
+def load_default_groups(dispatcher: PrintDispatcher, base_dir: str) -> int:
+    """Load groups from EZDINE_PRINTER_GROUPS or printer_groups.json next to the server"""
+    path = os.environ.get('EZDINE_PRINTER_GROUPS') or os.path.join(base_dir, 'printer_groups.json')
+    if not os.path.exists(path):
+        return 0
+    return dispatcher.load_groups(path)
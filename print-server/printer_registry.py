@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Printer Registry Module for EZDine
+Maps the logical printer ids the web app sends (billing-1, kitchen-1) to a transport,
+address, paper width and codepage, reloading the file whenever it changes
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+from ip_printer import CODEPAGES
+from transports import parse_target
+
+# Seconds between checks of the registry file for changes
+RELOAD_INTERVAL = float(os.environ.get('EZDINE_REGISTRY_RELOAD', 1.0))
+
+# Target prefix for each transport name allowed in the registry
+TRANSPORT_PREFIXES = {'tcp': '', 'usb': 'usb:', 'file': 'file:'}
+
+
+class PrinterEntry(NamedTuple):
+    name: str
+    target: str
+    width: Optional[int] = None
+    codepage: Optional[str] = None
+
+
+def parse_entry(name: str, spec: Dict[str, object]) -> PrinterEntry:
+    """Validate one registry entry, raises ValueError with the printer's name"""
+    if not isinstance(spec, dict):
+        raise ValueError(f"Printer '{name}': expected an object with an address, not {type(spec).__name__}")
+    transport = spec.get('transport', 'tcp')
+    if not isinstance(transport, str) or transport not in TRANSPORT_PREFIXES:
+        raise ValueError(f"Printer '{name}': unknown transport '{transport}'")
+    target = TRANSPORT_PREFIXES[transport] + str(spec.get('address', ''))
+    if parse_target(target) is None:
+        raise ValueError(f"Printer '{name}': invalid {transport} address '{spec.get('address', '')}'")
+
+    codepage = spec.get('codepage')
+    if codepage is not None and (not isinstance(codepage, str) or codepage not in CODEPAGES):
+        raise ValueError(f"Printer '{name}': unsupported codepage '{codepage}' "
+                         f"(supported: {', '.join(sorted(CODEPAGES))})")
+    width = spec.get('width')
+    if width and (isinstance(width, bool) or not isinstance(width, (int, str)) or not str(width).isdigit()):
+        raise ValueError(f"Printer '{name}': width must be a number of mm, not '{width}'")
+    return PrinterEntry(name, target, int(width) if width else None, codepage)
+
+
+class PrinterRegistry:
+    """In-memory index of named printers, swapped whole on every reload"""
+
+    def __init__(self):
+        self.path: Optional[str] = None
+        self.error: Optional[str] = None
+        self._printers: Dict[str, PrinterEntry] = {}
+        self._signature = None
+        self._watcher: Optional[threading.Thread] = None
+
+    def get(self, name: str) -> Optional[PrinterEntry]:
+        return self._printers.get(name)
+
+    def __len__(self) -> int:
+        return len(self._printers)
+
+    def load(self, path: str) -> int:
+        """Load the registry file, returns the number of printers; raises on an invalid file"""
+        signature = _file_signature(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        if not isinstance(config, dict) or not isinstance(config.get('printers', {}), dict):
+            raise ValueError(f"{path}: expected {{\"printers\": {{\"name\": {{...}}}}}}")
+        printers = {name: parse_entry(name, spec) for name, spec in config.get('printers', {}).items()}
+
+        self.path = path
+        self._printers = printers
+        self._signature = signature
+        self.error = None
+        return len(printers)
+
+    def watch(self, interval: float = RELOAD_INTERVAL):
+        """Reload in the background whenever the file's mtime or size changes"""
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), name='printer-registry',
+                                             daemon=True)
+            self._watcher.start()
+
+    def _watch(self, interval: float):
+        while True:
+            time.sleep(interval)
+            signature = _file_signature(self.path)
+            if signature is None or signature == self._signature:
+                continue
+            previous = self._printers
+            try:
+                count = self.load(self.path)
+            except (OSError, ValueError) as e:
+                # Keep printing with the last good registry until the file is fixed
+                self._signature = signature
+                self.error = str(e)
+                print(f"⚠️ Printer registry not reloaded: {e}")
+                continue
+            changed = sorted(name for name, entry in self._printers.items() if previous.get(name) != entry)
+            print(f"🔄 Printer registry reloaded ({count} printers"
+                  f"{', changed: ' + ', '.join(changed) if changed else ''})")
+
+    def status(self) -> Dict[str, object]:
+        return {
+            'path': self.path,
+            'printers': {name: entry._asdict() for name, entry in self._printers.items()},
+            'error': self.error
+        }
+
+
+def _file_signature(path: Optional[str]):
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+registry = PrinterRegistry()
+
+
+def load_default_registry(base_dir: str) -> int:
+    """Load EZDINE_PRINTER_REGISTRY or printers.json next to the server and watch it for changes"""
+    path = os.environ.get('EZDINE_PRINTER_REGISTRY') or os.path.join(base_dir, 'printers.json')
+    if not os.path.exists(path):
+        return 0
+    count = registry.load(path)
+    registry.watch()
+    return count
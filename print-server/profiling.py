@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Profiling Module for EZDine Print Server
+Opt-in cProfile of requests, stack sampling and tracemalloc snapshots for on-site diagnosis
+"""
+
+import collections
+import datetime
+import functools
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from app_paths import APP_DIR
+
+# cProfile and tracemalloc are imported on first use, they slow down every bridge start otherwise
+
+# Where profiles, samples and memory snapshots are written
+PROFILE_DIR = os.environ.get('EZDINE_PROFILE_DIR') or os.path.join(APP_DIR, 'profiles')
+
+# Longest stack sampling run an admin can request
+MAX_SAMPLE_SECONDS = 300
+
+
+def _output_path(prefix: str, suffix: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    return os.path.join(PROFILE_DIR, f'{prefix}-{stamp}{suffix}')
+
+
+class RequestProfiler:
+    """Runs the next N requests under cProfile and dumps one .pstats file per request"""
+
+    def __init__(self):
+        self.remaining = 0
+        self.written = []
+        self._lock = threading.Lock()
+        # cProfile can't profile two threads at once, so concurrent requests run unprofiled
+        self._active = threading.Lock()
+
+    def arm(self, count: int):
+        with self._lock:
+            self.remaining = max(0, count)
+
+    def _claim(self) -> bool:
+        with self._lock:
+            if self.remaining <= 0 or not self._active.acquire(blocking=False):
+                return False
+            self.remaining -= 1
+            return True
+
+    def call(self, func: Callable[[], Any], label: Callable[[], str]) -> Any:
+        if not self.remaining or not self._claim():
+            return func()
+
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func)
+        finally:
+            self._active.release()
+            path = _output_path(f'request-{label()}', '.pstats')
+            profile.dump_stats(path)
+            self.written = (self.written + [path])[-20:]
+            print(f"🔬 Request profile written to {path}")
+
+    def status(self) -> Dict[str, Any]:
+        return {'remaining': self.remaining, 'recent': self.written}
+
+
+class StackSampler:
+    """Samples every thread's stack and writes collapsed stacks for flame graphs"""
+
+    def __init__(self):
+        self.running = False
+        self.last_output: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def start(self, seconds: float, interval: float = 0.01) -> Optional[str]:
+        """Begin sampling in the background, returns the output path (None if already running)"""
+        seconds = min(max(seconds, 0.1), MAX_SAMPLE_SECONDS)
+        with self._lock:
+            if self.running:
+                return None
+            self.running = True
+        path = _output_path('sample', '.folded')
+        threading.Thread(target=self._run, args=(path, seconds, interval),
+                         name='stack-sampler', daemon=True).start()
+        return path
+
+    def _run(self, path: str, seconds: float, interval: float):
+        counts: Dict[str, int] = collections.Counter()
+        names = {}
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        try:
+            while time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    counts[';'.join(reversed(stack))] += 1
+                time.sleep(interval)
+
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in counts.most_common():
+                    f.write(f'{stack} {count}\n')
+            self.last_output = path
+            print(f"🔬 Stack samples written to {path}")
+        finally:
+            with self._lock:
+                self.running = False
+
+
+class MemoryTracker:
+    """tracemalloc snapshots, each compared against the one before it"""
+
+    def __init__(self):
+        self._previous: Optional['tracemalloc.Snapshot'] = None
+        self._lock = threading.Lock()
+
+    def start(self, frames: int = 1):
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def snapshot(self, top: int = 10) -> Dict[str, Any]:
+        """Dump a snapshot and report the biggest allocation sites (or growth since last time)"""
+        import tracemalloc
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                self.start()
+                return {'tracing': True, 'message': 'tracemalloc started, take another snapshot later'}
+
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            path = _output_path('memory', '.snapshot')
+            snapshot.dump(path)
+
+            if self._previous is not None:
+                stats = snapshot.compare_to(self._previous, 'lineno')[:top]
+                top_stats = [{'where': str(s.traceback), 'size': s.size, 'sizeDiff': s.size_diff,
+                              'count': s.count, 'countDiff': s.count_diff} for s in stats]
+            else:
+                stats = snapshot.statistics('lineno')[:top]
+                top_stats = [{'where': str(s.traceback), 'size': s.size, 'count': s.count} for s in stats]
+            self._previous = snapshot
+
+            current, peak = tracemalloc.get_traced_memory()
+            print(f"🔬 Memory snapshot written to {path}")
+            return {'tracing': True, 'file': path, 'current': current, 'peak': peak, 'top': top_stats}
+
+
+request_profiler = RequestProfiler()
+stack_sampler = StackSampler()
+memory_tracker = MemoryTracker()
+
+
+def profiled(method: Callable) -> Callable:
+    """
+    Wrap an HTTP handler method so armed requests run under cProfile
+
+    Paths in the handler's unprofiled_paths (long-lived streams, whose profile would
+    only show waiting) run as usual and don't use up an armed request.
+    """
+    @functools.wraps(method)
+    def wrapper(handler):
+        path = handler.path.split('?')[0]
+        if path in getattr(handler, 'unprofiled_paths', ()):
+            return method(handler)
+        label = lambda: f"{handler.command}{path.replace('/', '_')}"
+        return request_profiler.call(lambda: method(handler), label)
+    return wrapper
+
+
+def configure_from_env():
+    """Apply EZDINE_PROFILE_REQUESTS and EZDINE_TRACEMALLOC at startup"""
+    requests = os.environ.get('EZDINE_PROFILE_REQUESTS', '')
+    if requests.isdigit() and int(requests):
+        request_profiler.arm(int(requests))
+        print(f"🔬 Profiling the next {requests} request(s) into {PROFILE_DIR}")
+
+    frames = os.environ.get('EZDINE_TRACEMALLOC', '')
+    if frames.isdigit() and int(frames):
+        memory_tracker.start(int(frames))
+        print(f"🔬 tracemalloc tracing with {frames} frame(s)")
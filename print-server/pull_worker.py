@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Pull Worker Module for EZDine
+Optional pull mode: the bridge long-polls a central job queue over HTTP, claims jobs
+in batches and acknowledges results in bulk, so printing doesn't depend on a browser
+tab pushing to localhost
+
+Protocol (JSON over HTTP, Authorization: Bearer <EZDINE_PULL_TOKEN> when set):
+    POST {url}/claim  {"worker": "pc1", "max": 8, "wait": 25}
+        -> {"jobs": [{"id": "j1", "printerId": "192.168.1.50", "lines": [...], "width": 80}]}
+           (or "template": "kot", "data": {...} in place of "lines")
+           held open up to "wait" seconds until jobs are available
+    POST {url}/ack    {"worker": "pc1", "results": [{"id": "j1", "success": true,
+                                                    "printer": "192.168.1.50", "message": "..."}]}
+        results with "retry": true ask the queue to hand the job out again
+"""
+
+import functools
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from job_trace import JobTrace
+from print_queue import PrintDispatcher, PrintTask, QueueFull
+from request_body import PayloadError, expand_lines, json_loads
+from templates import apply_template
+
+# Jobs kept claimed locally (queued on printers or printing), so printers never wait on a poll
+PREFETCH = int(os.environ.get('EZDINE_PULL_PREFETCH', 10))
+
+# How long the queue may hold a claim request open
+LONG_POLL_SECONDS = 25
+
+# Results are sent in batches of up to ACK_BATCH, at most every ACK_INTERVAL seconds
+ACK_BATCH = 50
+ACK_INTERVAL = 0.5
+
+# Backoff after the queue is unreachable, doubling up to the maximum
+RETRY_SECONDS = 1.0
+MAX_RETRY_SECONDS = 30.0
+
+
+class QueueClient:
+    """Keep-alive JSON client for the central queue (one per thread)"""
+
+    def __init__(self, url: str, token: str = '', timeout: float = LONG_POLL_SECONDS + 10):
+        parts = urlsplit(url.rstrip('/'))
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"Pull URL must be http or https: {url}")
+        self._connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                                  else http.client.HTTPConnection)
+        self._netloc = parts.netloc
+        self._path = parts.path
+        self._timeout = timeout
+        self._headers = {'Content-Type': 'application/json'}
+        if token:
+            self._headers['Authorization'] = f'Bearer {token}'
+        self._connection: Optional[http.client.HTTPConnection] = None
+
+    def post(self, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        data = json.dumps(body).encode('utf-8')
+        # A kept-alive connection the queue has since closed fails on first use; retry once fresh
+        for attempt in (1, 2):
+            if self._connection is None:
+                self._connection = self._connection_class(self._netloc, timeout=self._timeout)
+            try:
+                self._connection.request('POST', self._path + path, data, self._headers)
+                response = self._connection.getresponse()
+                payload = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt == 2:
+                    raise
+                continue
+            except (OSError, http.client.HTTPException):
+                self.close()
+                raise
+            if response.status == 204 or not payload:
+                return {}
+            if response.status >= 400:
+                raise http.client.HTTPException(f"{path} answered {response.status}: {payload[:200]!r}")
+            return json_loads(payload)
+        return {}
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class PullWorker:
+    """Claims batches from the central queue into the local dispatcher and acks results in bulk"""
+
+    def __init__(self, url: str, dispatcher: PrintDispatcher, accepts: Callable[[str], bool],
+                 token: str = '', worker_id: Optional[str] = None, prefetch: int = PREFETCH, history: Any = None):
+        self.url = url
+        self.dispatcher = dispatcher
+        self.accepts = accepts
+        # JobHistory the results of pulled jobs are recorded in, if any
+        self.history = history
+        self.worker_id = worker_id or socket.gethostname()
+        self.prefetch = prefetch
+        self.claimed = 0
+        self.acked = 0
+        self.last_error: Optional[str] = None
+        self._claim_client = QueueClient(url, token)
+        self._ack_client = QueueClient(url, token, timeout=10)
+        self._in_flight: Dict[Any, PrintTask] = {}
+        self._results: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)
+
+    def start(self):
+        threading.Thread(target=self._claim_loop, name='pull-claim', daemon=True).start()
+        threading.Thread(target=self._ack_loop, name='pull-ack', daemon=True).start()
+
+    def _claim_loop(self):
+        backoff = RETRY_SECONDS
+        while True:
+            with self._room:
+                # Wait for the prefetch buffer to have room before asking for more
+                while len(self._in_flight) >= self.prefetch:
+                    self._room.wait()
+                room = self.prefetch - len(self._in_flight)
+            try:
+                reply = self._claim_client.post('/claim', {'worker': self.worker_id, 'max': room,
+                                                           'wait': LONG_POLL_SECONDS})
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                self.last_error = str(e)
+                print(f"⚠️ Pull queue unreachable ({e}), retrying in {backoff:.0f}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_RETRY_SECONDS)
+                continue
+            backoff = RETRY_SECONDS
+            self.last_error = None
+
+            jobs = reply.get('jobs') or []
+            if jobs:
+                print(f"📥 Pulled {len(jobs)} job(s) from {self.url}")
+            dispatched = sum(self._dispatch(job) for job in jobs)
+            if jobs and not dispatched:
+                # Everything was handed back (full queues, unreachable printers); don't spin on it
+                time.sleep(RETRY_SECONDS)
+
+    def _dispatch(self, job: Dict[str, Any]) -> bool:
+        """Queue a pulled job on its printer, False if it was handed back to the queue"""
+        job_id = job.get('id')
+        target = job.get('printerId', '')
+        try:
+            job = apply_template(job, job.get('width', 80))
+            lines = expand_lines(job.get('lines', []))
+        except PayloadError as e:
+            self._record(job_id, False, None, str(e))
+            if self.history is not None:
+                self.history.record(target, False, time.time(), None, str(e), job_id, job.get('type'),
+                                    job.get('documentId'), job.get('traceId'))
+            return True
+        if not self.accepts(target):
+            self._record(job_id, False, None, f"Printer {target} is not reachable from {self.worker_id}", retry=True)
+            return False
+        try:
+            self.dispatcher.admit(target)
+        except QueueFull as e:
+            self._record(job_id, False, None, str(e), retry=True)
+            return False
+
+        task = PrintTask(job_id, lines, job.get('width', 80), trace=JobTrace(job.get('traceId') or f'pull-{job_id}'),
+                         on_done=functools.partial(self._finished, target, time.time(), job))
+        with self._lock:
+            self._in_flight[job_id] = task
+        self.claimed += 1
+        self.dispatcher.submit(target, task)
+        return True
+
+    def _finished(self, target: str, created: float, job: Dict[str, Any], task: PrintTask):
+        with self._room:
+            self._in_flight.pop(task.job_id, None)
+            self._room.notify()
+        self._record(task.job_id, task.success, task.printer, task.message)
+        if self.history is not None:
+            self.history.record_task(target, task, created, job.get('type'), job.get('documentId'))
+
+    def _record(self, job_id: Any, success: bool, printer: Optional[str], message: str, retry: bool = False):
+        result = {'id': job_id, 'success': success, 'printer': printer, 'message': message}
+        if retry:
+            result['retry'] = True
+        with self._lock:
+            self._results.append(result)
+
+    def _ack_loop(self):
+        backoff = ACK_INTERVAL
+        while True:
+            time.sleep(backoff)
+            with self._lock:
+                batch = self._results[:ACK_BATCH]
+            if not batch:
+                continue
+            try:
+                self._ack_client.post('/ack', {'worker': self.worker_id, 'results': batch})
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                # Results stay queued and are resent once the queue is back
+                self.last_error = str(e)
+                backoff = min(max(backoff * 2, RETRY_SECONDS), MAX_RETRY_SECONDS)
+                continue
+            backoff = ACK_INTERVAL
+            with self._lock:
+                del self._results[:len(batch)]
+            self.acked += len(batch)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._in_flight)
+            pending_acks = len(self._results)
+        return {
+            'url': self.url,
+            'worker': self.worker_id,
+            'inFlight': in_flight,
+            'pendingAcks': pending_acks,
+            'claimed': self.claimed,
+            'acked': self.acked,
+            'error': self.last_error
+        }
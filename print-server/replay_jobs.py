@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+EZDine Print Job Replay Tool
+Replays a recorded job log through the print server's queues and groups against
+emulated printers, to size printers and bridges for an outlet before buying them
+
+Usage:
+    python3 replay_jobs.py jobs.ndjson [--speed 10] [--groups printer_groups.json]
+                                       [--printers printers.json] [--json]
+
+Job log: NDJSON (or CSV with a header row), one job per line:
+    {"t": 12.5, "printerId": "kitchen", "bytes": 900, "type": "kot"}
+  t          seconds from the start, or an ISO "timestamp"
+  printerId  printer address, group or name
+  bytes      rendered size; alternatively "lines" with the original print lines
+  type       kot / invoice / token / report (optional)
+
+Printer speeds (--printers): {"192.168.1.50": {"bytesPerSec": 3000, "cutSeconds": 0.8}}
+Printers not listed use --bytes-per-sec and --cut-seconds.
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from ip_printer import DEFAULT_DRAIN_RATE, build_escpos
+from job_trace import JobTrace
+from print_queue import PrintDispatcher, PrintTask, QueueFull
+
+# Characters per filler line when a job is described only by its size
+FILLER_LINE = 'x' * 42
+
+
+class EmulatedPrinter:
+    """Pretends to print by sleeping for as long as a real printer would take"""
+
+    def __init__(self, bytes_per_sec: float, cut_seconds: float, speed: float):
+        self.bytes_per_sec = bytes_per_sec
+        self.cut_seconds = cut_seconds
+        self.speed = speed
+        self.busy_seconds = 0.0
+        self.jobs = 0
+        self._lock = threading.Lock()
+
+    def print_job(self, task: PrintTask) -> bool:
+        size = len(build_escpos(task.lines, task.paper_width))
+        duration = size / self.bytes_per_sec + self.cut_seconds
+        time.sleep(duration / self.speed)
+        with self._lock:
+            self.busy_seconds += duration
+            self.jobs += 1
+        return True
+
+
+def read_jobs(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield jobs from an NDJSON or CSV log, with 't' normalised to seconds from the first job"""
+    handle = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    with handle:
+        first = handle.readline()
+        if first.lstrip().startswith('{'):
+            records = (json.loads(line) for line in _chain([first], handle) if line.strip())
+        else:
+            records = csv.DictReader(_chain([first], handle))
+
+        origin = None
+        for record in records:
+            if record.get('t') not in (None, ''):
+                at = float(record['t'])
+            else:
+                at = datetime.datetime.fromisoformat(record['timestamp']).timestamp()
+            if origin is None:
+                origin = at
+            yield {
+                't': at - origin,
+                'printerId': record.get('printerId') or record.get('printer', ''),
+                'bytes': _job_size(record),
+                'type': record.get('type') or 'unknown'
+            }
+
+
+def _chain(first: List[str], rest) -> Iterator[str]:
+    yield from first
+    yield from rest
+
+
+def _job_size(record: Dict[str, Any]) -> int:
+    if record.get('bytes') not in (None, ''):
+        return int(record['bytes'])
+    lines = record.get('lines')
+    if isinstance(lines, str):
+        lines = json.loads(lines)
+    return len(build_escpos(lines or [], int(record.get('width') or 80)))
+
+
+def _filler_lines(size: int) -> List[Dict[str, Any]]:
+    """Lines that render to roughly size bytes (text, line feed and a 3-byte alignment command)"""
+    return [{'text': FILLER_LINE}] * max(1, size // (len(FILLER_LINE) + 4))
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def replay(jobs: Iterator[Dict[str, Any]], speed: float = 1.0, groups: Optional[str] = None,
+           printer_specs: Optional[Dict[str, Dict[str, float]]] = None,
+           bytes_per_sec: float = DEFAULT_DRAIN_RATE, cut_seconds: float = 0.5) -> Dict[str, Any]:
+    """Drive the real dispatcher with a job log and collect latency and utilisation figures"""
+    printer_specs = printer_specs or {}
+    printers: Dict[str, EmulatedPrinter] = {}
+    printers_lock = threading.Lock()
+
+    def printer_for(address: str) -> EmulatedPrinter:
+        with printers_lock:
+            if address not in printers:
+                spec = printer_specs.get(address, {})
+                printers[address] = EmulatedPrinter(spec.get('bytesPerSec', bytes_per_sec),
+                                                    spec.get('cutSeconds', cut_seconds), speed)
+            return printers[address]
+
+    def send(address: str, task: PrintTask) -> bool:
+        task.mark('connected')
+        printed = printer_for(address).print_job(task)
+        # The emulated printer knows when it finished, as a printer answering status queries does
+        task.mark('acknowledged')
+        return printed
+
+    dispatcher = PrintDispatcher(send=send)
+    if groups:
+        dispatcher.load_groups(groups)
+
+    submitted = []
+    shed = 0
+    start = time.monotonic()
+
+    for job_number, job in enumerate(jobs, 1):
+        delay = start + job['t'] / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        try:
+            dispatcher.admit(job['printerId'])
+        except QueueFull:
+            shed += 1
+            continue
+
+        trace = JobTrace(f'replay-{job_number}')
+        task = PrintTask(job_number, _filler_lines(job['bytes']), trace=trace)
+        dispatcher.submit(job['printerId'], task)
+        submitted.append((job, task))
+
+    for _, task in submitted:
+        task.wait()
+    elapsed = (time.monotonic() - start) * speed
+
+    # Trace stages are in real ms; scale back to log time
+    latencies: Dict[str, List[float]] = {}
+    waits: List[float] = []
+    failed = 0
+    for job, task in submitted:
+        stages = task.trace.stages
+        if not task.success:
+            failed += 1
+            continue
+        latencies.setdefault(job['type'], []).append(stages['acknowledged'] * speed / 1000)
+        waits.append((stages['dequeued'] - stages['queued']) * speed / 1000)
+
+    return {
+        'jobs': len(submitted) + shed,
+        'shed': shed,
+        'failed': failed,
+        'duration': round(elapsed, 2),
+        'queueDelay': _summary(waits),
+        'latency': {kind: _summary(values) for kind, values in sorted(latencies.items())},
+        'worstKotLatency': round(max(latencies.get('kot', [0.0])), 3),
+        'printers': {
+            address: {
+                'jobs': printer.jobs,
+                'busySeconds': round(printer.busy_seconds, 2),
+                'utilization': round(printer.busy_seconds / elapsed, 3) if elapsed else 0.0
+            } for address, printer in sorted(printers.items())
+        }
+    }
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {
+        'p50': round(_percentile(values, 50), 3),
+        'p95': round(_percentile(values, 95), 3),
+        'max': round(max(values, default=0.0), 3)
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print("\n📊 === REPLAY REPORT ===")
+    print(f"🧾 Jobs: {report['jobs']} ({report['shed']} shed, {report['failed']} failed)")
+    print(f"⏱️ Log duration: {report['duration']}s")
+    delay = report['queueDelay']
+    print(f"⏳ Queueing delay: p50 {delay['p50']}s  p95 {delay['p95']}s  max {delay['max']}s")
+    print("📄 Latency by job type (received → printed):")
+    for kind, summary in report['latency'].items():
+        print(f"   {kind:<10} p50 {summary['p50']}s  p95 {summary['p95']}s  max {summary['max']}s")
+    print(f"🍳 Worst KOT latency: {report['worstKotLatency']}s")
+    print("🖨️ Printer utilization:")
+    for address, stats in report['printers'].items():
+        print(f"   {address:<20} {stats['utilization'] * 100:5.1f}%  ({stats['jobs']} jobs, {stats['busySeconds']}s busy)")
+    print("=" * 26)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a print job log against emulated printers')
+    parser.add_argument('log', help="NDJSON or CSV job log ('-' for stdin)")
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed multiplier (default 1x)')
+    parser.add_argument('--groups', help='printer groups file (same format as printer_groups.json)')
+    parser.add_argument('--printers', help='JSON file of per-printer bytesPerSec / cutSeconds')
+    parser.add_argument('--bytes-per-sec', type=float, default=DEFAULT_DRAIN_RATE, help='default printer speed')
+    parser.add_argument('--cut-seconds', type=float, default=0.5, help='default feed and cut time per job')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    printer_specs = {}
+    if args.printers:
+        with open(args.printers, 'r', encoding='utf-8') as f:
+            printer_specs = json.load(f)
+
+    report = replay(read_jobs(args.log), args.speed, args.groups, printer_specs,
+                    args.bytes_per_sec, args.cut_seconds)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Reprint Cache Module for EZDine
+Keeps the rendered ESC/POS bytes of recent bills and KOTs by document id, so a reprint
+is one request for the cached bytes instead of the client rebuilding and resending the job
+"""
+
+import collections
+import hashlib
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from ip_printer import ESCPOSCommands
+
+# Memory for cached documents (a receipt is typically 1-3 KB)
+MAX_CACHE_BYTES = int(float(os.environ.get('EZDINE_REPRINT_CACHE_MB', 16)) * 1024 * 1024)
+
+# Optional folder documents are moved to when they fall out of memory, and its size limit
+SPILL_DIR = os.environ.get('EZDINE_REPRINT_SPILL_DIR', '')
+MAX_SPILL_BYTES = int(float(os.environ.get('EZDINE_REPRINT_SPILL_MB', 256)) * 1024 * 1024)
+
+# Printed ahead of a reprint that asks for it, bold at double width and height via ESC !
+# (the document's own ESC @ resets the style after)
+DUPLICATE_BANNER = (ESCPOSCommands.INIT + ESCPOSCommands.ALIGN_CENTER + ESCPOSCommands.ESC + b'!\x38'
+                    + b'DUPLICATE' + ESCPOSCommands.LF + ESCPOSCommands.ESC + b'!\x00' + ESCPOSCommands.LF)
+
+
+class ReprintCache:
+    """Rendered documents by id, least recently used first out of memory (to disk if enabled)"""
+
+    def __init__(self, max_bytes: int = MAX_CACHE_BYTES, spill_dir: str = SPILL_DIR,
+                 max_spill_bytes: int = MAX_SPILL_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._documents: 'collections.OrderedDict[str, Tuple[bytes, str]]' = collections.OrderedDict()
+        self._spilled: 'collections.OrderedDict[str, int]' = collections.OrderedDict()
+        self._spilled_bytes = 0
+        self._lock = threading.Lock()
+        if spill_dir:
+            self._scan_spill_dir()
+
+    def put(self, document_id: str, data: bytes, printer_id: str):
+        """Remember a document's bytes and the printer it was sent to"""
+        with self._lock:
+            old = self._documents.pop(document_id, None)
+            if old is not None:
+                self.total_bytes -= len(old[0])
+            self._documents[document_id] = (data, printer_id)
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes and self._documents:
+                evicted_id, (evicted, evicted_printer) = self._documents.popitem(last=False)
+                self.total_bytes -= len(evicted)
+                if self.spill_dir:
+                    self._spill(evicted_id, evicted, evicted_printer)
+
+    def get(self, document_id: str) -> Optional[Tuple[bytes, str]]:
+        """(bytes, original printer) for a document, or None if it is no longer cached"""
+        with self._lock:
+            entry = self._documents.get(document_id)
+            if entry is not None:
+                self._documents.move_to_end(document_id)
+                self.hits += 1
+                return entry
+            entry = self._unspill(document_id) if self.spill_dir else None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def _spill_path(self, document_id: str) -> str:
+        return os.path.join(self.spill_dir, hashlib.sha256(document_id.encode('utf-8')).hexdigest()[:32] + '.bin')
+
+    def _spill(self, document_id: str, data: bytes, printer_id: str):
+        path = self._spill_path(document_id)
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(path, 'wb') as f:
+                # First line is the original printer, the rest the document as rendered
+                f.write(printer_id.encode('utf-8') + b'\n')
+                f.write(data)
+        except OSError as e:
+            print(f"⚠️ Could not spill reprint document {document_id}: {e}")
+            return
+        size = len(data) + len(printer_id) + 1
+        self._spilled_bytes += size - self._spilled.pop(path, 0)
+        self._spilled[path] = size
+        while self._spilled_bytes > self.max_spill_bytes and self._spilled:
+            oldest, oldest_size = self._spilled.popitem(last=False)
+            self._spilled_bytes -= oldest_size
+            try:
+                os.remove(oldest)
+            except OSError:
+                pass
+
+    def _unspill(self, document_id: str) -> Optional[Tuple[bytes, str]]:
+        path = self._spill_path(document_id)
+        try:
+            with open(path, 'rb') as f:
+                printer_id = f.readline()[:-1].decode('utf-8')
+                data = f.read()
+        except OSError:
+            return None
+        if path in self._spilled:
+            self._spilled.move_to_end(path)
+        return data, printer_id
+
+    def _scan_spill_dir(self):
+        """Pick up documents spilled before a restart, oldest first"""
+        try:
+            names = [name for name in os.listdir(self.spill_dir) if name.endswith('.bin')]
+        except OSError:
+            return
+        paths = sorted((os.path.join(self.spill_dir, name) for name in names), key=os.path.getmtime)
+        for path in paths:
+            size = os.path.getsize(path)
+            self._spilled[path] = size
+            self._spilled_bytes += size
+
+    def status(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'documents': len(self._documents),
+                'bytes': self.total_bytes,
+                'spilled': len(self._spilled),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+reprint_cache = ReprintCache()
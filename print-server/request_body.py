@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Request Body Module for EZDine Print Server
+Incremental readers that move HTTP request bodies without buffering them whole
+"""
+
+import json
+import os
+import zlib
+from typing import Any, BinaryIO, Dict, List, Mapping
+
+# Use a faster JSON decoder when one is installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# MessagePack payloads are optional
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Largest request body accepted on the wire, checked against Content-Length before reading
+MAX_BODY_SIZE = int(os.environ.get('EZDINE_MAX_BODY_SIZE', 4 * 1024 * 1024))
+
+# Largest body accepted after gzip decompression
+MAX_DECODED_SIZE = 4 * MAX_BODY_SIZE
+
+# Bodies of any other Content-Type are read as JSON, as they always were
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+# Positional order of compact [text, align, bold] lines
+LINE_FIELDS = ('text', 'align', 'bold')
+
+
+class PayloadError(ValueError):
+    """Request body rejected, carries the HTTP status to answer with"""
+
+    def __init__(self, status_code: int, message: str, body_consumed: bool = True):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body_consumed = body_consumed
+
+
+class BodyReader:
+    """Reads at most Content-Length bytes from a request stream into caller buffers"""
+
+    def __init__(self, stream: BinaryIO, length: int):
+        self.stream = stream
+        self.remaining = length
+        self.consumed = 0
+
+    def readinto(self, buffer: memoryview) -> int:
+        if self.remaining <= 0:
+            return 0
+        count = self.stream.readinto(buffer[:min(self.remaining, len(buffer))])
+        if not count:
+            raise ConnectionError('Request body ended early')
+        self.remaining -= count
+        self.consumed += count
+        return count
+
+    def drain(self):
+        """Discard whatever is left of the body"""
+        buffer = memoryview(bytearray(16384))
+        while self.readinto(buffer):
+            pass
+
+
+class GzipBodyReader:
+    """Decompresses a gzip request body into caller buffers as it is read"""
+
+    def __init__(self, body: BodyReader, chunk_size: int = 16384):
+        self.body = body
+        self._decompressor = zlib.decompressobj(wbits=31)
+        self._input = memoryview(bytearray(chunk_size))
+        self._pending = b''
+
+    @property
+    def consumed(self) -> int:
+        return self.body.consumed
+
+    def readinto(self, buffer: memoryview) -> int:
+        while not self._decompressor.eof:
+            if not self._pending:
+                count = self.body.readinto(self._input)
+                if not count:
+                    raise ValueError('Truncated gzip body')
+                self._pending = self._input[:count]
+            data = self._decompressor.decompress(self._pending, len(buffer))
+            self._pending = self._decompressor.unconsumed_tail
+            if data:
+                buffer[:len(data)] = data
+                return len(data)
+        return 0
+
+    def drain(self):
+        self.body.drain()
+
+
+def read_payload(stream: BinaryIO, headers: Mapping[str, str]) -> Dict[str, Any]:
+    """Read and decode a /print body (JSON or MessagePack, optionally gzip-encoded)"""
+    length = headers.get('Content-Length')
+    if length is None or not length.isdigit():
+        raise PayloadError(411, 'Content-Length required', body_consumed=False)
+    if int(length) > MAX_BODY_SIZE:
+        raise PayloadError(413, f'Request body exceeds {MAX_BODY_SIZE} bytes', body_consumed=False)
+
+    encoding = headers.get('Content-Encoding', 'identity').lower()
+    content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+    if encoding not in ('identity', 'gzip'):
+        raise PayloadError(415, f'Unsupported Content-Encoding: {encoding}', body_consumed=False)
+    if content_type in MSGPACK_TYPES and msgpack is None:
+        raise PayloadError(415, 'MessagePack support not installed (pip install msgpack)', body_consumed=False)
+
+    body = BodyReader(stream, int(length))
+    if encoding == 'gzip':
+        data = _read_all(GzipBodyReader(body), MAX_DECODED_SIZE)
+        body.drain()
+    else:
+        data = stream.read(int(length))
+        if len(data) < int(length):
+            raise PayloadError(400, 'Request body ended early', body_consumed=False)
+
+    try:
+        if content_type in MSGPACK_TYPES:
+            payload = msgpack.unpackb(data, raw=False)
+        else:
+            payload = json_loads(data)
+    except Exception as e:
+        raise PayloadError(400, f'Invalid request body: {e}')
+
+    if not isinstance(payload, dict):
+        raise PayloadError(400, 'Print job must be an object')
+    if 'lines' in payload:
+        payload['lines'] = expand_lines(payload['lines'])
+    return payload
+
+
+def expand_lines(lines: List[Any]) -> List[Dict[str, Any]]:
+    """Expand compact [text, align, bold] lines into the usual line objects, raises PayloadError"""
+    if not isinstance(lines, list):
+        raise PayloadError(400, 'lines must be an array')
+    expanded = []
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, (list, tuple)):
+            line = dict(zip(LINE_FIELDS, line))
+        elif isinstance(line, str):
+            line = {'text': line}
+        elif not isinstance(line, dict):
+            raise PayloadError(400, f'Line {number} must be an object, array or string')
+        if not isinstance(line.get('text', ''), str):
+            raise PayloadError(400, f'Line {number} text must be a string')
+        expanded.append(line)
+    return expanded
+
+
+def _read_all(source: 'GzipBodyReader', limit: int) -> bytearray:
+    """Collect a decoded body, refusing to grow past limit"""
+    data = bytearray()
+    buffer = memoryview(bytearray(65536))
+    try:
+        while True:
+            count = source.readinto(buffer)
+            if not count:
+                return data
+            if len(data) + count > limit:
+                raise PayloadError(413, f'Decoded body exceeds {limit} bytes', body_consumed=False)
+            data += buffer[:count]
+    except PayloadError:
+        raise
+    except (ValueError, zlib.error) as e:
+        raise PayloadError(400, f'Invalid gzip body: {e}', body_consumed=False)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Host Resolver Module for EZDine
+Caches DNS lookups for printers addressed by hostname (e.g. kitchen-printer.local), so
+jobs connect to an address already known instead of waiting on DNS. Lookups run on
+background threads, answers are refreshed before they expire and failures are cached
+for a short while so a missing name doesn't cost a lookup per job
+"""
+
+import concurrent.futures
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Seconds an answer is used before it is looked up again (getaddrinfo doesn't report
+# record TTLs, so one TTL applies to every name)
+DNS_TTL = float(os.environ.get('EZDINE_DNS_TTL', 60))
+
+# Seconds a failed lookup is remembered before the name is tried again
+NEGATIVE_TTL = float(os.environ.get('EZDINE_DNS_NEGATIVE_TTL', 10))
+
+# Seconds an expired answer is still used while its refresh keeps failing, so a DNS or
+# mDNS outage doesn't stop a printer whose address hasn't changed
+STALE_GRACE = 600
+
+# Refresh an answer once this much of its TTL has passed
+REFRESH_AHEAD = 0.8
+
+# Names not printed to for this many TTLs stop being refreshed. Within the stale grace
+# their last answer is still used and brought up to date in the background when they are
+# next printed to; after it the answer is dropped, and the name once nothing is looking it up
+IDLE_TTLS = 10
+
+# Most names cached; beyond this the least recently used idle one is dropped
+MAX_HOSTS = 1024
+
+# Seconds between checks for answers due a refresh
+REFRESH_CHECK = 1.0
+
+# Most lookups running at once
+MAX_LOOKUPS = 4
+
+
+class _Entry:
+    """Cached answer for one name"""
+
+    def __init__(self):
+        self.addresses: Optional[List[str]] = None
+        self.error = ''
+        self.resolved_at = 0.0
+        self.expires = 0.0
+        self.refresh_at = 0.0
+        self.used = time.monotonic()
+        self.pending = False
+        self.ready = threading.Event()
+
+
+class HostResolver:
+    """Hostname to address cache, filled and refreshed off the printing path"""
+
+    def __init__(self, ttl: float = DNS_TTL, negative_ttl: float = NEGATIVE_TTL, port: int = 9100):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.port = port
+        self.lookups = 0
+        self.failures = 0
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(MAX_LOOKUPS, thread_name_prefix='dns')
+        self._refresher: Optional[threading.Thread] = None
+
+    def resolve(self, host: str, timeout: float = 5.0) -> Optional[List[str]]:
+        """
+        Addresses for a name, None if it can't be resolved
+
+        A cached answer is returned at once, even one being refreshed, or one past its TTL
+        but within the stale grace: one whose refresh failed, or the last answer of a name
+        gone idle, which is refreshed in the background. A name with no usable answer (new,
+        or idle so long its answer is older than the grace) waits, up to timeout (0 to not
+        wait at all), for a fresh lookup.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entry(host)
+            entry.used = now
+            if entry.addresses is not None and now < entry.expires + STALE_GRACE:
+                if now >= entry.refresh_at:
+                    self._start(host, entry)
+                return entry.addresses
+            if entry.addresses is None and entry.resolved_at and now < entry.expires:
+                return None
+            # Too old to trust: the printer may have a new DHCP lease by now
+            entry.addresses = None
+            self._start(host, entry)
+        entry.ready.wait(timeout)
+        with self._lock:
+            return entry.addresses
+
+    def resolving(self, host: str) -> bool:
+        """True while a name with no answer yet is being looked up"""
+        with self._lock:
+            entry = self._entries.get(host)
+            return entry is not None and entry.pending and entry.addresses is None
+
+    def _entry(self, host: str) -> _Entry:
+        # Call with self._lock held
+        entry = self._entries.get(host)
+        if entry is None:
+            if len(self._entries) >= MAX_HOSTS:
+                idle = [(other.used, name) for name, other in self._entries.items() if not other.pending]
+                if idle:
+                    del self._entries[min(idle)[1]]
+            entry = self._entries[host] = _Entry()
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name='dns-refresh', daemon=True)
+                self._refresher.start()
+        return entry
+
+    def _start(self, host: str, entry: _Entry):
+        # Call with self._lock held
+        if entry.addresses is None:
+            # Callers with nothing cached wait for this lookup (or the refresh already running),
+            # not an earlier failure
+            entry.ready.clear()
+        if not entry.pending:
+            entry.pending = True
+            self._pool.submit(self._lookup, host, entry)
+
+    def _lookup(self, host: str, entry: _Entry):
+        try:
+            infos = socket.getaddrinfo(host, self.port, type=socket.SOCK_STREAM)
+            addresses, error = list(dict.fromkeys(info[4][0] for info in infos)), ''
+        except (OSError, UnicodeError) as e:
+            addresses, error = None, str(e)
+
+        now = time.monotonic()
+        with self._lock:
+            self.lookups += 1
+            entry.pending = False
+            entry.resolved_at = now
+            if addresses:
+                if entry.addresses != addresses and entry.addresses is not None:
+                    print(f"🔄 {host} now resolves to {', '.join(addresses)}")
+                entry.addresses, entry.error, entry.expires = addresses, '', now + self.ttl
+                entry.refresh_at = now + self.ttl * REFRESH_AHEAD
+            else:
+                self.failures += 1
+                if not entry.error:
+                    print(f"⚠️ Could not resolve printer {host}: {error or 'no addresses'}")
+                entry.error = error or 'no addresses'
+                if entry.addresses is None or now >= entry.expires + STALE_GRACE:
+                    entry.addresses = None
+                    entry.expires = now + self.negative_ttl
+                # A stale answer stays in use, and either way the name is retried later
+                entry.refresh_at = now + self.negative_ttl
+            entry.ready.set()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(REFRESH_CHECK)
+            now = time.monotonic()
+            with self._lock:
+                for host, entry in list(self._entries.items()):
+                    if now - entry.used > self.ttl * IDLE_TTLS:
+                        # Idle: not refreshed, and forgotten once its answer is too old to use
+                        if not entry.pending and now >= entry.expires + STALE_GRACE:
+                            del self._entries[host]
+                        continue
+                    if entry.resolved_at and now >= entry.refresh_at:
+                        self._start(host, entry)
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'lookups': self.lookups,
+                'failures': self.failures,
+                'hosts': {host: {'addresses': entry.addresses, 'error': entry.error or None,
+                                 'expiresIn': round(entry.expires - now, 1)}
+                          for host, entry in self._entries.items()}
+            }
+
+
+resolver = HostResolver()
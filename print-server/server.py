@@ -7,72 +7,299 @@ Supports both console logging and direct IP printer communication
 
 import json
 import datetime
-import re
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse
+import functools
+import os
+import sqlite3
+import threading
+import time
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
 import sys
 
 # Import IP printer module
 try:
-    from ip_printer import print_to_ip_printer, test_ip_printer
+    from ip_printer import iter_escpos, test_ip_printer
+    from print_queue import PrintDispatcher, PrintTask, QueueFull, load_default_groups
+    from preview import PREVIEW_FORMATS, PreviewUnavailable, preview_cache
+    from printer_registry import load_default_registry, registry
+    from reprint_cache import DUPLICATE_BANNER, reprint_cache
+    from resolver import resolver
+    from templates import apply_template, templates
+    from throughput import escpos_cost, stream_cost
+    from transports import is_network_address, lookup_transport
     IP_PRINTING_AVAILABLE = True
     print("✅ IP printing module loaded successfully")
 except ImportError as e:
     IP_PRINTING_AVAILABLE = False
     print(f"⚠️ IP printing not available: {e}")
 
+from app_paths import APP_DIR
+from job_events import EventBroker
+from job_history import EXPORT_FORMATS, HISTORY_PATH, JobHistory, parse_time
+from job_trace import JobTrace, trace_id_from_headers
+from profiling import (configure_from_env, memory_tracker, profiled, request_profiler,
+                       stack_sampler)
+from request_body import BodyReader, GzipBodyReader, PayloadError, read_payload
+
+# How long /print waits for a queued job to reach the printer
+PRINT_WAIT_TIMEOUT = 60
+
 # Store print jobs for debugging
 print_jobs = []
+print_jobs_lock = threading.Lock()
+
+# Every print result, kept on disk for GET /jobs/export (set up in run_server)
+job_history = None
+
+# Shared secret for /debug endpoints; they stay disabled unless this is set
+ADMIN_TOKEN = os.environ.get('EZDINE_ADMIN_TOKEN', '')
+
+# Seconds between keep-alive comments on idle /events streams
+EVENT_STREAM_PING = 15
+
+# Job and printer status pushed to /events subscribers
+event_broker = EventBroker()
+
+# Per-printer queues and printer groups
+dispatcher = PrintDispatcher(on_event=event_broker.publish) if IP_PRINTING_AVAILABLE else None
+
+# Shared SQLite job store for running two or more bridges as a pair (set up in run_server)
+JOB_STORE_PATH = os.environ.get('EZDINE_JOB_STORE', '')
+shared_queue = None
+
+# Central job queue to pull print jobs from, instead of waiting for pushes (set up in run_server)
+PULL_URL = os.environ.get('EZDINE_PULL_URL', '')
+pull_worker = None
+
+# CORS headers to allow requests from web app
+CORS_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type, Content-Encoding, X-Printer-Id, X-Request-Id, traceparent'),
+    ('Access-Control-Expose-Headers', 'X-Request-Id, Retry-After, X-Preview-Cache'),
+)
+
+# /health is polled by every terminal, so its body is rebuilt at most once a second
+HEALTH_CACHE_TTL = 1.0
+_health_cache = {'expires': 0.0, 'body': b''}
+_health_lock = threading.Lock()
+
+
+def _static_response(status_code, data=None):
+    """Pre-render a complete HTTP response for a reply that never changes"""
+    body = json.dumps(data).encode('utf-8') if data is not None else b''
+    head = [f'HTTP/1.1 {status_code} {HTTPStatus(status_code).phrase}']
+    if data is not None:
+        head.append('Content-Type: application/json')
+    head.extend(f'{name}: {value}' for name, value in CORS_HEADERS)
+    head.append(f'Content-Length: {len(body)}')
+    return ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+
+
+PREFLIGHT_RESPONSE = _static_response(200)
+NOT_FOUND_RESPONSE = _static_response(404, {
+    'success': False,
+    'error': 'Endpoint not found'
+})
+NOT_FOUND_GET_RESPONSE = _static_response(404, {
+    'success': False,
+    'error': 'Endpoint not found',
+    'availableEndpoints': [
+        'GET /health - Check server status',
+        'POST /print - Send print job',
+        'POST /print/raw?printerId={printer} - Send pre-rendered ESC/POS bytes',
+        'POST /preview?format=png|text - Render a print job without printing it',
+        'POST /reprint/{documentId}?printerId={printer}&duplicate=1 - Reprint a recent bill or KOT',
+        'GET /jobs - View recent print jobs',
+        'GET /jobs/{id} - View one job with its trace id and stage timings',
+        'GET /jobs/export?since=&until=&printer=&format=ndjson|csv - Export print history',
+        'GET /events - Stream job and printer status (Server-Sent Events)',
+        'DELETE /jobs - Clear print job history',
+        'GET /test-ip/{ip_address} - Test IP printer connection'
+    ]
+})
+
+
+def _estimate(task, submitted):
+    """When the queue expected a task to finish, as of when it was submitted"""
+    finish = submitted + datetime.timedelta(seconds=task.eta_seconds)
+    return {
+        'seconds': round(task.eta_seconds, 2),
+        'printSeconds': round(task.print_seconds, 2),
+        'finishAt': finish.isoformat()
+    }
+
+
+def _cache_for_reprint(job, task):
+    """Keep the bytes a printed job sent under its documentId for POST /reprint"""
+    if task.success:
+        reprint_cache.put(str(job['documentId']), b''.join(task.sent), job.get('printerId', ''))
+
+
+def _record_history(target, created, job_type, document_id, size, task, cancelled=None):
+    """
+    Keep a job's result in the persisted history, if it is on
+
+    Bound with functools.partial as the task's on_done, so the row is written when the job
+    prints or fails, even long after the request stopped waiting for it. A task the request
+    withdrew never finishes and is recorded with cancelled, the reason, instead.
+    """
+    if job_history is not None:
+        job_history.record_task(target, task, created, job_type, document_id, size, cancelled)
+
+
+def _print_job_done(job, created, task):
+    """on_done for /print jobs: record the result, and cache what a document job sent for reprints"""
+    _record_history(job.get('printerId', ''), created, job.get('type'), job.get('documentId'), None, task)
+    if task.sent is not None:
+        _cache_for_reprint(job, task)
+
+
+def _health_body():
+    """Return the cached /health body, rebuilding it once it is older than HEALTH_CACHE_TTL"""
+    now = time.monotonic()
+    with _health_lock:
+        if now >= _health_cache['expires']:
+            _health_cache['body'] = json.dumps({
+                'status': 'ok',
+                'message': 'EZDine Print Server is running (Python)',
+                'timestamp': datetime.datetime.now().isoformat(),
+                'totalJobs': len(print_jobs),
+                **(dispatcher.status() if dispatcher else {}),
+                **({'registry': registry.status()} if dispatcher and registry.path else {}),
+                **({'reprint': reprint_cache.status()} if dispatcher else {}),
+                **({'dns': resolver.status()} if dispatcher and resolver.lookups else {}),
+                **({'templates': templates.status()} if dispatcher and templates.compiles else {}),
+                **({'shared': shared_queue.status()} if shared_queue else {}),
+                **({'pull': pull_worker.status()} if pull_worker else {}),
+                **({'history': job_history.status()} if job_history else {})
+            }).encode('utf-8')
+            _health_cache['expires'] = now + HEALTH_CACHE_TTL
+        return _health_cache['body']
 
 class PrintServerHandler(BaseHTTPRequestHandler):
+    # Keep connections open so terminals don't reconnect for every poll
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    # Streaming responses, left out of request profiling
+    unprofiled_paths = ('/events', '/jobs/export')
+    
     def _set_cors_headers(self):
         """Set CORS headers to allow requests from web app"""
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        for name, value in CORS_HEADERS:
+            self.send_header(name, value)
     
-    def _send_json_response(self, status_code, data):
-        """Send JSON response"""
+    def _send_body(self, status_code, body, content_type='application/json', headers=None):
+        """Send an encoded body with an exact Content-Length"""
         self.send_response(status_code)
-        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
         self._set_cors_headers()
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        self.wfile.write(body)
     
-    def do_OPTIONS(self):
-        """Handle preflight CORS requests"""
-        self.send_response(200)
+    def _send_chunked(self, status_code, chunks, content_type, headers=None):
+        """Stream a body of unknown length with chunked transfer encoding"""
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Transfer-Encoding', 'chunked')
         self._set_cors_headers()
         self.end_headers()
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(b'%X\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            chunks.close()
+    
+    def _send_json_response(self, status_code, data, headers=None):
+        """Send JSON response"""
+        self._send_body(status_code, json.dumps(data).encode('utf-8'), headers=headers)
     
+    def _send_queue_full(self, error):
+        """Shed a job with 429 and a Retry-After based on how fast the queue drains"""
+        print(f"🚦 {error} - retry in {error.retry_after}s")
+        self._send_json_response(429, {
+            'success': False,
+            'error': 'Print queue full',
+            'message': str(error),
+            'retryAfter': error.retry_after
+        }, headers={'Retry-After': str(error.retry_after)})
+    
+    def _send_static(self, response):
+        """Write a pre-rendered response in a single call"""
+        self.wfile.write(response)
+    
+    def _discard_body(self):
+        """Drain an unread request body so the connection can be reused"""
+        try:
+            remaining = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            self.close_connection = True
+            return
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 65536))
+            if not chunk:
+                self.close_connection = True
+                return
+            remaining -= len(chunk)
+    
+    def do_OPTIONS(self):
+        """Handle preflight CORS requests"""
+        self._send_static(PREFLIGHT_RESPONSE)
+    
+    @profiled
     def do_GET(self):
         """Handle GET requests"""
-        path = urlparse(self.path).path
+        url = urlparse(self.path)
+        path = url.path
         
-        if path == '/health':
-            self._send_json_response(200, {
-                'status': 'ok',
-                'message': 'EZDine Print Server is running (Python)',
-                'timestamp': datetime.datetime.now().isoformat(),
-                'totalJobs': len(print_jobs)
-            })
+        if path.startswith('/debug/'):
+            self._handle_debug(path, {})
+        
+        elif path == '/health':
+            self._send_body(200, _health_body())
+        
+        elif path == '/events':
+            self._stream_events()
         
         elif path == '/jobs':
+            with print_jobs_lock:
+                # Copy stage timings, which printer workers may still be adding to
+                recent = [{**job, 'stages': dict(job.get('stages', {}))} for job in print_jobs[-10:]]
             self._send_json_response(200, {
-                'jobs': print_jobs[-10:],  # Last 10 jobs
+                'jobs': recent,  # Last 10 jobs
                 'total': len(print_jobs)
             })
         
-        elif path.startswith('/test-ip/'):
-            # Test IP printer endpoint: /test-ip/192.168.1.100
-            ip_address = path.split('/test-ip/')[-1]
+        elif path == '/jobs/export':
+            self._handle_export(parse_qs(url.query))
+        
+        elif path.startswith('/jobs/'):
+            job_id = path.split('/jobs/')[-1]
+            job = self._find_job(int(job_id)) if job_id.isdigit() else None
             
-            if not self._is_ip_address(ip_address):
-                self._send_json_response(400, {
+            if job is None:
+                self._send_json_response(404, {
                     'success': False,
-                    'error': 'Invalid IP address format'
+                    'error': f'Job {job_id} not found'
                 })
-                return
+            else:
+                self._send_json_response(200, job)
+        
+        elif path.startswith('/test-ip/'):
+            # Test IP printer endpoint: /test-ip/192.168.1.100, /test-ip/kitchen-printer.local
+            ip_address = unquote(path.split('/test-ip/')[-1])
             
             if not IP_PRINTING_AVAILABLE:
                 self._send_json_response(500, {
@@ -82,8 +309,26 @@ class PrintServerHandler(BaseHTTPRequestHandler):
                 return
             
             try:
+                if not self._is_ip_address(ip_address):
+                    self._send_json_response(400, {
+                        'success': False,
+                        'error': 'Invalid IP address or hostname'
+                    })
+                    return
+                
                 print(f"\n🧪 Testing IP printer: {ip_address}")
-                success = test_ip_printer(ip_address)
+                # Hostnames go through the resolver cache like print jobs do, but a name not
+                # cached yet is looked up in the background rather than on this thread
+                transport = lookup_transport(ip_address)
+                connect_address = transport.connect_address(timeout=0)
+                if connect_address is None and resolver.resolving(transport.host):
+                    self._send_json_response(503, {
+                        'success': False,
+                        'error': f'Still resolving {ip_address}, try again shortly',
+                        'retryAfter': 1
+                    }, headers={'Retry-After': '1'})
+                    return
+                success = connect_address is not None and test_ip_printer(connect_address)
                 
                 self._send_json_response(200, {
                     'success': success,
@@ -98,60 +343,91 @@ class PrintServerHandler(BaseHTTPRequestHandler):
                 })
         
         else:
-            self._send_json_response(404, {
-                'success': False,
-                'error': 'Endpoint not found',
-                'availableEndpoints': [
-                    'GET /health - Check server status',
-                    'POST /print - Send print job',
-                    'GET /jobs - View recent print jobs',
-                    'DELETE /jobs - Clear print job history',
-                    'GET /test-ip/{ip_address} - Test IP printer connection'
-                ]
-            })
+            self._send_static(NOT_FOUND_GET_RESPONSE)
     
+    @profiled
     def do_POST(self):
         """Handle POST requests"""
-        path = urlparse(self.path).path
+        url = urlparse(self.path)
+        path = url.path
+        
+        if path.startswith('/debug/'):
+            self._discard_body()
+            self._handle_debug(path, parse_qs(url.query))
+        
+        elif path == '/print/raw':
+            self._handle_raw_print(parse_qs(url.query), JobTrace(trace_id_from_headers(self.headers)))
         
-        if path == '/print':
+        elif path == '/preview':
+            self._handle_preview(parse_qs(url.query))
+        
+        elif path.startswith('/reprint/'):
+            self._discard_body()
+            self._handle_reprint(unquote(path[len('/reprint/'):]), parse_qs(url.query),
+                                 JobTrace(trace_id_from_headers(self.headers)))
+        
+        elif path == '/print':
+            trace = JobTrace(trace_id_from_headers(self.headers))
             try:
                 # Read request body
-                content_length = int(self.headers['Content-Length'])
-                post_data = self.rfile.read(content_length)
-                job = json.loads(post_data.decode('utf-8'))
+                job = read_payload(self.rfile, self.headers)
+                if IP_PRINTING_AVAILABLE:
+                    job = apply_template(job, self._print_settings(job)[0])
+                trace.mark('parsed')
+                
+                # Shed the job up front if its printer queue is full
+                if IP_PRINTING_AVAILABLE and self._is_print_target(job.get('printerId', '')):
+                    try:
+                        dispatcher.admit(job.get('printerId', ''))
+                    except QueueFull as e:
+                        self._send_queue_full(e)
+                        return
                 
                 # Store job for debugging
-                timestamp = datetime.datetime.now().isoformat()
-                job_with_meta = {
-                    **job,
-                    'timestamp': timestamp,
-                    'id': len(print_jobs) + 1
-                }
-                print_jobs.append(job_with_meta)
+                received = time.time()
+                timestamp = datetime.datetime.fromtimestamp(received).isoformat()
+                with print_jobs_lock:
+                    job_id = len(print_jobs) + 1
+                    print_jobs.append({
+                        **job,
+                        'timestamp': timestamp,
+                        'id': job_id,
+                        'traceId': trace.trace_id,
+                        'stages': trace.stages
+                    })
+                
+                event_broker.publish('job', {
+                    'job': job_id,
+                    'state': 'received',
+                    'printer': job.get('printerId', 'unknown')
+                })
                 
                 # Print beautiful console output
-                self._print_job_to_console(job, len(print_jobs))
+                self._print_job_to_console(job, job_id)
                 
                 # Check if this is IP printing
-                ip_success, ip_message = self._handle_ip_printing(job)
+                ip_success, ip_message, ip_printer, ip_estimate = self._handle_ip_printing(job, job_id, trace)
                 
                 response_data = {
                     'success': True,
                     'message': 'Print job processed successfully',
-                    'jobId': len(print_jobs),
+                    'jobId': job_id,
+                    'traceId': trace.trace_id,
                     'timestamp': timestamp,
                     'printer': job.get('printerId', 'unknown'),
                     'lines': len(job.get('lines', []))
                 }
                 
                 # Add IP printing status to response
-                if self._is_ip_address(job.get('printerId', '')):
+                if self._is_print_target(job.get('printerId', '')):
                     response_data['ipPrinting'] = {
                         'attempted': True,
                         'success': ip_success,
-                        'message': ip_message
+                        'message': ip_message,
+                        'printer': ip_printer
                     }
+                    if ip_estimate is not None:
+                        response_data['ipPrinting']['estimate'] = ip_estimate
                     
                     if ip_success:
                         print(f"✅ {ip_message}")
@@ -161,70 +437,441 @@ class PrintServerHandler(BaseHTTPRequestHandler):
                         response_data['message'] += f" (IP printing failed: {ip_message})"
                 
                 # Send success response
-                self._send_json_response(200, response_data)
+                self._send_json_response(200, response_data, headers={'X-Request-Id': trace.trace_id})
                 
+            except PayloadError as e:
+                print(f"❌ Rejected print job: {e}")
+                if not e.body_consumed:
+                    self.close_connection = True
+                self._send_json_response(e.status_code, {
+                    'success': False,
+                    'error': 'Invalid print job',
+                    'message': str(e)
+                })
             except Exception as e:
                 print(f"❌ Error processing print job: {e}")
+                # The body may be partly unread, so don't reuse this connection
+                self.close_connection = True
                 self._send_json_response(500, {
                     'success': False,
                     'error': 'Failed to process print job',
                     'message': str(e)
                 })
         else:
-            self._send_json_response(404, {
-                'success': False,
-                'error': 'Endpoint not found'
-            })
+            self._discard_body()
+            self._send_static(NOT_FOUND_RESPONSE)
     
+    @profiled
     def do_DELETE(self):
         """Handle DELETE requests"""
         path = urlparse(self.path).path
         
         if path == '/jobs':
-            count = len(print_jobs)
-            print_jobs.clear()
+            with print_jobs_lock:
+                count = len(print_jobs)
+                print_jobs.clear()
             print(f"🗑️ Cleared {count} print jobs")
             self._send_json_response(200, {
                 'message': f'Cleared {count} print jobs'
             })
         else:
+            self._send_static(NOT_FOUND_RESPONSE)
+    
+    def _handle_debug(self, path, query):
+        """Admin-only profiling endpoints, enabled by EZDINE_ADMIN_TOKEN"""
+        import hmac
+        token = self.headers.get('X-Admin-Token', '')
+        if not ADMIN_TOKEN or not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            self._send_static(NOT_FOUND_RESPONSE)
+            return
+        
+        def number(name, default):
+            try:
+                return float(query.get(name, [default])[0])
+            except ValueError:
+                return default
+        
+        if path == '/debug/profile' and self.command == 'POST':
+            request_profiler.arm(int(number('requests', 1)))
+            self._send_json_response(200, request_profiler.status())
+        
+        elif path == '/debug/profile':
+            self._send_json_response(200, {
+                **request_profiler.status(),
+                'sampling': stack_sampler.running,
+                'lastSample': stack_sampler.last_output
+            })
+        
+        elif path == '/debug/sample' and self.command == 'POST':
+            output = stack_sampler.start(number('seconds', 10), number('interval', 10) / 1000)
+            if output is None:
+                self._send_json_response(409, {
+                    'success': False,
+                    'error': 'A sampling run is already in progress'
+                })
+            else:
+                self._send_json_response(202, {'success': True, 'file': output})
+        
+        elif path == '/debug/memory' and self.command == 'POST':
+            self._send_json_response(200, memory_tracker.snapshot(int(number('top', 10))))
+        
+        else:
+            self._send_static(NOT_FOUND_RESPONSE)
+    
+    def _handle_export(self, query):
+        """Stream persisted job history as NDJSON or CSV, oldest first"""
+        if job_history is None:
+            self._send_json_response(501, {
+                'success': False,
+                'error': 'Job history is turned off (EZDINE_JOB_HISTORY)'
+            })
+            return
+        
+        accept_csv = 'text/csv' in self.headers.get('Accept', '')
+        fmt = query.get('format', ['csv' if accept_csv else 'ndjson'])[0]
+        try:
+            if fmt not in EXPORT_FORMATS:
+                raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+            since = parse_time(query['since'][0]) if 'since' in query else 0.0
+            until = parse_time(query['until'][0]) if 'until' in query else float('inf')
+        except ValueError as e:
+            self._send_json_response(400, {
+                'success': False,
+                'error': 'Invalid export query',
+                'message': str(e)
+            })
+            return
+        
+        printer = query.get('printer', [None])[0]
+        content_type = 'text/csv; charset=utf-8' if fmt == 'csv' else 'application/x-ndjson'
+        print(f"📤 Exporting job history as {fmt}{f' for {printer}' if printer else ''}")
+        self._send_chunked(200, job_history.export(fmt, since, until, printer), content_type, headers={
+            'Content-Disposition': f'attachment; filename="print-jobs.{fmt}"'
+        })
+    
+    def _find_job(self, job_id):
+        """Look up a stored job record by id"""
+        with print_jobs_lock:
+            for job in reversed(print_jobs):
+                if job['id'] == job_id:
+                    return {**job, 'stages': dict(job.get('stages', {}))}
+        return None
+    
+    def _handle_raw_print(self, query, trace):
+        """Stream an application/octet-stream ESC/POS body straight into the printer queue"""
+        printer_id = query.get('printerId', [self.headers.get('X-Printer-Id', '')])[0]
+        length = self.headers.get('Content-Length')
+        
+        if length is None or not length.isdigit():
+            self.close_connection = True
+            self._send_json_response(411, {
+                'success': False,
+                'error': 'Content-Length required'
+            })
+            return
+        
+        body = BodyReader(self.rfile, int(length))
+        encoding = self.headers.get('Content-Encoding', 'identity').lower()
+        
+        if not self._is_print_target(printer_id) or encoding not in ('identity', 'gzip'):
+            body.drain()
+            self._send_json_response(400, {
+                'success': False,
+                'error': (f'Unsupported Content-Encoding: {encoding}' if encoding not in ('identity', 'gzip')
+                          else 'printerId must be a printer address or group')
+            })
+            return
+        
+        if not IP_PRINTING_AVAILABLE:
+            body.drain()
+            self._send_json_response(500, {
+                'success': False,
+                'error': 'IP printing module not available'
+            })
+            return
+        
+        try:
+            dispatcher.admit(printer_id)
+        except QueueFull as e:
+            # Don't read a body that won't be printed
+            self.close_connection = True
+            self._send_queue_full(e)
+            return
+        
+        source = GzipBodyReader(body) if encoding == 'gzip' else body
+        
+        timestamp = datetime.datetime.now().isoformat()
+        with print_jobs_lock:
+            job_id = len(print_jobs) + 1
+            job_record = {
+                'printerId': printer_id,
+                'type': 'raw',
+                'bytes': int(length),
+                'timestamp': timestamp,
+                'id': job_id,
+                'traceId': trace.trace_id,
+                'stages': trace.stages
+            }
+            print_jobs.append(job_record)
+        
+        event_broker.publish('job', {'job': job_id, 'state': 'received', 'printer': printer_id})
+        print(f"\n📦 RAW PRINT JOB #{job_id}: {length} bytes ({encoding}) for {printer_id}")
+        
+        # The printer worker reads the body from rfile, so wait until it is finished with it
+        trace.mark('parsed')
+        # A gzip body's Content-Length undercounts the bytes the printer gets
+        submitted = datetime.datetime.now()
+        record = functools.partial(_record_history, printer_id, submitted.timestamp(), 'raw', None, int(length))
+        task = PrintTask(job_id, [], raw_source=source, trace=trace, on_done=record, cost=stream_cost(int(length)))
+        dispatcher.submit(printer_id, task)
+        if not task.wait(PRINT_WAIT_TIMEOUT) and not task.cancel():
+            task.wait()
+        
+        if task.done:
+            status_code, message = (200 if task.success else 502), task.message
+        else:
+            status_code, message = 504, f"Print job timed out in queue for {printer_id}"
+            record(task, cancelled=message)
+        
+        try:
+            body.drain()
+        except (ConnectionError, OSError):
+            self.close_connection = True
+        
+        job_record['success'] = task.success
+        self._send_json_response(status_code, {
+            'success': task.success,
+            'message': message,
+            'jobId': job_id,
+            'traceId': trace.trace_id,
+            'timestamp': timestamp,
+            'printer': task.printer or printer_id,
+            'bytes': body.consumed,
+            'estimate': _estimate(task, submitted)
+        }, headers={'X-Request-Id': trace.trace_id})
+    
+    def _handle_reprint(self, document_id, query, trace):
+        """Send a cached document again, to its original printer or printerId, paced like a rendered job"""
+        if not IP_PRINTING_AVAILABLE:
+            self._send_json_response(500, {'success': False, 'error': 'IP printing module not available'})
+            return
+        cached = reprint_cache.get(document_id)
+        if cached is None:
             self._send_json_response(404, {
                 'success': False,
-                'error': 'Endpoint not found'
+                'error': f"Document {document_id} is not in the reprint cache; send the job again"
             })
+            return
+        data, original_printer = cached
+        printer_id = query.get('printerId', [original_printer])[0]
+        if not self._is_print_target(printer_id):
+            self._send_json_response(400, {
+                'success': False,
+                'error': 'printerId must be a printer address or group'
+            })
+            return
+        try:
+            dispatcher.admit(printer_id)
+        except QueueFull as e:
+            self._send_queue_full(e)
+            return
+        
+        duplicate = query.get('duplicate', ['0'])[0] not in ('0', 'false', '')
+        timestamp = datetime.datetime.now().isoformat()
+        with print_jobs_lock:
+            job_id = len(print_jobs) + 1
+            job_record = {
+                'printerId': printer_id,
+                'type': 'reprint',
+                'documentId': document_id,
+                'bytes': len(data),
+                'timestamp': timestamp,
+                'id': job_id,
+                'traceId': trace.trace_id,
+                'stages': trace.stages
+            }
+            print_jobs.append(job_record)
+        
+        event_broker.publish('job', {'job': job_id, 'state': 'received', 'printer': printer_id})
+        print(f"\n🔁 REPRINT #{job_id}: {document_id} ({len(data)} bytes) for {printer_id}"
+              f"{' as DUPLICATE' if duplicate else ''}")
+        
+        trace.mark('parsed')
+        banner = DUPLICATE_BANNER if duplicate else b''
+        submitted = datetime.datetime.now()
+        record = functools.partial(_record_history, printer_id, submitted.timestamp(), 'reprint', document_id,
+                                   len(banner) + len(data))
+        task = PrintTask(job_id, [], rendered=[banner, data], trace=trace, on_done=record,
+                         cost=escpos_cost(banner + data))
+        dispatcher.submit(printer_id, task)
+        if not task.wait(PRINT_WAIT_TIMEOUT) and not task.cancel():
+            task.wait()
+        
+        if task.done:
+            status_code, message = (200 if task.success else 502), task.message
+        else:
+            status_code, message = 504, f"Reprint still queued for {printer_id}"
+            record(task, cancelled=message)
+        
+        job_record['success'] = task.success
+        self._send_json_response(status_code, {
+            'success': task.success,
+            'message': message,
+            'jobId': job_id,
+            'documentId': document_id,
+            'traceId': trace.trace_id,
+            'timestamp': timestamp,
+            'printer': task.printer or printer_id,
+            'estimate': _estimate(task, submitted)
+        }, headers={'X-Request-Id': trace.trace_id})
+    
+    def _print_settings(self, job):
+        """Paper width and codepage for a job, a named printer's own taking precedence"""
+        entry = registry.get(job.get('printerId', ''))
+        if entry is not None:
+            return entry.width or job.get('width', 80), entry.codepage
+        return job.get('width', 80), None
+    
+    def _handle_preview(self, query):
+        """Render a /print body through the same ESC/POS path as printing, as a PNG or text"""
+        if not IP_PRINTING_AVAILABLE:
+            self._discard_body()
+            self._send_json_response(503, {'success': False, 'error': 'IP printing module not available'})
+            return
+        try:
+            job = read_payload(self.rfile, self.headers)
+            paper_width, codepage = self._print_settings(job)
+            job = apply_template(job, paper_width)
+        except PayloadError as e:
+            if not e.body_consumed:
+                self.close_connection = True
+            self._send_json_response(e.status_code, {
+                'success': False,
+                'error': 'Invalid print job',
+                'message': str(e)
+            })
+            return
+        
+        fmt = query.get('format', [job.get('format', 'png')])[0]
+        if fmt not in PREVIEW_FORMATS:
+            self._send_json_response(400, {
+                'success': False,
+                'error': f"format must be one of: {', '.join(PREVIEW_FORMATS)}"
+            })
+            return
+        
+        try:
+            data = b''.join(iter_escpos(job.get('lines', []), paper_width, codepage=codepage))
+            body, key, hit = preview_cache.render(data, paper_width, fmt)
+        except PreviewUnavailable as e:
+            self._send_json_response(501, {'success': False, 'error': str(e)})
+            return
+        except Exception as e:
+            print(f"❌ Error rendering preview: {e}")
+            self._send_json_response(500, {
+                'success': False,
+                'error': 'Failed to render preview',
+                'message': str(e)
+            })
+            return
+        
+        content_type = 'image/png' if fmt == 'png' else 'text/plain; charset=utf-8'
+        self._send_body(200, body, content_type, headers={
+            'ETag': f'"{key}"',
+            'X-Preview-Cache': 'hit' if hit else 'miss'
+        })
+    
+    def _stream_events(self):
+        """Push job state transitions and printer status changes as Server-Sent Events"""
+        try:
+            last_event_id = int(self.headers.get('Last-Event-ID', ''))
+        except ValueError:
+            last_event_id = None
+        
+        subscription = event_broker.subscribe(last_event_id)
+        # The stream has no length, so it ends by closing the connection
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self._set_cors_headers()
+            self.end_headers()
+            
+            snapshot = dispatcher.status() if dispatcher else {}
+            self.wfile.write(f"event: snapshot\ndata: {json.dumps(snapshot)}\n\n".encode('utf-8'))
+            
+            while not subscription.overflowed:
+                event = subscription.get(timeout=EVENT_STREAM_PING)
+                if event is None:
+                    self.wfile.write(b": ping\n\n")
+                    continue
+                event_id, kind, data = event
+                self.wfile.write(f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n".encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            event_broker.unsubscribe(subscription)
     
     def _is_ip_address(self, address):
-        """Check if string is a valid IP address"""
-        ip_pattern = r'^(\d{1,3}\.){3}\d{1,3}$'
-        if re.match(ip_pattern, address):
-            parts = address.split('.')
-            return all(0 <= int(part) <= 255 for part in parts)
-        return False
+        """Check if string is a network printer address (IPv4, IPv6 or hostname)"""
+        return IP_PRINTING_AVAILABLE and is_network_address(address)
     
-    def _handle_ip_printing(self, job):
-        """Handle direct IP printing if printer ID is an IP address"""
+    def _is_print_target(self, printer_id):
+        """Check if printer ID is a printer address (IP, hostname, usb:, file:), a named printer or a printer group"""
+        if not IP_PRINTING_AVAILABLE:
+            return False
+        return dispatcher.is_target(printer_id)
+    
+    def _handle_ip_printing(self, job, job_id, trace=None):
+        """
+        Queue the job on its IP printer or printer group and wait for the result, returned
+        with the queue's completion estimate (None when another PC's queue prints it)
+        """
         printer_id = job.get('printerId', '')
         
-        if not self._is_ip_address(printer_id):
-            return False, "Printer ID is not an IP address"
+        if not self._is_print_target(printer_id):
+            return False, "Printer ID is not a printer address or group", None, None
         
         if not IP_PRINTING_AVAILABLE:
-            return False, "IP printing module not available"
+            return False, "IP printing module not available", None, None
         
         try:
-            lines = job.get('lines', [])
-            paper_width = job.get('width', 80)
+            if shared_queue:
+                shared_id = shared_queue.submit(printer_id, job, trace)
+                print(f"\n🎯 SHARED QUEUE JOB #{shared_id} FOR: {printer_id}")
+                result = shared_queue.wait(shared_id, PRINT_WAIT_TIMEOUT)
+                if result is None:
+                    return False, f"Print job still queued for {printer_id}", None, None
+                if result[0] and job.get('documentId'):
+                    # Another PC printed it, so render the bytes here for reprints from this one
+                    paper_width, codepage = self._print_settings(job)
+                    data = b''.join(iter_escpos(job.get('lines', []), paper_width, codepage=codepage))
+                    reprint_cache.put(str(job['documentId']), data, printer_id)
+                return (*result, None)
+            
+            # Recorded, and a document cached from what was actually sent, once it prints or fails
+            # (even after this request gives up waiting)
+            task = PrintTask(job_id, job.get('lines', []), job.get('width', 80), trace=trace,
+                             on_done=functools.partial(_print_job_done, job, time.time()))
+            if job.get('documentId'):
+                task.sent = []
             
             print(f"\n🎯 DIRECT IP PRINTING TO: {printer_id}")
-            success = print_to_ip_printer(printer_id, lines, paper_width)
+            submitted = datetime.datetime.now()
+            dispatcher.submit(printer_id, task)
+            estimate = _estimate(task, submitted)
+            print(f"⏱️ Expected to finish in {task.eta_seconds:.1f}s")
             
-            if success:
-                return True, f"Successfully printed to IP printer {printer_id}"
-            else:
-                return False, f"Failed to print to IP printer {printer_id}"
+            if not task.wait(PRINT_WAIT_TIMEOUT):
+                return False, f"Print job still queued for {printer_id}", None, estimate
+            return task.success, task.message, task.printer, estimate
                 
         except Exception as e:
-            return False, f"IP printing error: {str(e)}"
+            return False, f"IP printing error: {str(e)}", None, None
+    
+    def _print_job_to_console(self, job, job_number):
         """Print job details to console in a beautiful format"""
         print('\n🖨️ ' + '=' * 32)
         print('📄 PRINT JOB RECEIVED')
@@ -266,10 +913,70 @@ class PrintServerHandler(BaseHTTPRequestHandler):
         """Override to reduce server logging noise"""
         pass
 
+def _can_print_locally(target):
+    """True if this machine can reach target, so shared jobs for another PC's USB printer are left alone"""
+    if dispatcher.is_group(target):
+        return True
+    entry = registry.get(target)
+    transport = lookup_transport(entry.target if entry else target)
+    return transport is not None and transport.available()
+
+def start_job_history(path):
+    """Keep print results on disk for GET /jobs/export"""
+    global job_history
+    try:
+        job_history = JobHistory(path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️ Could not open job history {path}: {e}")
+        return
+    print(f"🗂️ Keeping print history in {path}")
+
+def start_shared_queue(path):
+    """Claim jobs from a job store shared with other bridges"""
+    global shared_queue
+    from shared_queue import SharedJobStore, SharedQueueWorker
+    store = SharedJobStore(path, os.environ.get('EZDINE_NODE_ID') or None)
+    shared_queue = SharedQueueWorker(store, dispatcher, _can_print_locally, history=job_history)
+    shared_queue.start()
+    print(f"🤝 Sharing print jobs via {path} as node {store.node_id}")
+
+def start_pull_worker(url):
+    """Long-poll a central job queue for print jobs"""
+    global pull_worker
+    from pull_worker import PullWorker
+    pull_worker = PullWorker(url, dispatcher, _can_print_locally, os.environ.get('EZDINE_PULL_TOKEN', ''),
+                             os.environ.get('EZDINE_NODE_ID') or None, history=job_history)
+    pull_worker.start()
+    print(f"📥 Pulling print jobs from {url} as {pull_worker.worker_id}")
+
 def run_server(port=8080):
     """Start the print server"""
+    configure_from_env()
+    
     server_address = ('', port)
-    httpd = HTTPServer(server_address, PrintServerHandler)
+    httpd = ThreadingHTTPServer(server_address, PrintServerHandler)
+    
+    if dispatcher:
+        try:
+            printer_count = load_default_registry(APP_DIR)
+            if printer_count:
+                print(f"📇 Loaded {printer_count} named printer(s) from {registry.path}")
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not load printer registry: {e}")
+        
+        try:
+            group_count = load_default_groups(dispatcher, APP_DIR)
+            if group_count:
+                print(f"👥 Loaded {group_count} printer group(s)")
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not load printer groups: {e}")
+        
+        if HISTORY_PATH:
+            start_job_history(HISTORY_PATH)
+        if JOB_STORE_PATH:
+            start_shared_queue(JOB_STORE_PATH)
+        if PULL_URL:
+            start_pull_worker(PULL_URL)
     
     print('\n🚀 ' + '=' * 32)
     print('🖨️  EZDINE PRINT SERVER STARTED')
@@ -277,6 +984,7 @@ def run_server(port=8080):
     print('🌐 Server URL:', f'http://localhost:{port}')
     print('💚 Health Check:', f'http://localhost:{port}/health')
     print('📋 View Jobs:', f'http://localhost:{port}/jobs')
+    print('📡 Live Status:', f'http://localhost:{port}/events')
     print('🔧 Ready to receive print jobs from EZDine web app')
     print('=' * 32 + '\n')
     
@@ -294,12 +1002,17 @@ def run_server(port=8080):
         print('\n\n🛑 Server stopped by user')
         httpd.server_close()
 
-if __name__ == '__main__':
+def main(argv=None):
+    """Entry point for `python3 server.py [port]` and the ezdine-print-bridge zipapp"""
+    argv = sys.argv[1:] if argv is None else argv
     port = 8080
-    if len(sys.argv) > 1:
+    if argv:
         try:
-            port = int(sys.argv[1])
+            port = int(argv[0])
         except ValueError:
             print('Invalid port number, using default 8080')
     
-    run_server(port)
\ No newline at end of file
+    run_server(port)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Shared Queue Module for EZDine
+Lets two or more print servers share one SQLite job store, claiming jobs through
+time-limited leases so a node that dies mid-job has its work picked up by another
+"""
+
+import functools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple
+
+from job_trace import JobTrace
+from print_queue import PrintDispatcher, PrintTask
+
+# How long a claimed job stays with its node without a lease renewal
+LEASE_SECONDS = float(os.environ.get('EZDINE_LEASE_SECONDS', 30))
+
+# Most jobs one node holds leases on at a time, the rest are left for other nodes
+MAX_IN_FLIGHT = int(os.environ.get('EZDINE_SHARED_IN_FLIGHT', 4))
+
+# Claims after which a job that keeps losing its node is failed instead of retried
+MAX_ATTEMPTS = 3
+
+# Seconds between claim / renew passes, and between result checks while waiting
+POLL_INTERVAL = 0.2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    trace_id TEXT,
+    state TEXT NOT NULL DEFAULT 'queued',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    finished REAL,
+    printer TEXT,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SharedJobStore:
+    """
+    Job table in a SQLite file that every node opens
+
+    States: queued -> leased (owner, lease_until) -> printed / failed. A leased job whose
+    lease has run out is claimable again. Rollback journal rather than WAL, since WAL
+    doesn't work on network shares.
+    """
+
+    def __init__(self, path: str, node_id: Optional[str] = None, lease_seconds: float = LEASE_SECONDS):
+        self.path = path
+        self.node_id = node_id or default_node_id()
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+
+    def _transaction(self):
+        return _Transaction(self._db, self._lock)
+
+    def enqueue(self, target: str, payload: Dict[str, Any], trace_id: Optional[str] = None) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT INTO jobs (target, payload, trace_id, created) VALUES (?, ?, ?, ?)',
+                (target, json.dumps(payload), trace_id, time.time()))
+            return cursor.lastrowid
+
+    def claim(self, limit: int, accepts: Callable[[str], bool] = lambda target: True,
+              exclusive: Callable[[str], bool] = lambda target: True,
+              held: Collection[int] = ()) -> List[sqlite3.Row]:
+        """
+        Lease up to limit claimable jobs, oldest first
+
+        Jobs for targets this node can't print are left alone. For exclusive targets (single
+        printers, not groups) jobs are skipped while another node holds a live lease on the
+        same target, so two nodes don't fight over one printer's connection. Jobs in held are
+        still being printed here, even if their lease lapsed, and aren't claimed twice.
+        """
+        if limit <= 0:
+            return []
+        now = time.time()
+        with self._transaction() as db:
+            rows = db.execute(
+                "SELECT * FROM jobs WHERE state = 'queued' OR (state = 'leased' AND lease_until < ?) "
+                "ORDER BY id LIMIT ?", (now, limit + 50)).fetchall()
+            if not rows:
+                return []
+            busy = {row['target'] for row in db.execute(
+                "SELECT DISTINCT target FROM jobs WHERE state = 'leased' AND lease_until >= ? AND owner != ?",
+                (now, self.node_id))}
+
+            claimed = []
+            for row in rows:
+                if len(claimed) >= limit:
+                    break
+                if row['id'] in held or not accepts(row['target']) or (row['target'] in busy and exclusive(row['target'])):
+                    continue
+                if row['attempts'] >= MAX_ATTEMPTS:
+                    db.execute("UPDATE jobs SET state = 'failed', finished = ?, message = ? WHERE id = ?",
+                               (now, f"Gave up after {row['attempts']} attempts", row['id']))
+                    continue
+                db.execute("UPDATE jobs SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 "
+                           "WHERE id = ?", (self.node_id, now + self.lease_seconds, row['id']))
+                claimed.append(row)
+            return claimed
+
+    def renew(self, job_ids: List[int]) -> List[int]:
+        """Extend this node's leases on jobs it is still printing, returns the ids it no longer holds"""
+        lost = []
+        if not job_ids:
+            return lost
+        with self._transaction() as db:
+            lease_until = time.time() + self.lease_seconds
+            for job_id in job_ids:
+                cursor = db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                                    (lease_until, job_id, self.node_id))
+                if cursor.rowcount != 1:
+                    lost.append(job_id)
+        return lost
+
+    def complete(self, job_id: int, success: bool, printer: Optional[str], message: str) -> bool:
+        """Record a result, False if the lease was lost to another node in the meantime"""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET state = ?, finished = ?, printer = ?, message = ? "
+                "WHERE id = ? AND owner = ? AND state = 'leased'",
+                ('printed' if success else 'failed', time.time(), printer, message, job_id, self.node_id))
+            return cursor.rowcount == 1
+
+    def get(self, job_id: int) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {'queued': 0, 'leased': 0, **{row[0]: row[1] for row in
+                    self._db.execute("SELECT state, COUNT(*) FROM jobs WHERE state IN ('queued', 'leased') "
+                                     "GROUP BY state")}}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, so claims by different nodes can't interleave"""
+
+    def __init__(self, db: sqlite3.Connection, lock: threading.Lock):
+        self._db = db
+        self._lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._lock.acquire()
+        try:
+            self._db.execute('BEGIN IMMEDIATE')
+        except BaseException:
+            self._lock.release()
+            raise
+        return self._db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self._lock.release()
+
+
+class SharedQueueWorker:
+    """Claims jobs from the shared store into the local dispatcher and reports results back"""
+
+    def __init__(self, store: SharedJobStore, dispatcher: PrintDispatcher,
+                 accepts: Callable[[str], bool], max_in_flight: int = MAX_IN_FLIGHT, history: Any = None):
+        self.store = store
+        self.dispatcher = dispatcher
+        self.accepts = accepts
+        self.max_in_flight = max_in_flight
+        # JobHistory the results of jobs printed here are recorded in, if any
+        self.history = history
+        self.claimed = 0
+        self.lost = 0
+        self._renewed_at = 0.0
+        self._in_flight: Dict[int, PrintTask] = {}
+        # Traces of jobs submitted through this node, so stages show up in its /jobs
+        self._traces: Dict[int, JobTrace] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='shared-queue', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, target: str, job: Dict[str, Any], trace: Optional[JobTrace] = None) -> int:
+        """Put a job in the shared store, returns its shared id"""
+        payload = {'lines': job.get('lines', []), 'width': job.get('width', 80), 'type': job.get('type'),
+                   'documentId': job.get('documentId')}
+        job_id = self.store.enqueue(target, payload, trace.trace_id if trace else None)
+        if trace is not None:
+            with self._lock:
+                self._traces[job_id] = trace
+        self._wake.set()
+        return job_id
+
+    def wait(self, job_id: int, timeout: float) -> Optional[Tuple[bool, str, Optional[str]]]:
+        """Block until any node has printed or failed the job; None on timeout"""
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                row = self.store.get(job_id)
+                if row is not None and row['state'] in ('printed', 'failed'):
+                    return row['state'] == 'printed', row['message'] or '', row['printer']
+                if time.monotonic() >= deadline:
+                    return None
+                time.sleep(POLL_INTERVAL)
+        finally:
+            with self._lock:
+                self._traces.pop(job_id, None)
+
+    def _run(self):
+        while True:
+            try:
+                self._reap()
+                self._renew()
+                self._claim()
+            except sqlite3.Error as e:
+                print(f"⚠️ Shared job store error: {e}")
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+    def _claim(self):
+        with self._lock:
+            room = self.max_in_flight - len(self._in_flight)
+            held = set(self._in_flight)
+        rows = self.store.claim(room, self.accepts, lambda target: not self.dispatcher.is_group(target), held)
+        for row in rows:
+            payload = json.loads(row['payload'])
+            with self._lock:
+                trace = self._traces.get(row['id']) or JobTrace(row['trace_id'] or f"shared-{row['id']}")
+            task = PrintTask(row['id'], payload.get('lines', []), payload.get('width', 80), trace=trace,
+                             on_done=functools.partial(self._finished, row['target'], row['created'], payload))
+            with self._lock:
+                self._in_flight[row['id']] = task
+            self.claimed += 1
+            if row['attempts']:
+                print(f"🔁 Shared job #{row['id']}: taking over from {row['owner']} (lease expired)")
+            self.dispatcher.submit(row['target'], task)
+
+    def _finished(self, target: str, created: float, payload: Dict[str, Any], task: PrintTask):
+        # The node that printed a job records it, whichever node it was submitted to
+        if self.history is not None:
+            self.history.record_task(target, task, created, payload.get('type'), payload.get('documentId'))
+
+    def _renew(self):
+        # A third of the lease leaves two more chances to renew before it runs out
+        if time.monotonic() - self._renewed_at < self.store.lease_seconds / 3:
+            return
+        self._renewed_at = time.monotonic()
+        with self._lock:
+            job_ids = list(self._in_flight)
+        for job_id in self.store.renew(job_ids):
+            # Another node took the job over; drop our copy unless it is already printing
+            with self._lock:
+                task = self._in_flight.get(job_id)
+                if task is None or not task.cancel():
+                    continue
+                del self._in_flight[job_id]
+            self.lost += 1
+            print(f"⚠️ Shared job #{job_id}: taken over by another node, dropping local copy")
+
+    def _reap(self):
+        with self._lock:
+            finished = [(job_id, task) for job_id, task in self._in_flight.items() if task.done]
+            for job_id, _ in finished:
+                del self._in_flight[job_id]
+        for job_id, task in finished:
+            if not self.store.complete(job_id, task.success, task.printer, task.message):
+                self.lost += 1
+                print(f"⚠️ Shared job #{job_id}: lease was lost before the result was recorded")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return {
+            'node': self.store.node_id,
+            'store': self.store.path,
+            'inFlight': in_flight,
+            'claimed': self.claimed,
+            'lost': self.lost,
+            **self.store.counts()
+        }
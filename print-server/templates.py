@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Receipt Templates Module for EZDine
+Named receipt layouts (KOT, invoice, token slip) kept on the bridge, so clients send the
+order data instead of building lines. Each template file is compiled into a render plan
+per paper width and recompiled only when the file changes
+"""
+
+import collections
+import datetime
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app_paths import APP_DIR
+from preview import CHAR_WIDTH, dot_width, paper_size
+from request_body import PayloadError
+
+# Folder of <name>.json template files
+TEMPLATE_DIR = os.environ.get('EZDINE_TEMPLATE_DIR') or os.path.join(APP_DIR, 'templates')
+
+# Seconds between checks of a template file for changes
+CHECK_INTERVAL = 1.0
+
+# {field} or {field|filter|filter} inside template text
+FIELD_PATTERN = re.compile(r'\{([A-Za-z_][\w.]*)((?:\|\w+)*)\}')
+NAME_PATTERN = re.compile(r'^[\w-]+$')
+
+FILTERS: Dict[str, Callable[[Any], str]] = {
+    'upper': lambda value: str(value).upper(),
+    'lower': lambda value: str(value).lower(),
+    'money': lambda value: f"{float(value or 0):.2f}",
+    'int': lambda value: str(int(float(value or 0))),
+    'count': lambda value: str(len(value or ())),
+}
+
+Context = collections.ChainMap
+Render = Callable[[Context], str]
+
+
+class TemplateError(ValueError):
+    """Template file or order data that can't be rendered"""
+
+
+def _lookup(context: Context, path: str) -> Any:
+    value: Any = context
+    for key in path.split('.'):
+        value = value.get(key) if hasattr(value, 'get') else None
+        if value is None:
+            return None
+    return value
+
+
+def _compile_text(source: str) -> Render:
+    """Split text into literals and field lookups once, so rendering is a join"""
+    parts: List[Any] = []
+    position = 0
+    for match in FIELD_PATTERN.finditer(source):
+        parts.append(source[position:match.start()])
+        parts.append(_compile_field(match.group(1), match.group(2)))
+        position = match.end()
+    parts.append(source[position:])
+    parts = [part for part in parts if part != '']
+    if all(isinstance(part, str) for part in parts):
+        constant = ''.join(parts)
+        return lambda context: constant
+    return lambda context: ''.join(part if isinstance(part, str) else part(context) for part in parts)
+
+
+def _compile_field(path: str, filters: str) -> Render:
+    names = [name for name in filters.split('|') if name]
+    for name in names:
+        if name not in FILTERS:
+            raise TemplateError(f"Unknown filter '{name}' (available: {', '.join(FILTERS)})")
+    chain = [FILTERS[name] for name in names]
+
+    def render(context: Context) -> str:
+        value = _lookup(context, path)
+        if value is None:
+            return ''
+        for apply in chain:
+            value = apply(value)
+        return str(value)
+    return render
+
+
+def _compile_condition(spec: Dict[str, Any]) -> Optional[Callable[[Context], bool]]:
+    if 'if' in spec:
+        path = spec['if']
+        return lambda context: bool(_lookup(context, path))
+    if 'unless' in spec:
+        path = spec['unless']
+        return lambda context: not _lookup(context, path)
+    return None
+
+
+def _fit(text: str, width: int, align: str) -> str:
+    if len(text) > width:
+        # Long item names are shortened the way the web app did, 'PANEER TIKKA MAS..'
+        return text[:width - 2] + '..' if width > 2 else text[:width]
+    if align == 'right':
+        return text.rjust(width)
+    if align == 'center':
+        return text.center(width)
+    return text.ljust(width)
+
+
+def _cell_width(spec: Dict[str, Any], paper_width: int) -> Any:
+    width = spec.get('width', 'auto')
+    if isinstance(width, dict):
+        width = width.get(str(paper_width), width.get('default', 'auto'))
+    if width not in ('*', 'auto') and not isinstance(width, int):
+        raise TemplateError(f"Column width must be a number, '*' or 'auto', not {width!r}")
+    return width
+
+
+def _compile_columns(spec: Dict[str, Any], columns: int, paper_width: int) -> Render:
+    """A row of fixed, 'auto' (own length) and '*' (rest of the line) width cells"""
+    gap = ' ' * spec.get('gap', 1)
+    cells = [(_compile_text(cell.get('text', '')), _cell_width(cell, paper_width), cell.get('align', 'left'),
+              _compile_condition(cell)) for cell in spec['columns']]
+    fixed = sum(width for _, width, _, _ in cells if isinstance(width, int)) + len(gap) * (len(cells) - 1)
+
+    def render(context: Context) -> str:
+        texts = [text(context) if condition is None or condition(context) else ''
+                 for text, _, _, condition in cells]
+        used = fixed + sum(len(texts[i]) for i, cell in enumerate(cells) if cell[1] == 'auto')
+        stars = sum(1 for cell in cells if cell[1] == '*')
+        rest = max(1, (columns - used) // stars) if stars else 0
+        out = []
+        for content, (_, width, align, _) in zip(texts, cells):
+            out.append(_fit(content, len(content) if width == 'auto' else rest if width == '*' else width, align))
+        return gap.join(out)
+    return render
+
+
+Step = Callable[[Context, List[Dict[str, Any]]], None]
+
+
+def _compile_lines(specs: List[Dict[str, Any]], columns: int, paper_width: int) -> List[Step]:
+    steps = []
+    for spec in specs:
+        if not isinstance(spec, dict):
+            raise TemplateError(f"Template lines must be objects, not {spec!r}")
+        condition = _compile_condition(spec)
+        if 'each' in spec:
+            step = _compile_each(spec, columns, paper_width)
+        else:
+            if 'divider' in spec:
+                text = _compile_text(spec['divider'][:1] * columns)
+            elif 'columns' in spec:
+                text = _compile_columns(spec, columns, paper_width)
+            elif 'text' in spec:
+                text = _compile_text(spec['text'])
+            else:
+                raise TemplateError(f"Template line needs text, columns, divider or each: {spec!r}")
+            step = _line_step(text, spec.get('align', 'left'), bool(spec.get('bold', False)))
+        steps.append(step if condition is None else _conditional(condition, step))
+    return steps
+
+
+def _line_step(text: Render, align: str, bold: bool) -> Step:
+    def step(context: Context, out: List[Dict[str, Any]]):
+        out.append({'text': text(context), 'align': align, 'bold': bold})
+    return step
+
+
+def _conditional(condition: Callable[[Context], bool], step: Step) -> Step:
+    def conditional(context: Context, out: List[Dict[str, Any]]):
+        if condition(context):
+            step(context, out)
+    return conditional
+
+
+def _compile_each(spec: Dict[str, Any], columns: int, paper_width: int) -> Step:
+    path = spec['each']
+    body = _compile_lines(spec.get('lines', []), columns, paper_width)
+
+    def each(context: Context, out: List[Dict[str, Any]]):
+        for item in _lookup(context, path) or ():
+            if not isinstance(item, dict):
+                item = {'value': item}
+            elif 'amount' not in item and 'price' in item:
+                # Line totals are derived so clients don't have to send them
+                item = {**item, 'amount': float(item.get('price') or 0) * float(item.get('qty') or 1)}
+            scope = context.new_child(item)
+            for step in body:
+                step(scope, out)
+    return each
+
+
+class Template:
+    """One parsed template file, with a compiled plan per paper width"""
+
+    def __init__(self, name: str, spec: Dict[str, Any]):
+        if not isinstance(spec.get('lines'), list):
+            raise TemplateError(f"Template '{name}' has no lines list")
+        self.name = name
+        self.spec = spec
+        self.defaults = spec.get('defaults', {})
+        self._plans: Dict[int, List[Step]] = {}
+        # Compile the common widths now, so mistakes show up when the file is loaded
+        for paper_width in (58, 80):
+            self.plan(paper_width)
+
+    def plan(self, paper_width: int) -> List[Step]:
+        # Any width is laid out as 58 or 80 mm, so there are never more than two plans
+        paper_width = paper_size(paper_width)
+        plan = self._plans.get(paper_width)
+        if plan is None:
+            plan = _compile_lines(self.spec['lines'], dot_width(paper_width) // CHAR_WIDTH, paper_width)
+            self._plans[paper_width] = plan
+        return plan
+
+    def render(self, data: Dict[str, Any], paper_width: int = 80) -> List[Dict[str, Any]]:
+        now = datetime.datetime.now()
+        context = Context(data, {'date': now.strftime('%d/%m/%Y'), 'time': now.strftime('%H:%M')}, self.defaults)
+        out: List[Dict[str, Any]] = []
+        for step in self.plan(paper_width):
+            step(context, out)
+        return out
+
+
+class TemplateStore:
+    """Templates by name, loaded on first use and reloaded when their file changes"""
+
+    def __init__(self, directory: str = TEMPLATE_DIR):
+        self.directory = directory
+        self.compiles = 0
+        self._entries: Dict[str, Tuple[Template, Any, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Template:
+        if not NAME_PATTERN.match(name or ''):
+            raise TemplateError(f"Invalid template name '{name}'")
+        now = time.monotonic()
+        entry = self._entries.get(name)
+        if entry is not None and now - entry[2] < CHECK_INTERVAL:
+            return entry[0]
+
+        with self._lock:
+            path = os.path.join(self.directory, name + '.json')
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._entries.pop(name, None)
+                raise TemplateError(f"Unknown template '{name}'")
+            signature = (stat.st_mtime, stat.st_size)
+            entry = self._entries.get(name)
+            if entry is not None and entry[1] == signature:
+                template = entry[0]
+            else:
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        template = Template(name, json.load(f))
+                except (OSError, ValueError) as e:
+                    raise TemplateError(f"Template '{name}' could not be loaded: {e}")
+                self.compiles += 1
+                if entry is not None:
+                    print(f"🔄 Receipt template '{name}' reloaded")
+            self._entries[name] = (template, signature, now)
+            return template
+
+    def render(self, name: str, data: Dict[str, Any], paper_width: int = 80) -> List[Dict[str, Any]]:
+        if not isinstance(data, dict):
+            raise TemplateError("Template data must be an object")
+        return self.get(name).render(data, paper_width)
+
+    def status(self) -> Dict[str, Any]:
+        return {'directory': self.directory, 'loaded': sorted(self._entries), 'compiles': self.compiles}
+
+
+templates = TemplateStore()
+
+
+def apply_template(job: Dict[str, Any], paper_width: int) -> Dict[str, Any]:
+    """Fill in lines for a job naming a template, raises PayloadError for a bad template or data"""
+    name = job.get('template')
+    if not name:
+        return job
+    try:
+        lines = templates.render(name, job.get('data') or {}, paper_width)
+    except TemplateError as e:
+        raise PayloadError(422, str(e))
+    except (TypeError, ValueError) as e:
+        raise PayloadError(422, f"Template '{name}' could not use the order data: {e}")
+    return {**job, 'lines': lines}
@@ -0,0 +1,6 @@
+"""Lets the tests import the print-server modules from any working directory"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Tests for streaming NDJSON jobs to the printers with bulk_print
+Run from print-server: python3 -m pytest tests (or python3 -m unittest discover tests)
+"""
+
+import io
+import json
+import unittest
+
+from bulk_print import bulk_print
+from print_queue import PrintDispatcher
+
+
+class BulkPrintTest(unittest.TestCase):
+
+    def run_jobs(self, data):
+        output = io.StringIO()
+        results = bulk_print(io.BytesIO(data), output, window=2,
+                             dispatcher=PrintDispatcher(lambda address, task: True))
+        return results, sorted((json.loads(line) for line in output.getvalue().splitlines()),
+                               key=lambda row: row['line'])
+
+    def test_jobs_print(self):
+        results, rows = self.run_jobs(b'{"id": "a", "printerId": "10.0.0.5", "lines": [{"text": "Dosa"}]}\n'
+                                      b'\n'
+                                      b'{"printerId": "10.0.0.6", "lines": [{"text": "Tea"}]}\n')
+        self.assertEqual((results.succeeded, results.failed), (2, 0))
+        self.assertEqual([(row['line'], row['id'], row['printer']) for row in rows],
+                         [(1, 'a', '10.0.0.5'), (3, 3, '10.0.0.6')])
+
+    def test_bad_line_fails_only_that_job(self):
+        results, rows = self.run_jobs(b'{"id": "a", "printerId": "10.0.0.5", "lines": [{"text": "Caf\xe9"}]}\n'
+                                      b'{"id": "b", "printerId": "10.0.0.5", "lines": [{"text": "Tea"}]}\n'
+                                      b'not json\n'
+                                      b'{"id": "c", "printerId": "10.0.0.5", "lines": [{"text": "Vada"}]}\n')
+        self.assertEqual((results.succeeded, results.failed), (2, 2))
+        self.assertEqual([(row['line'], row['success']) for row in rows],
+                         [(1, False), (2, True), (3, False), (4, True)])
+        self.assertIn('utf-8', rows[0]['message'])
+
+
+if __name__ == '__main__':
+    unittest.main()
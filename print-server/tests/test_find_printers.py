@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests for fingerprinting port 9100 devices and caching what they are
+Run from print-server: python3 -m pytest tests (or python3 -m unittest discover tests)
+"""
+
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import find_printers
+from find_printers import FingerprintCache, fingerprint
+
+
+def _device(reply):
+    """A one-connection TCP device answering its first query with reply (None to stay silent)"""
+    server = socket.create_server(('127.0.0.1', 0))
+
+    def serve():
+        connection, _ = server.accept()
+        with connection:
+            connection.recv(16)
+            if reply is not None:
+                connection.sendall(reply)
+            time.sleep(0.5)
+        server.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()[1]
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(find_printers, 'FINGERPRINT_REPLY_TIMEOUT', 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_escpos_status_reply(self):
+        self.assertEqual(fingerprint('127.0.0.1', _device(b'\x16'))['kind'], 'escpos')
+
+    def test_reply_that_is_not_a_status(self):
+        self.assertEqual(fingerprint('127.0.0.1', _device(b'\xff'))['kind'], 'other')
+
+    def test_silent_or_refusing_device_is_unknown(self):
+        self.assertEqual(fingerprint('127.0.0.1', _device(None))['kind'], 'unknown')
+        closed = socket.create_server(('127.0.0.1', 0))
+        port = closed.getsockname()[1]
+        closed.close()
+        self.assertEqual(fingerprint('127.0.0.1', port)['kind'], 'unknown')
+
+
+class FingerprintCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = FingerprintCache(os.path.join(self.directory.name, 'fingerprints.json'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_printers_are_kept(self):
+        self.cache.put({'ip': '10.0.0.5', 'mac': 'aa:bb:cc:dd:ee:ff', 'kind': 'escpos'})
+        # Found again at a new DHCP address by its MAC
+        self.assertEqual(self.cache.get('10.0.0.9', 'aa:bb:cc:dd:ee:ff')['ip'], '10.0.0.9')
+        self.cache.save()
+        reloaded = FingerprintCache(self.cache.path)
+        self.assertEqual(reloaded.get('10.0.0.5', 'aa:bb:cc:dd:ee:ff')['kind'], 'escpos')
+
+    def test_other_answers_expire(self):
+        self.cache.put({'ip': '10.0.0.6', 'mac': None, 'kind': 'other'})
+        self.cache.put({'ip': '10.0.0.7', 'mac': None, 'kind': 'unknown'})
+        self.assertEqual(self.cache.get('10.0.0.6')['kind'], 'other')
+        self.assertEqual(self.cache.get('10.0.0.7')['kind'], 'unknown')
+        with mock.patch.object(find_printers.time, 'time', return_value=time.time() + 601):
+            self.assertIsNotNone(self.cache.get('10.0.0.6'))
+            self.assertIsNone(self.cache.get('10.0.0.7'))
+
+    def test_answers_cached_without_expiry_are_asked_again(self):
+        self.cache.devices = {'10.0.0.6': {'ip': '10.0.0.6', 'kind': 'other'}}
+        self.assertIsNone(self.cache.get('10.0.0.6'))
+
+
+if __name__ == '__main__':
+    unittest.main()
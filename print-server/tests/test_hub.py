@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Tests for routing and tenant quotas in the print hub front end
+Run from print-server: python3 -m pytest tests (or python3 -m unittest discover tests)
+"""
+
+import threading
+import unittest
+from unittest import mock
+
+import hub
+from hub import HashRing, PrintHub
+
+
+class _ClosedQueue:
+    def put(self, item):
+        raise ValueError('Queue is closed')
+
+
+class _Worker:
+    index = 0
+    inbox = _ClosedQueue()
+
+
+def _front_end(groups=None) -> PrintHub:
+    """A PrintHub without worker processes"""
+    front = PrintHub.__new__(PrintHub)
+    front.ring = HashRing(1)
+    front.groups = groups or {}
+    front.keys = hub.shard_keys(front.groups)
+    front.quotas, front.default_quota, front.shed = {}, 2, 0
+    front.workers = [_Worker()]
+    front._ids = iter(range(1, 1000))
+    front._pending, front._in_flight = {}, {}
+    front._lock = threading.Lock()
+    return front
+
+
+class PrintHubTest(unittest.TestCase):
+
+    def test_only_printers_are_targets(self):
+        front = _front_end({'kitchen': {'members': ['10.0.0.5', '10.0.0.6']}})
+        for target in ('kitchen', '10.0.0.7', 'kitchen-printer.local', 'usb:/dev/usb/lp0'):
+            self.assertTrue(front.is_target(target), target)
+        for target in ('made-up-1', 'KITCHEN', '', '999.1.1.1'):
+            self.assertFalse(front.is_target(target), target)
+
+    def test_named_printers_are_targets(self):
+        front = _front_end()
+        with mock.patch.object(hub.registry, 'get', lambda name: object() if name == 'billing-1' else None):
+            self.assertTrue(front.is_target('billing-1'))
+            self.assertFalse(front.is_target('billing-2'))
+
+    def test_failed_handoff_releases_quota(self):
+        front = _front_end()
+        self.assertTrue(front.acquire('brand'))
+        success, message, _, _ = front.print_job('10.0.0.5', [], 80, 'brand', timeout=0.1)
+        self.assertFalse(success)
+        self.assertIn('restarting', message)
+        self.assertEqual(front._pending, {})
+        self.assertEqual(front._in_flight['brand'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
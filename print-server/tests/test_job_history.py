@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQLite job history and its exports
+Run from print-server: python3 -m pytest tests (or python3 -m unittest discover tests)
+"""
+
+import csv
+import datetime
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import job_history
+import server
+from job_history import FIELDS, JobHistory, parse_time
+from print_queue import PrintDispatcher, PrintTask
+from shared_queue import SharedJobStore, SharedQueueWorker
+
+
+class JobHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        # The writer thread keeps its connection, and so the WAL files, open
+        self.directory = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        # Recent enough not to be pruned
+        self.base = time.time() - 3600
+        self.history = JobHistory(os.path.join(self.directory.name, 'history.sqlite'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def record_jobs(self):
+        self.history.record('kitchen', True, self.base + 1, printer='10.0.0.5', job_id=1, job_type='kot',
+                            document_id='KOT-1', trace_id='t1', lines=12)
+        # A group job taken by a member printer
+        self.history.record('kitchen-group', False, self.base + 2, printer='kitchen', message='Timeout', job_id=2)
+        self.history.record('billing', True, self.base + 3, printer='billing', job_type='raw', size=2048)
+        self.history.flush()
+
+    def ndjson(self, **query):
+        return [json.loads(line) for line in b''.join(self.history.export('ndjson', **query)).splitlines()]
+
+    def test_ndjson_export_in_time_order(self):
+        self.record_jobs()
+        rows = self.ndjson()
+        self.assertEqual([row['printerId'] for row in rows], ['kitchen', 'kitchen-group', 'billing'])
+        first = rows[0]
+        self.assertEqual(list(first), [name for name, _ in FIELDS])
+        self.assertEqual(first['created'], datetime.datetime.fromtimestamp(self.base + 1).isoformat(timespec='milliseconds'))
+        self.assertIs(first['success'], True)
+        self.assertEqual((first['jobId'], first['type'], first['documentId'], first['lines']), (1, 'kot', 'KOT-1', 12))
+        self.assertEqual(rows[1]['message'], 'Timeout')
+        self.assertEqual(rows[2]['bytes'], 2048)
+        self.assertEqual(self.history.status()['written'], 3)
+
+    def test_time_range_is_half_open(self):
+        self.record_jobs()
+        self.assertEqual([row['jobId'] for row in self.ndjson(since=self.base + 1, until=self.base + 2)], [1])
+        self.assertEqual(len(self.ndjson(since=self.base + 2)), 2)
+
+    def test_printer_matches_target_or_member(self):
+        self.record_jobs()
+        self.assertEqual([row['printerId'] for row in self.ndjson(printer='kitchen')], ['kitchen', 'kitchen-group'])
+        self.assertEqual(len(self.ndjson(printer='billing')), 1)
+        self.assertEqual(self.ndjson(printer='bar'), [])
+
+    def test_csv_export(self):
+        self.record_jobs()
+        rows = list(csv.reader(io.StringIO(b''.join(self.history.export('csv')).decode('utf-8'))))
+        self.assertEqual(rows[0], [name for name, _ in FIELDS])
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[2][rows[0].index('success')], 'False')
+
+    def test_empty_csv_export_has_header(self):
+        self.assertEqual(b''.join(self.history.export('csv')).decode('utf-8').splitlines(),
+                         [','.join(name for name, _ in FIELDS)])
+        self.assertEqual(b''.join(self.history.export('ndjson')), b'')
+
+    def test_export_streams_in_batches(self):
+        for number in range(25):
+            self.history.record('p', True, self.base + number, job_id=number)
+        self.history.flush()
+        with mock.patch.object(job_history, 'EXPORT_BATCH', 10):
+            chunks = list(self.history.export('ndjson'))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(sum(chunk.count(b'\n') for chunk in chunks), 25)
+
+    def test_old_jobs_are_pruned(self):
+        history = JobHistory(os.path.join(self.directory.name, 'pruned.sqlite'), retention_days=1)
+        history.record('p', True, time.time() - 2 * 86400, job_id=1)
+        history.record('p', True, time.time(), job_id=2)
+        history.flush()
+        self.assertEqual([row['jobId'] for row in
+                          (json.loads(line) for line in b''.join(history.export('ndjson')).splitlines())], [2])
+
+
+class RecordedResultTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        self.history = JobHistory(os.path.join(self.directory.name, 'history.sqlite'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def rows(self):
+        self.history.flush()
+        return [json.loads(line) for line in b''.join(self.history.export('ndjson')).splitlines()]
+
+    def test_job_still_queued_at_the_timeout_is_recorded_once_printed(self):
+        release = threading.Event()
+
+        def send(address, task):
+            release.wait(5)
+            return True
+
+        handler = server.PrintServerHandler.__new__(server.PrintServerHandler)
+        job = {'printerId': '10.0.0.5', 'type': 'kot', 'documentId': 'KOT-7', 'lines': [{'text': 'Dosa'}]}
+        with mock.patch.object(server, 'dispatcher', PrintDispatcher(send)), \
+                mock.patch.object(server, 'job_history', self.history), \
+                mock.patch.object(server, 'PRINT_WAIT_TIMEOUT', 0.05):
+            success, message, _, _ = handler._handle_ip_printing(job, 7)
+            self.assertFalse(success)
+            self.assertIn('still queued', message)
+            # Nothing is written while the job is still on its way
+            self.assertEqual(self.rows(), [])
+            release.set()
+            deadline = time.monotonic() + 5
+            while not self.history.written and time.monotonic() < deadline:
+                time.sleep(0.01)
+        [row] = self.rows()
+        self.assertEqual((row['jobId'], row['printerId'], row['printer'], row['success']), (7, '10.0.0.5', '10.0.0.5', True))
+        self.assertEqual((row['type'], row['documentId'], row['lines']), ('kot', 'KOT-7', 1))
+
+    def test_cancelled_task(self):
+        task = PrintTask(3, [], raw_source=object())
+        self.history.record_task('kitchen', task, time.time(), 'raw', size=10, cancelled='Print job timed out in queue')
+        [row] = self.rows()
+        self.assertEqual((row['success'], row['printer'], row['bytes']), (False, None, 10))
+        self.assertEqual(row['message'], 'Cancelled: Print job timed out in queue')
+
+    def test_shared_queue_jobs_are_recorded_where_they_print(self):
+        store = SharedJobStore(os.path.join(self.directory.name, 'jobs.sqlite'), 'node-a')
+        worker = SharedQueueWorker(store, PrintDispatcher(lambda address, task: True), lambda target: True,
+                                   history=self.history)
+        job_id = worker.submit('kitchen', {'lines': [{'text': 'Tea'}], 'type': 'kot', 'documentId': 'KOT-9'})
+        worker.start()
+        self.assertEqual(worker.wait(job_id, 5)[0], True)
+        deadline = time.monotonic() + 5
+        while not self.history.written and time.monotonic() < deadline:
+            time.sleep(0.01)
+        [row] = self.rows()
+        self.assertEqual((row['jobId'], row['printerId'], row['documentId'], row['success']),
+                         (job_id, 'kitchen', 'KOT-9', True))
+
+
+class ParseTimeTest(unittest.TestCase):
+
+    def test_epoch_seconds(self):
+        self.assertEqual(parse_time('1700000000.5'), 1700000000.5)
+
+    def test_iso_forms(self):
+        self.assertEqual(parse_time('2025-01-01T00:00:00Z'),
+                         datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+        self.assertEqual(parse_time('2025-01-01T05:30:00+05:30'), parse_time('2025-01-01T00:00:00Z'))
+        self.assertEqual(parse_time('2025-01-01'), datetime.datetime(2025, 1, 1).timestamp())
+
+    def test_rejects_garbage(self):
+        for value in ('yesterday', '', '2025-13-01'):
+            with self.assertRaises(ValueError):
+                parse_time(value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Tests for the circuit breaker and group member picking in print_queue
+Run from print-server: python3 -m pytest tests (or python3 -m unittest discover tests)
+"""
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+import print_queue
+from ip_printer import build_escpos
+from print_queue import (STRATEGY_EARLIEST_FINISH, STRATEGY_ROUND_ROBIN, STRATEGY_SHORTEST_QUEUE,
+                         CircuitBreaker, PrintDispatcher, PrinterGroup, PrinterQueue, PrintTask, send_task)
+from throughput import JobCost
+
+
+def _blocked_send(release: threading.Event):
+    def send(address, task):
+        release.wait(5)
+        return True
+    return send
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def tripped(self) -> CircuitBreaker:
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        breaker.record_failure()
+        return breaker
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_lets_one_probe_through(self):
+        breaker = self.tripped()
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        probe, other = object(), object()
+        self.assertTrue(breaker.allow(probe))
+        self.assertTrue(breaker.allow(probe))
+        self.assertFalse(breaker.allow(other))
+        self.assertFalse(breaker.allow())
+
+    def test_probe_success_closes(self):
+        breaker = self.tripped()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow('probe'))
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow('anyone'))
+
+    def test_probe_failure_reopens(self):
+        breaker = self.tripped()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow('probe'))
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow('probe'))
+
+    def test_lost_probe_is_replaced_after_timeout(self):
+        breaker = self.tripped()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow('lost'))
+        self.assertFalse(breaker.allow('next'))
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow('next'))
+
+
+class PrinterGroupPickTest(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        send = _blocked_send(self.release)
+        self.queues = [PrinterQueue(address, send) for address in ('a', 'b', 'c')]
+
+    def fill(self, printer_queue: PrinterQueue, jobs: int):
+        for number in range(jobs):
+            printer_queue.submit(PrintTask(number, [{'text': 'x'}]))
+
+    def test_unknown_strategy_rejected(self):
+        with self.assertRaises(ValueError):
+            PrinterGroup('g', ['a'], 'fastest')
+        with self.assertRaises(ValueError):
+            PrinterGroup('g', [])
+
+    def test_shortest_queue(self):
+        self.fill(self.queues[0], 3)
+        self.fill(self.queues[2], 1)
+        group = PrinterGroup('g', ['a', 'b', 'c'], STRATEGY_SHORTEST_QUEUE)
+        for _ in range(3):
+            self.assertEqual(group.pick(self.queues).address, 'b')
+
+    def test_round_robin_visits_every_member(self):
+        group = PrinterGroup('g', ['a', 'b', 'c'], STRATEGY_ROUND_ROBIN)
+        picked = [group.pick(self.queues).address for _ in range(6)]
+        self.assertEqual(sorted(picked), ['a', 'a', 'b', 'b', 'c', 'c'])
+
+    def test_earliest_finish_prefers_faster_printer(self):
+        cost = JobCost(2000, 1, 1200)
+        for _ in range(20):
+            self.queues[0].model.observe(cost, 0.2)
+            self.queues[1].model.observe(cost, 4.0)
+            self.queues[2].model.observe(cost, 4.0)
+        self.fill(self.queues[0], 2)
+        group = PrinterGroup('g', ['a', 'b', 'c'], STRATEGY_EARLIEST_FINISH)
+        self.assertEqual(group.pick(self.queues, cost=cost).address, 'a')
+
+    def test_excluded_and_open_members_skipped(self):
+        group = PrinterGroup('g', ['a', 'b', 'c'], STRATEGY_ROUND_ROBIN)
+        for _ in range(3):
+            self.queues[1].breaker.record_failure()
+        for _ in range(6):
+            self.assertEqual(group.pick(self.queues, exclude=['a']).address, 'c')
+        self.assertIsNone(group.pick(self.queues, exclude=['a', 'c']))
+
+    def test_half_open_member_gets_one_probe(self):
+        group = PrinterGroup('g', ['a', 'b'], STRATEGY_SHORTEST_QUEUE)
+        breaker = self.queues[0].breaker
+        breaker.reset_timeout = 0.05
+        for _ in range(3):
+            breaker.record_failure()
+        time.sleep(0.06)
+        self.fill(self.queues[1], 5)
+        self.assertEqual(group.pick(self.queues[:2], probe='first').address, 'a')
+        self.assertEqual(group.pick(self.queues[:2], probe='second').address, 'b')
+
+
+class DispatcherTest(unittest.TestCase):
+
+    def test_group_failover(self):
+        sent = []
+
+        def send(address, task):
+            sent.append(address)
+            return address == 'good'
+
+        dispatcher = PrintDispatcher(send)
+        dispatcher.add_group('g', ['bad', 'good'], STRATEGY_ROUND_ROBIN)
+        for number in range(4):
+            task = PrintTask(number, [{'text': 'x'}])
+            dispatcher.submit('g', task)
+            self.assertTrue(task.wait(5))
+            self.assertTrue(task.success)
+            self.assertEqual(task.printer, 'good')
+        self.assertIn('bad', sent)
+
+    def test_open_printer_rejects_without_sending(self):
+        dispatcher = PrintDispatcher(lambda address, task: False)
+        for number in range(3):
+            task = PrintTask(number, [{'text': 'x'}])
+            dispatcher.submit('p', task)
+            task.wait(5)
+        task = PrintTask(9, [{'text': 'x'}])
+        dispatcher.submit('p', task)
+        self.assertTrue(task.done)
+        self.assertIn('circuit open', task.message)
+
+
+class ModelFeedTest(unittest.TestCase):
+
+    def observed(self, send) -> list:
+        """Seconds the printer's model was fed for one job"""
+        printer_queue = PrinterQueue('p', send)
+        seconds = []
+        printer_queue.model.observe = lambda cost, value: seconds.append(value)
+        task = PrintTask(1, [{'text': 'x'}])
+        printer_queue.submit(task)
+        self.assertTrue(task.wait(5))
+        self.assertTrue(task.success)
+        return seconds
+
+    def test_unconfirmed_jobs_are_not_learned(self):
+        def send(address, task):
+            task.mark('connected')
+            time.sleep(0.02)
+            task.mark('sent')
+            return True
+        self.assertEqual(self.observed(send), [])
+
+    def test_learns_the_connected_to_acknowledged_span(self):
+        def send(address, task):
+            # Time spent before connecting (lookups, pre-connect checks) isn't printing
+            time.sleep(0.1)
+            task.mark('connected')
+            time.sleep(0.03)
+            task.mark('acknowledged')
+            return True
+        seconds, = self.observed(send)
+        self.assertGreaterEqual(seconds, 0.03)
+        self.assertLess(seconds, 0.09)
+
+
+class _ChunkTransport:
+    """Records what is sent; takes only the first chunk when told to fail"""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.received = []
+
+    def send_chunks(self, chunks, on_stage):
+        for chunk in chunks:
+            self.received.append(chunk)
+            if self.fail:
+                return False
+        return True
+
+
+class SendTaskTest(unittest.TestCase):
+
+    def test_keeps_exactly_the_bytes_sent(self):
+        lines = [{'text': f'Item {number}', 'bold': number % 2 == 0} for number in range(200)]
+        task = PrintTask(1, lines)
+        task.sent = []
+        transport = _ChunkTransport()
+        with mock.patch.object(print_queue, 'get_transport', return_value=transport):
+            self.assertTrue(send_task('10.0.0.5', task))
+        self.assertEqual(task.sent, transport.received)
+        self.assertEqual(b''.join(task.sent), build_escpos(lines))
+
+    def test_retry_starts_afresh(self):
+        task = PrintTask(1, [{'text': 'x' * 100}] * 50)
+        task.sent = []
+        with mock.patch.object(print_queue, 'get_transport', return_value=_ChunkTransport(fail=True)):
+            self.assertFalse(send_task('a', task))
+        with mock.patch.object(print_queue, 'get_transport', return_value=_ChunkTransport()):
+            self.assertTrue(send_task('b', task))
+        self.assertEqual(b''.join(task.sent), build_escpos(task.lines))
+
+    def test_rendered_bytes_are_paced_in_render_chunks(self):
+        document = bytes(range(256)) * 20
+        task = PrintTask(1, [], rendered=[b'DUP', document])
+        self.assertTrue(task.retryable)
+        with mock.patch.object(print_queue, 'get_transport', return_value=_ChunkTransport(fail=True)):
+            self.assertFalse(send_task('a', task))
+        transport = _ChunkTransport()
+        with mock.patch.object(print_queue, 'get_transport', return_value=transport):
+            self.assertTrue(send_task('b', task))
+        self.assertTrue(all(len(chunk) <= print_queue.RENDER_CHUNK_SIZE for chunk in transport.received))
+        self.assertEqual(b''.join(transport.received), b'DUP' + document)
+
+
+if __name__ == '__main__':
+    unittest.main()
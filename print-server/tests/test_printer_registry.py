@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests for loading and hot-reloading the named printer registry
+Run from print-server: python3 -m pytest tests (or python3 -m unittest discover tests)
+"""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from printer_registry import PrinterRegistry
+
+
+class PrinterRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'printers.json')
+        self.registry = PrinterRegistry()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, config, version=0):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(config if isinstance(config, str) else json.dumps(config))
+        # Make each rewrite visible even within the file system's timestamp resolution
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + version * 1000000))
+
+    def test_load(self):
+        self.write({'printers': {'kitchen-1': {'address': '10.0.0.5', 'width': 58, 'codepage': 'cp437'},
+                                 'bar': {'transport': 'usb', 'address': '/dev/usb/lp0'}}})
+        self.assertEqual(self.registry.load(self.path), 2)
+        self.assertEqual(self.registry.get('kitchen-1').target, '10.0.0.5')
+        self.assertEqual(self.registry.get('kitchen-1').width, 58)
+        self.assertEqual(self.registry.get('bar').target, 'usb:/dev/usb/lp0')
+
+    def test_malformed_files_raise_value_error(self):
+        for config in ([], 'kitchen', {'printers': []}, {'printers': {'kitchen-1': '10.0.0.5'}},
+                       {'printers': {'kitchen-1': ['10.0.0.5']}},
+                       {'printers': {'kitchen-1': {'transport': ['tcp'], 'address': '10.0.0.5'}}},
+                       {'printers': {'kitchen-1': {'address': '10.0.0.5', 'codepage': ['cp437']}}},
+                       {'printers': {'kitchen-1': {'address': '10.0.0.5', 'width': 'wide'}}},
+                       {'printers': {'kitchen-1': {'address': 'not a printer'}}}):
+            self.write(config)
+            with self.assertRaises(ValueError, msg=config) as caught:
+                self.registry.load(self.path)
+            if isinstance(config, dict) and isinstance(config['printers'], dict):
+                self.assertIn('kitchen-1', str(caught.exception))
+
+    def test_bad_save_keeps_the_watcher_running(self):
+        self.write({'printers': {'kitchen-1': {'address': '10.0.0.5'}}})
+        self.registry.load(self.path)
+        self.registry.watch(interval=0.01)
+        self.write(['oops'], version=1)
+        deadline = time.monotonic() + 2
+        while self.registry.error is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsNotNone(self.registry.error)
+        self.assertEqual(self.registry.get('kitchen-1').target, '10.0.0.5')
+
+        self.write({'printers': {'kitchen-1': {'address': '10.0.0.6'}}}, version=2)
+        while self.registry.get('kitchen-1').target != '10.0.0.6' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.registry.get('kitchen-1').target, '10.0.0.6')
+        self.assertIsNone(self.registry.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for the reprint cache and its disk spill
+Run from print-server: python3 -m pytest tests (or python3 -m unittest discover tests)
+"""
+
+import os
+import tempfile
+import unittest
+
+from reprint_cache import ReprintCache
+
+
+class ReprintCacheTest(unittest.TestCase):
+
+    def test_put_and_get(self):
+        cache = ReprintCache(max_bytes=1024)
+        cache.put('INV-1', b'bill', '10.0.0.5')
+        self.assertEqual(cache.get('INV-1'), (b'bill', '10.0.0.5'))
+        self.assertIsNone(cache.get('INV-2'))
+        self.assertEqual(cache.status(), {'documents': 1, 'bytes': 4, 'spilled': 0, 'hits': 1, 'misses': 1})
+
+    def test_replacing_a_document_keeps_the_byte_count(self):
+        cache = ReprintCache(max_bytes=1024)
+        cache.put('INV-1', b'first', 'a')
+        cache.put('INV-1', b'second!', 'b')
+        self.assertEqual(cache.get('INV-1'), (b'second!', 'b'))
+        self.assertEqual(cache.total_bytes, 7)
+
+    def test_least_recently_used_is_dropped(self):
+        cache = ReprintCache(max_bytes=10)
+        cache.put('a', b'1234', 'p')
+        cache.put('b', b'1234', 'p')
+        cache.get('a')
+        cache.put('c', b'1234', 'p')
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertLessEqual(cache.total_bytes, 10)
+
+
+class SpillTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spill_dir = os.path.join(self.directory.name, 'spill')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_dropped_documents_come_back_from_disk(self):
+        cache = ReprintCache(max_bytes=8, spill_dir=self.spill_dir)
+        cache.put('KOT/7', b'\x1b@kitchen\n', 'kitchen-1')
+        cache.put('KOT/8', b'\x1b@next', 'kitchen-2')
+        self.assertEqual(cache.status()['spilled'], 1)
+        self.assertEqual(cache.get('KOT/7'), (b'\x1b@kitchen\n', 'kitchen-1'))
+        # Spilled names are hashed, so document ids can't reach outside the folder
+        self.assertTrue(all(name.endswith('.bin') and '/' not in name for name in os.listdir(self.spill_dir)))
+
+    def test_spill_limit_removes_oldest_files(self):
+        cache = ReprintCache(max_bytes=1, spill_dir=self.spill_dir, max_spill_bytes=20)
+        for number in range(5):
+            cache.put(f'doc-{number}', b'12345678', 'p')
+        self.assertLessEqual(len(os.listdir(self.spill_dir)), 2)
+        self.assertIsNone(cache.get('doc-0'))
+        self.assertEqual(cache.get('doc-3'), (b'12345678', 'p'))
+
+    def test_spilled_documents_survive_a_restart(self):
+        ReprintCache(max_bytes=1, spill_dir=self.spill_dir).put('INV-9', b'total', 'billing')
+        reopened = ReprintCache(max_bytes=1, spill_dir=self.spill_dir)
+        self.assertEqual(reopened.status()['spilled'], 1)
+        self.assertEqual(reopened.get('INV-9'), (b'total', 'billing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
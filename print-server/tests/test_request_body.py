@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for reading and decoding /print request bodies
+Run from print-server: python3 -m pytest tests (or python3 -m unittest discover tests)
+"""
+
+import gzip
+import io
+import json
+import unittest
+from unittest import mock
+
+import request_body
+from request_body import MAX_BODY_SIZE, PayloadError, expand_lines, read_payload
+
+
+def _read(body: bytes, content_type: str = 'application/json', **headers) -> dict:
+    headers = {'Content-Length': str(len(body)), 'Content-Type': content_type, **headers}
+    return read_payload(io.BytesIO(body), headers)
+
+
+class ReadPayloadTest(unittest.TestCase):
+
+    def test_json(self):
+        job = _read(json.dumps({'printerId': '10.0.0.5', 'lines': [{'text': 'Hi'}]}).encode())
+        self.assertEqual(job['lines'], [{'text': 'Hi'}])
+
+    def test_unknown_content_type_is_read_as_json(self):
+        job = _read(b'{"printerId": "kitchen"}', content_type='application/x-www-form-urlencoded')
+        self.assertEqual(job, {'printerId': 'kitchen'})
+        self.assertEqual(_read(b'{"a": 1}', content_type='')['a'], 1)
+
+    def test_missing_length(self):
+        with self.assertRaises(PayloadError) as caught:
+            read_payload(io.BytesIO(b'{}'), {'Content-Type': 'application/json'})
+        self.assertEqual(caught.exception.status_code, 411)
+        self.assertFalse(caught.exception.body_consumed)
+
+    def test_too_large(self):
+        with self.assertRaises(PayloadError) as caught:
+            read_payload(io.BytesIO(b''), {'Content-Length': str(MAX_BODY_SIZE + 1)})
+        self.assertEqual(caught.exception.status_code, 413)
+
+    def test_gzip(self):
+        job = _read(gzip.compress(b'{"lines": ["Total", ["Thanks", "center", true]]}'), **{'Content-Encoding': 'gzip'})
+        self.assertEqual(job['lines'], [{'text': 'Total'}, {'text': 'Thanks', 'align': 'center', 'bold': True}])
+
+    def test_gzip_bomb_is_refused(self):
+        body = gzip.compress(b' ' * 4096)
+        with mock.patch.object(request_body, 'MAX_DECODED_SIZE', 1024):
+            with self.assertRaises(PayloadError) as caught:
+                _read(body, **{'Content-Encoding': 'gzip'})
+        self.assertEqual(caught.exception.status_code, 413)
+
+    def test_bad_gzip(self):
+        with self.assertRaises(PayloadError) as caught:
+            _read(b'not gzip at all', **{'Content-Encoding': 'gzip'})
+        self.assertEqual(caught.exception.status_code, 400)
+
+    def test_unsupported_encoding(self):
+        with self.assertRaises(PayloadError) as caught:
+            _read(b'{}', **{'Content-Encoding': 'br'})
+        self.assertEqual(caught.exception.status_code, 415)
+
+    def test_msgpack_without_library(self):
+        with mock.patch.object(request_body, 'msgpack', None):
+            with self.assertRaises(PayloadError) as caught:
+                _read(b'\x80', content_type='application/msgpack')
+        self.assertEqual(caught.exception.status_code, 415)
+
+    def test_invalid_json(self):
+        with self.assertRaises(PayloadError) as caught:
+            _read(b'{"lines": [')
+        self.assertEqual(caught.exception.status_code, 400)
+
+    def test_body_must_be_object(self):
+        with self.assertRaises(PayloadError) as caught:
+            _read(b'[1, 2]')
+        self.assertEqual(caught.exception.status_code, 400)
+
+    def test_bad_lines(self):
+        with self.assertRaises(PayloadError) as caught:
+            _read(b'{"lines": "Total"}')
+        self.assertEqual(caught.exception.status_code, 400)
+
+
+class ExpandLinesTest(unittest.TestCase):
+
+    def test_compact_forms(self):
+        self.assertEqual(expand_lines(['A', ['B', 'right'], {'text': 'C', 'bold': True}]),
+                         [{'text': 'A'}, {'text': 'B', 'align': 'right'}, {'text': 'C', 'bold': True}])
+
+    def test_rejects_non_list(self):
+        for lines in ('Total', {'text': 'A'}, None, 3):
+            with self.assertRaises(PayloadError) as caught:
+                expand_lines(lines)
+            self.assertEqual(caught.exception.status_code, 400)
+
+    def test_rejects_bad_items(self):
+        for lines in ([3], [None], [{'text': 5}], [[7]]):
+            with self.assertRaises(PayloadError):
+                expand_lines(lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Tests for the printer hostname cache and TCP transport address selection
+Run from print-server: python3 -m pytest tests (or python3 -m unittest discover tests)
+"""
+
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+
+import resolver as resolver_module
+import transports
+from resolver import HostResolver
+from transports import TcpTransport, describe_target, get_transport
+
+
+def _infos(*addresses):
+    return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, 9100)) for address in addresses]
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.01)
+
+
+class HostResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(resolver_module.socket, 'getaddrinfo')
+        self.getaddrinfo = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_answers_are_cached(self):
+        self.getaddrinfo.return_value = _infos('10.0.0.5', '10.0.0.5', '10.0.0.6')
+        resolver = HostResolver()
+        self.assertEqual(resolver.resolve('kitchen.local'), ['10.0.0.5', '10.0.0.6'])
+        self.assertEqual(resolver.resolve('kitchen.local'), ['10.0.0.5', '10.0.0.6'])
+        self.assertEqual(self.getaddrinfo.call_count, 1)
+
+    def test_failures_are_cached(self):
+        self.getaddrinfo.side_effect = socket.gaierror('Name or service not known')
+        resolver = HostResolver(negative_ttl=60)
+        self.assertIsNone(resolver.resolve('missing.local'))
+        self.assertIsNone(resolver.resolve('missing.local'))
+        self.assertEqual((resolver.lookups, resolver.failures), (1, 1))
+        self.assertEqual(resolver.status()['hosts']['missing.local']['error'], 'Name or service not known')
+
+    def test_zero_timeout_does_not_wait(self):
+        release = threading.Event()
+
+        def slow_lookup(*args, **kwargs):
+            release.wait(2)
+            return _infos('10.0.0.7')
+
+        self.getaddrinfo.side_effect = slow_lookup
+        resolver = HostResolver()
+        self.assertIsNone(resolver.resolve('bar.local', timeout=0))
+        self.assertTrue(resolver.resolving('bar.local'))
+        release.set()
+        _wait_for(lambda: not resolver.resolving('bar.local'))
+        self.assertEqual(resolver.resolve('bar.local', timeout=0), ['10.0.0.7'])
+
+    def test_idle_name_keeps_its_answer(self):
+        self.getaddrinfo.return_value = _infos('10.0.0.5')
+        with mock.patch.object(resolver_module, 'REFRESH_CHECK', 0.01), \
+                mock.patch.object(resolver_module, 'IDLE_TTLS', 1):
+            resolver = HostResolver(ttl=0.05)
+            resolver.resolve('kitchen.local')
+            time.sleep(0.2)
+            # Idle names stop being refreshed, but aren't forgotten
+            lookups = resolver.lookups
+            time.sleep(0.1)
+            self.assertEqual(resolver.lookups, lookups)
+            self.assertEqual(resolver.status()['hosts']['kitchen.local']['addresses'], ['10.0.0.5'])
+
+            # The next job gets the kept answer at once and the name is refreshed behind it
+            self.getaddrinfo.return_value = _infos('10.0.0.9')
+            self.assertEqual(resolver.resolve('kitchen.local', timeout=0), ['10.0.0.5'])
+            _wait_for(lambda: resolver.lookups > lookups)
+            self.assertEqual(resolver.resolve('kitchen.local', timeout=0), ['10.0.0.9'])
+
+    def test_answer_older_than_the_grace_is_not_used(self):
+        self.getaddrinfo.return_value = _infos('10.0.0.5')
+        with mock.patch.object(resolver_module, 'STALE_GRACE', 0.05):
+            resolver = HostResolver(ttl=0.05)
+            resolver.resolve('kitchen.local')
+            # Overnight the printer got a new lease; the first job must not go to the old one
+            self.getaddrinfo.return_value = _infos('10.0.0.9')
+            time.sleep(0.15)
+            self.assertEqual(resolver.resolve('kitchen.local'), ['10.0.0.9'])
+
+    def test_long_idle_names_are_forgotten(self):
+        self.getaddrinfo.return_value = _infos('10.0.0.5')
+        with mock.patch.object(resolver_module, 'REFRESH_CHECK', 0.01), \
+                mock.patch.object(resolver_module, 'IDLE_TTLS', 1), \
+                mock.patch.object(resolver_module, 'STALE_GRACE', 0.05):
+            resolver = HostResolver(ttl=0.05)
+            resolver.resolve('kitchen.local')
+            _wait_for(lambda: not resolver.status()['hosts'])
+
+    def test_cache_is_bounded(self):
+        self.getaddrinfo.return_value = _infos('10.0.0.5')
+        with mock.patch.object(resolver_module, 'MAX_HOSTS', 3):
+            resolver = HostResolver()
+            for number in range(5):
+                resolver.resolve(f'printer-{number}.local')
+            self.assertEqual(sorted(resolver.status()['hosts']),
+                             ['printer-2.local', 'printer-3.local', 'printer-4.local'])
+
+    def test_failed_refresh_keeps_the_last_answer(self):
+        self.getaddrinfo.return_value = _infos('10.0.0.5')
+        resolver = HostResolver(ttl=0.01)
+        resolver.resolve('kitchen.local')
+        self.getaddrinfo.side_effect = socket.gaierror('Temporary failure in name resolution')
+        time.sleep(0.05)
+        self.assertEqual(resolver.resolve('kitchen.local', timeout=0), ['10.0.0.5'])
+        _wait_for(lambda: resolver.failures)
+        self.assertEqual(resolver.resolve('kitchen.local', timeout=0), ['10.0.0.5'])
+
+
+class TcpTransportTest(unittest.TestCase):
+
+    def test_ip_addresses_need_no_lookup(self):
+        with mock.patch.object(transports, 'resolver') as resolver:
+            self.assertEqual(TcpTransport('[fd00::50]').connect_address(), 'fd00::50')
+            self.assertEqual(TcpTransport('10.0.0.5').connect_address(), '10.0.0.5')
+        resolver.resolve.assert_not_called()
+
+    def test_nothing_is_looked_up_until_a_job_is_sent(self):
+        with mock.patch.object(transports, 'resolver') as resolver:
+            TcpTransport('kitchen.local')
+            describe_target('bar.local')
+        self.assertEqual(resolver.mock_calls, [])
+
+    def test_addresses_are_tried_in_order_and_the_working_one_kept(self):
+        tried = []
+
+        def connect(address, timeout):
+            tried.append(address[0])
+            if address[0] == '10.0.0.1':
+                raise ConnectionRefusedError()
+            return mock.MagicMock()
+
+        transport = TcpTransport('kitchen.local')
+        with mock.patch.object(transports, 'resolver') as resolver, \
+                mock.patch.object(transports.socket, 'create_connection', side_effect=connect):
+            resolver.resolve.return_value = ['10.0.0.1', '10.0.0.2']
+            self.assertEqual(transport.connect_address(), '10.0.0.2')
+            self.assertEqual(transport.connect_address(), '10.0.0.2')
+        self.assertEqual(tried, ['10.0.0.1', '10.0.0.2', '10.0.0.2'])
+
+    def test_no_address_answering(self):
+        with mock.patch.object(transports, 'resolver') as resolver, \
+                mock.patch.object(transports.socket, 'create_connection', side_effect=OSError()):
+            resolver.resolve.return_value = ['10.0.0.1', '10.0.0.2']
+            self.assertIsNone(TcpTransport('kitchen.local').connect_address())
+
+    def test_shared_transports_are_bounded(self):
+        closed = []
+        with mock.patch.object(transports, 'MAX_TRANSPORTS', 2), \
+                mock.patch.object(transports, '_transports', transports.OrderedDict()), \
+                mock.patch.object(TcpTransport, 'close', lambda self: closed.append(self.address)):
+            first = get_transport('10.0.0.1')
+            get_transport('10.0.0.2')
+            self.assertIs(get_transport('10.0.0.1'), first)
+            get_transport('10.0.0.3')
+            self.assertEqual(closed, ['10.0.0.2'])
+            self.assertIs(get_transport('10.0.0.1'), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Tests for compiling and rendering receipt templates
+Run from print-server: python3 -m pytest tests (or python3 -m unittest discover tests)
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import templates
+from preview import CHAR_WIDTH, dot_width
+from request_body import PayloadError
+from templates import Template, TemplateError, TemplateStore, apply_template
+
+SHIPPED = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+
+def _texts(lines):
+    return [line['text'] for line in lines]
+
+
+class TemplateTest(unittest.TestCase):
+
+    def test_fields_filters_and_defaults(self):
+        template = Template('t', {'lines': [{'text': '{name|upper} x{qty} = {total|money}', 'bold': True}],
+                                  'defaults': {'qty': 1}})
+        self.assertEqual(template.render({'name': 'dosa', 'total': 90}),
+                         [{'text': 'DOSA x1 = 90.00', 'align': 'left', 'bold': True}])
+
+    def test_missing_fields_render_empty(self):
+        template = Template('t', {'lines': [{'text': '[{customer.name}]'}]})
+        self.assertEqual(_texts(template.render({})), ['[]'])
+
+    def test_conditions(self):
+        template = Template('t', {'lines': [{'text': 'Table {table}', 'if': 'table'},
+                                            {'text': 'Takeaway', 'unless': 'table'}]})
+        self.assertEqual(_texts(template.render({'table': 4})), ['Table 4'])
+        self.assertEqual(_texts(template.render({})), ['Takeaway'])
+
+    def test_each_derives_amounts(self):
+        template = Template('t', {'lines': [{'each': 'items', 'lines': [{'text': '{name} {amount|money}'}]}]})
+        lines = template.render({'items': [{'name': 'Tea', 'price': '15', 'qty': 2}, {'name': 'Bun', 'amount': 9}]})
+        self.assertEqual(_texts(lines), ['Tea 30.00', 'Bun 9.00'])
+
+    def test_each_scopes_plain_values(self):
+        template = Template('t', {'lines': [{'each': 'notes', 'lines': [{'text': '* {value}'}]}]})
+        self.assertEqual(_texts(template.render({'notes': ['no onion', 'extra hot']})), ['* no onion', '* extra hot'])
+
+    def test_divider_and_columns_fill_the_paper(self):
+        spec = {'lines': [{'divider': '-='},
+                          {'columns': [{'text': '{name}', 'width': '*'}, {'text': '{amount}', 'width': 8,
+                                                                          'align': 'right'}]}]}
+        template = Template('t', spec)
+        for paper_width in (58, 80):
+            columns = dot_width(paper_width) // CHAR_WIDTH
+            divider, row = _texts(template.render({'name': 'Masala Dosa', 'amount': '90.00'}, paper_width))
+            self.assertEqual(divider, '-' * columns)
+            self.assertEqual(len(row), columns)
+            self.assertTrue(row.startswith('Masala Dosa'))
+            self.assertTrue(row.endswith('   90.00'))
+
+    def test_long_cells_are_shortened(self):
+        template = Template('t', {'lines': [{'columns': [{'text': '{name}', 'width': 8}, {'text': 'x', 'width': 1}]}]})
+        self.assertEqual(_texts(template.render({'name': 'PANEER TIKKA MASALA'})), ['PANEER.. x'])
+
+    def test_column_width_per_paper(self):
+        template = Template('t', {'lines': [{'columns': [{'text': 'a', 'width': {'58': 2, 'default': 4}},
+                                                         {'text': 'b', 'width': 'auto'}]}]})
+        self.assertEqual(_texts(template.render({}, 58)), ['a  b'])
+        self.assertEqual(_texts(template.render({}, 80)), ['a    b'])
+
+    def test_one_plan_per_known_width(self):
+        template = Template('t', {'lines': [{'columns': [{'text': 'a', 'width': {'58': 2, 'default': 4}},
+                                                         {'text': 'b', 'width': 'auto'}]}]})
+        for paper_width in range(40, 120):
+            template.render({}, paper_width)
+        self.assertEqual(sorted(template._plans), [58, 80])
+        self.assertEqual(_texts(template.render({}, 76)), ['a  b'])
+        self.assertEqual(_texts(template.render({}, 112)), ['a    b'])
+
+    def test_mistakes_show_up_at_load(self):
+        for spec in ({}, {'lines': 'text'}, {'lines': ['text']}, {'lines': [{'bold': True}]},
+                     {'lines': [{'text': '{total|euros}'}]},
+                     {'lines': [{'columns': [{'text': 'a', 'width': 'wide'}]}]}):
+            with self.assertRaises(TemplateError):
+                Template('t', spec)
+
+    def test_shipped_templates_render(self):
+        store = TemplateStore(SHIPPED)
+        lines = store.render('kot', {'tableName': 't4', 'items': [{'name': 'tea', 'notes': 'less sugar'}]})
+        self.assertEqual(lines[0]['text'], 'KITCHEN ORDER')
+        self.assertIn('TBL:T4 | ', _texts(lines)[1])
+        self.assertIn('1x TEA', _texts(lines))
+        self.assertIn('  LESS SUGAR', _texts(lines))
+        for name in ('invoice', 'token'):
+            self.assertTrue(store.render(name, {}))
+
+
+class TemplateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = TemplateStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, spec):
+        path = os.path.join(self.directory.name, name + '.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(spec, f)
+        # Make the rewrite visible even within the file system's timestamp resolution
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + self.store.compiles + 1))
+
+    def test_compiled_once_and_reloaded_on_change(self):
+        self.write('slip', {'lines': [{'text': 'one'}]})
+        with mock.patch.object(templates, 'CHECK_INTERVAL', 0):
+            self.assertEqual(_texts(self.store.render('slip', {})), ['one'])
+            self.store.render('slip', {})
+            self.assertEqual(self.store.compiles, 1)
+            self.write('slip', {'lines': [{'text': 'two'}]})
+            self.assertEqual(_texts(self.store.render('slip', {})), ['two'])
+            self.assertEqual(self.store.compiles, 2)
+
+    def test_unknown_and_invalid_names(self):
+        for name in ('missing', '../secrets', '', 'a b'):
+            with self.assertRaises(TemplateError):
+                self.store.get(name)
+
+    def test_broken_file(self):
+        with open(os.path.join(self.directory.name, 'bad.json'), 'w', encoding='utf-8') as f:
+            f.write('{"lines": [')
+        with self.assertRaises(TemplateError):
+            self.store.get('bad')
+
+    def test_apply_template(self):
+        self.write('slip', {'lines': [{'text': 'Token {token|int}'}]})
+        with mock.patch.object(templates, 'templates', self.store):
+            job = apply_template({'printerId': 'kitchen', 'template': 'slip', 'data': {'token': '12'}}, 80)
+            self.assertEqual(job['lines'], [{'text': 'Token 12', 'align': 'left', 'bold': False}])
+            self.assertEqual(apply_template({'lines': []}, 80), {'lines': []})
+            for bad in ({'template': 'missing'}, {'template': 'slip', 'data': {'token': 'abc'}},
+                        {'template': 'slip', 'data': [1]}):
+                with self.assertRaises(PayloadError) as caught:
+                    apply_template(bad, 80)
+                self.assertEqual(caught.exception.status_code, 422)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Tests for job cost estimates and the per-printer throughput model
+Run from print-server: python3 -m pytest tests (or python3 -m unittest discover tests)
+"""
+
+import random
+import unittest
+
+from ip_printer import ESCPOSCommands, build_escpos
+from preview import LINE_PITCH
+from throughput import (PRIOR_BYTES_PER_SEC, PRIOR_CUT_SECONDS, PRIOR_OVERHEAD_SECONDS, PRIOR_ROWS_PER_SEC,
+                        STREAM_BYTES_PER_LINE, JobCost, ThroughputModel, escpos_cost, line_cost, stream_cost)
+
+
+def _raster(width_bytes: int, height: int) -> bytes:
+    header = ESCPOSCommands.GS + b'v0\x00' + bytes([width_bytes % 256, width_bytes // 256,
+                                                      height % 256, height // 256])
+    return header + b'\xff' * (width_bytes * height)
+
+
+class JobCostTest(unittest.TestCase):
+
+    def test_line_cost_matches_rendering(self):
+        lines = [{'text': 'KITCHEN ORDER', 'align': 'center', 'bold': True}, {'text': '2x Dosa'}, {'text': ''}]
+        cost = line_cost(lines)
+        self.assertEqual(cost.bytes, len(build_escpos(lines)))
+        self.assertEqual(cost.cuts, 1)
+        self.assertEqual(cost.rows, (len(lines) + 3) * LINE_PITCH)
+        self.assertEqual(escpos_cost(build_escpos(lines)), cost)
+
+    def test_escpos_cost_counts_raster_rows_not_their_bytes(self):
+        # Image data full of 0x0a bytes must not be taken for line feeds
+        image = _raster(4, 100).replace(b'\xff', ESCPOSCommands.LF)
+        data = ESCPOSCommands.INIT + b'logo' + ESCPOSCommands.LF + image + ESCPOSCommands.LF + ESCPOSCommands.CUT_PARTIAL
+        cost = escpos_cost(data)
+        self.assertEqual(cost, JobCost(len(data), 1, 100 + 2 * LINE_PITCH))
+
+    def test_escpos_cost_survives_truncated_image(self):
+        data = ESCPOSCommands.LF + ESCPOSCommands.GS + b'v0'
+        self.assertEqual(escpos_cost(data).rows, LINE_PITCH)
+
+    def test_stream_cost(self):
+        self.assertEqual(stream_cost(STREAM_BYTES_PER_LINE * 10), JobCost(STREAM_BYTES_PER_LINE * 10, 1, 10 * LINE_PITCH))
+
+
+class ThroughputModelTest(unittest.TestCase):
+
+    def test_starts_from_the_priors(self):
+        model = ThroughputModel()
+        cost = JobCost(4096, 1, 800)
+        expected = (PRIOR_OVERHEAD_SECONDS + 4096 / PRIOR_BYTES_PER_SEC + PRIOR_CUT_SECONDS
+                    + 800 / PRIOR_ROWS_PER_SEC)
+        self.assertAlmostEqual(model.estimate(cost), expected)
+        self.assertEqual(model.status()['samples'], 0)
+
+    def test_learns_a_printer(self):
+        rng = random.Random(7)
+        model = ThroughputModel()
+
+        def actual(cost: JobCost) -> float:
+            return 0.05 + cost.bytes / 20000 + cost.cuts * 0.3 + cost.rows / 1500
+
+        for _ in range(200):
+            cost = JobCost(rng.randint(200, 20000), rng.choice((0, 1, 1, 2)), rng.randint(100, 6000))
+            model.observe(cost, actual(cost))
+        for cost in (JobCost(1500, 1, 900), JobCost(15000, 2, 5000)):
+            self.assertAlmostEqual(model.estimate(cost), actual(cost), delta=0.1 * actual(cost))
+        status = model.status()
+        self.assertEqual(status['samples'], 200)
+        self.assertAlmostEqual(status['rowsPerSec'], 1500, delta=150)
+
+    def test_terms_never_go_negative(self):
+        model = ThroughputModel()
+        # Bigger jobs happen to be quicker here; that must not become a negative per-byte time
+        for size in range(1000, 30000, 1000):
+            model.observe(JobCost(size, 1, 900), 2.0 - size / 30000)
+        status = model.status()
+        self.assertGreaterEqual(status['overheadSeconds'], 0)
+        self.assertGreaterEqual(status['cutSeconds'], 0)
+        # A term pinned at zero reports no rate rather than a negative one
+        self.assertTrue(status['bytesPerSec'] is None or status['bytesPerSec'] > 0)
+        self.assertGreater(model.estimate(JobCost(1000, 1, 900)), 0)
+        self.assertGreaterEqual(model.estimate(JobCost(50000, 1, 900)), 0)
+
+    def test_follows_a_printer_that_slows_down(self):
+        model = ThroughputModel()
+        cost = JobCost(2000, 1, 1200)
+        for _ in range(100):
+            model.observe(cost, 1.0)
+        for _ in range(100):
+            model.observe(cost, 3.0)
+        self.assertAlmostEqual(model.estimate(cost), 3.0, delta=0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
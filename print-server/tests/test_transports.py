@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Tests for file and named-pipe sinks
+Run from print-server: python3 -m pytest tests (or python3 -m unittest discover tests)
+"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from transports import FileTransport
+
+
+class FileTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_jobs_are_appended(self):
+        path = os.path.join(self.directory.name, 'kitchen.bin')
+        sink = FileTransport(path)
+        self.assertTrue(sink.send(b'first'))
+        self.assertTrue(sink.send_chunks([b'sec', b'ond']))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'firstsecond')
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), 'needs named pipes')
+    def test_pipe_without_reader_fails_at_once(self):
+        path = os.path.join(self.directory.name, 'pipe')
+        os.mkfifo(path)
+        stages = []
+        self.assertFalse(FileTransport(path).send_chunks([b'hello'], stages.append))
+        self.assertEqual(stages, [])
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), 'needs named pipes')
+    def test_pipe_with_reader_takes_more_than_its_buffer(self):
+        path = os.path.join(self.directory.name, 'pipe')
+        os.mkfifo(path)
+        received = []
+        opened = threading.Event()
+
+        def read():
+            with open(path, 'rb') as pipe:
+                opened.set()
+                received.append(pipe.read())
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        # Opening for reading blocks until a writer opens too, so retry until the reader is there
+        data = b'x' * 200000
+        while not FileTransport(path).send(data):
+            self.assertFalse(opened.is_set())
+            time.sleep(0.01)
+        reader.join(5)
+        self.assertEqual(received, [data])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Printer Throughput Module for EZDine
+Learns how long each printer takes per job from its own send/ack timings, as a fixed
+overhead plus time per byte, per cut and per dot row of paper, so the queues can estimate
+when a job will finish and group jobs go to the member that will finish them first
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, NamedTuple, Sequence
+
+from ip_printer import DEFAULT_DRAIN_RATE, ESCPOSCommands
+from preview import LINE_PITCH
+
+# Starting guesses until a printer has printed some jobs: connection overhead (seconds),
+# link speed (bytes/sec), cutter time (seconds) and paper speed (dot rows/sec,
+# about 100 mm/s at 8 dots/mm)
+PRIOR_OVERHEAD_SECONDS = 0.2
+PRIOR_BYTES_PER_SEC = DEFAULT_DRAIN_RATE
+PRIOR_CUT_SECONDS = 0.5
+PRIOR_ROWS_PER_SEC = float(os.environ.get('EZDINE_PRINTER_ROWS_PER_SEC', 800))
+
+# Weight of older jobs after each new one, so the model follows a printer that slows down
+FORGETTING = 0.98
+
+# How many typical jobs' worth of evidence the starting guesses count for
+PRIOR_WEIGHT = 1.0
+
+# Raw streams of unknown layout are assumed to be text at this many bytes per line
+STREAM_BYTES_PER_LINE = 32
+
+# Size of a typical job in each term, so the fit works on numbers near 1
+FEATURE_SCALE = (1.0, 2048.0, 1.0, 1200.0)
+
+RASTER_IMAGE = ESCPOSCommands.GS + b'v0'
+
+
+class JobCost(NamedTuple):
+    """What a job asks of the printer"""
+    bytes: int
+    cuts: int
+    rows: int
+
+
+def line_cost(lines: Sequence[dict]) -> JobCost:
+    """Cost of print lines as iter_escpos renders them, without rendering them"""
+    size = len(ESCPOSCommands.INIT) + 3 * len(ESCPOSCommands.LF) + len(ESCPOSCommands.CUT_PARTIAL)
+    for line in lines:
+        # Alignment, text and line feed, plus bold on and off
+        size += len(line.get('text', '')) + 4 + (6 if line.get('bold') else 0)
+    return JobCost(size, 1, (len(lines) + 3) * LINE_PITCH)
+
+
+def escpos_cost(data: bytes) -> JobCost:
+    """Cost of rendered ESC/POS: line feeds and raster image rows feed paper"""
+    rows = 0
+    position = 0
+    while True:
+        start = data.find(RASTER_IMAGE, position)
+        end = start if start >= 0 else len(data)
+        rows += data.count(ESCPOSCommands.LF, position, end) * LINE_PITCH
+        if start < 0 or start + 8 > len(data):
+            break
+        # GS v 0 m xL xH yL yH, then xL+xH*256 bytes for each of yL+yH*256 rows
+        width = data[start + 4] + data[start + 5] * 256
+        height = data[start + 6] + data[start + 7] * 256
+        rows += height
+        position = start + 8 + width * height
+    return JobCost(len(data), data.count(ESCPOSCommands.GS + b'V'), rows)
+
+
+def stream_cost(size: int) -> JobCost:
+    """Cost of a raw stream known only by its length"""
+    return JobCost(size, 1, (size // STREAM_BYTES_PER_LINE) * LINE_PITCH)
+
+
+def _solve(matrix: List[List[float]], vector: List[float]) -> List[float]:
+    """Gaussian elimination with partial pivoting for the small normal equations"""
+    size = len(vector)
+    rows = [matrix[i][:] + [vector[i]] for i in range(size)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda r: abs(rows[r][column]))
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for r in range(column + 1, size):
+            factor = rows[r][column] / rows[column][column]
+            for c in range(column, size + 1):
+                rows[r][c] -= factor * rows[column][c]
+    solution = [0.0] * size
+    for r in reversed(range(size)):
+        solution[r] = (rows[r][size] - sum(rows[r][c] * solution[c] for c in range(r + 1, size))) / rows[r][r]
+    return solution
+
+
+class ThroughputModel:
+    """
+    Job seconds as overhead + bytes/bytesPerSec + cuts*cutSeconds + rows/rowsPerSec for
+    one printer, fitted by least squares over recent jobs and pulled towards the starting
+    guesses, so a printer that only ever prints receipts still gets sensible terms
+    """
+
+    def __init__(self):
+        prior = (PRIOR_OVERHEAD_SECONDS, 1 / PRIOR_BYTES_PER_SEC, PRIOR_CUT_SECONDS, 1 / PRIOR_ROWS_PER_SEC)
+        size = len(prior)
+        # Work in units of a typical job, so the prior weighs the same on every term
+        self._prior = [coefficient * scale for coefficient, scale in zip(prior, FEATURE_SCALE)]
+        self._matrix = [[0.0] * size for _ in range(size)]
+        self._vector = [0.0] * size
+        self._coefficients = list(self._prior)
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _features(cost: JobCost) -> List[float]:
+        return [value / scale for value, scale in zip((1, cost.bytes, cost.cuts, cost.rows), FEATURE_SCALE)]
+
+    def estimate(self, cost: JobCost) -> float:
+        """Expected seconds for the printer to take a job"""
+        features = self._features(cost)
+        with self._lock:
+            return max(0.0, sum(c * x for c, x in zip(self._coefficients, features)))
+
+    def observe(self, cost: JobCost, seconds: float):
+        """Learn from a job the printer acknowledged after the given seconds"""
+        features = self._features(cost)
+        with self._lock:
+            size = len(features)
+            for i in range(size):
+                for j in range(size):
+                    self._matrix[i][j] = FORGETTING * self._matrix[i][j] + features[i] * features[j]
+                self._vector[i] = FORGETTING * self._vector[i] + features[i] * seconds
+            # Ridge regression towards the prior: (A + wI) c = b + w c0
+            matrix = [[self._matrix[i][j] + (PRIOR_WEIGHT if i == j else 0.0) for j in range(size)]
+                      for i in range(size)]
+            vector = [self._vector[i] + PRIOR_WEIGHT * self._prior[i] for i in range(size)]
+            # A term can't make a job quicker: pin any that come out negative at zero and
+            # refit the rest, so the others absorb what they were offsetting
+            free = list(range(size))
+            while True:
+                solution = _solve([[matrix[i][j] for j in free] for i in free], [vector[i] for i in free])
+                negative = [i for i, c in zip(free, solution) if c < 0]
+                if not negative:
+                    break
+                free = [i for i in free if i not in negative]
+            self._coefficients = [0.0] * size
+            for i, c in zip(free, solution):
+                self._coefficients[i] = c
+            self.samples += 1
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            overhead, per_byte, per_cut, per_row = (c / scale for c, scale in zip(self._coefficients, FEATURE_SCALE))
+            samples = self.samples
+        return {
+            'samples': samples,
+            'overheadSeconds': round(overhead, 3),
+            'bytesPerSec': round(1 / per_byte) if per_byte else None,
+            'cutSeconds': round(per_cut, 3),
+            'rowsPerSec': round(1 / per_row) if per_row else None
+        }
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Printer Transport Module for EZDine
+Pluggable outputs behind the print queue: TCP/IP, USB line printer devices and file/pipe sinks
+"""
+
+import errno
+import ipaddress
+import os
+import re
+import socket
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from ip_printer import DrainRate, IPPrinter, ignore_stage, iter_escpos, mark_rendered, print_to_ip_printer, stream_to_ip_printer, STREAM_CHUNK_SIZE
+from resolver import resolver
+
+# USB line printer device nodes that may be written to directly
+DEVICE_PATTERN = re.compile(r'^/dev/(usb/)?lp\d+$')
+
+# Confirm long TCP jobs with in-order status queries while streaming them
+STATUS_CONFIRM = os.environ.get('EZDINE_STATUS_CONFIRM', '') == '1'
+
+# File and named-pipe sinks must live under this directory (disabled when unset)
+SINK_DIR = os.environ.get('EZDINE_SINK_DIR', '')
+
+# Called with a job stage name ('connected', 'rendered', 'sent', 'acknowledged') as a send progresses
+StageCallback = Callable[[str], None]
+
+IP_PATTERN = re.compile(r'^(\d{1,3}\.){3}\d{1,3}$')
+
+# Printer hostnames need a dot (kitchen-printer.local), so a mistyped printer name isn't
+# taken for one; the last label can't be all digits, so a bad IPv4 address isn't either
+HOSTNAME_PATTERN = re.compile(r'^(?=.{1,253}$)([A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+'
+                              r'(?!\d+$)[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.?$')
+
+# Seconds a job waits for the first lookup of a printer hostname
+RESOLVE_TIMEOUT = 5.0
+
+# Seconds to try each address of a hostname with several before moving to the next
+CONNECT_TIMEOUT = 2.0
+
+# Most targets with a shared transport; the least recently used is closed beyond this
+MAX_TRANSPORTS = 64
+
+
+class Transport:
+    """Base class for a printer output"""
+
+    label = 'printer'
+
+    def __init__(self, address: str):
+        self.address = address
+
+    def describe(self) -> str:
+        return f"{self.label} {self.address}"
+
+    def send(self, data: bytes, on_stage: StageCallback = ignore_stage) -> bool:
+        return self.send_chunks([data], on_stage)
+
+    def send_chunks(self, chunks: Iterable[bytes], on_stage: StageCallback = ignore_stage) -> bool:
+        raise NotImplementedError
+
+    def send_stream(self, readinto: Callable[[memoryview], int], on_stage: StageCallback = ignore_stage) -> bool:
+        raise NotImplementedError
+
+    def print_lines(self, lines: List[Dict[str, Any]], paper_width: int = 80,
+                    on_stage: StageCallback = ignore_stage, codepage: Optional[str] = None) -> bool:
+        return self.send_chunks(mark_rendered(iter_escpos(lines, paper_width, codepage=codepage), on_stage),
+                                on_stage)
+
+    def available(self) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+
+class TcpTransport(Transport):
+    """Raw TCP (port 9100) network printer"""
+
+    label = 'IP printer'
+
+    def __init__(self, address: str):
+        super().__init__(address)
+        self.drain = DrainRate()
+        # IPv6 literals may come bracketed, [fe80::1]
+        self.host = address[1:-1] if address.startswith('[') else address
+        self.needs_lookup = not is_ip_address(address)
+        # Address of this hostname that last accepted a connection, tried first next time
+        self.last_address: Optional[str] = None
+
+    def connect_address(self, timeout: float = RESOLVE_TIMEOUT) -> Optional[str]:
+        """
+        Address to connect to, from the resolver cache for a hostname
+
+        A name with several addresses (IPv4 and IPv6, or a stale record next to the
+        printer's current one) has them tried in order, last working one first, each
+        for CONNECT_TIMEOUT, and the first to accept is used.
+        """
+        if not self.needs_lookup:
+            return self.host
+        addresses = resolver.resolve(self.host, timeout)
+        if not addresses:
+            if resolver.resolving(self.host):
+                print(f"⏳ Still resolving printer hostname {self.host}")
+            else:
+                print(f"❌ Could not resolve printer hostname {self.host}")
+            return None
+        if len(addresses) == 1:
+            return addresses[0]
+        last = self.last_address
+        for address in sorted(addresses, key=lambda address: address != last):
+            try:
+                socket.create_connection((address, 9100), timeout=CONNECT_TIMEOUT).close()
+            except OSError:
+                print(f"⚠️ {self.host} not answering on {address}")
+                continue
+            self.last_address = address
+            return address
+        print(f"❌ No address of printer hostname {self.host} accepted a connection")
+        return None
+
+    def send(self, data: bytes, on_stage: StageCallback = ignore_stage) -> bool:
+        return self.send_stream(_bytes_reader(data), on_stage)
+
+    def send_chunks(self, chunks: Iterable[bytes], on_stage: StageCallback = ignore_stage) -> bool:
+        address = self.connect_address()
+        return address is not None and IPPrinter(address).send_paced(chunks, self.drain, STATUS_CONFIRM, on_stage)
+
+    def send_stream(self, readinto: Callable[[memoryview], int], on_stage: StageCallback = ignore_stage) -> bool:
+        address = self.connect_address()
+        return address is not None and stream_to_ip_printer(address, readinto, on_stage)
+
+    def print_lines(self, lines: List[Dict[str, Any]], paper_width: int = 80,
+                    on_stage: StageCallback = ignore_stage, codepage: Optional[str] = None) -> bool:
+        address = self.connect_address()
+        return address is not None and print_to_ip_printer(address, lines, paper_width, self.drain, STATUS_CONFIRM,
+                                                           on_stage, codepage)
+
+
+class DeviceTransport(Transport):
+    """USB line printer device kept open between jobs"""
+
+    label = 'USB printer'
+
+    def __init__(self, address: str):
+        super().__init__(address)
+        self._handle = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self._handle is None:
+            self._handle = open(self.address, 'wb', buffering=0)
+        return self._handle
+
+    def _reset(self):
+        if self._handle is not None:
+            try:
+                self._handle.close()
+            except OSError:
+                pass
+            self._handle = None
+
+    def send_chunks(self, chunks: Iterable[bytes], on_stage: StageCallback = ignore_stage) -> bool:
+        with self._lock:
+            # The kernel lp driver blocks writes while the printer is busy, so no pacing is needed
+            total = 0
+            try:
+                self._open()
+                on_stage('connected')
+                for chunk in chunks:
+                    try:
+                        self._open().write(chunk)
+                    except OSError:
+                        # A stale handle (printer unplugged and replugged) gets one reopen,
+                        # but only before anything of this job has been written
+                        self._reset()
+                        if total:
+                            raise
+                        self._open().write(chunk)
+                    total += len(chunk)
+                on_stage('sent')
+                print(f"📤 Wrote {total} bytes to {self.address}")
+                return True
+            except OSError as e:
+                self._reset()
+                print(f"❌ USB printer error on {self.address}: {e}")
+                return False
+
+    def send_stream(self, readinto: Callable[[memoryview], int], on_stage: StageCallback = ignore_stage) -> bool:
+        buffer = memoryview(bytearray(STREAM_CHUNK_SIZE))
+        with self._lock:
+            try:
+                handle = self._open()
+                on_stage('connected')
+                total = 0
+                while True:
+                    count = readinto(buffer)
+                    if not count:
+                        break
+                    handle.write(buffer[:count])
+                    total += count
+                on_stage('sent')
+                print(f"📤 Streamed {total} bytes to {self.address}")
+                return True
+            except OSError as e:
+                self._reset()
+                print(f"❌ USB printer error on {self.address}: {e}")
+                return False
+
+    def available(self) -> bool:
+        return os.access(self.address, os.W_OK)
+
+    def close(self):
+        with self._lock:
+            self._reset()
+
+
+class FileTransport(Transport):
+    """Appends jobs to a file or named pipe, for testing without a printer"""
+
+    label = 'file sink'
+
+    def _open(self):
+        """
+        Open the sink for appending
+
+        A named pipe with no reader would block the open until one turns up, holding the
+        printer's queue thread, so it is opened non-blocking (ENXIO when nothing reads) and
+        switched back to blocking writes once open.
+        """
+        fd = os.open(self.address, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_NONBLOCK', 0), 0o666)
+        try:
+            os.set_blocking(fd, True)
+        except (AttributeError, OSError):
+            # No O_NONBLOCK on Windows, where the file was opened blocking anyway
+            pass
+        return open(fd, 'wb', buffering=0)
+
+    def _failed(self, e: OSError) -> bool:
+        if e.errno == errno.ENXIO:
+            print(f"❌ File sink {self.address} is a named pipe with nothing reading it")
+        else:
+            print(f"❌ File sink error on {self.address}: {e}")
+        return False
+
+    def send_chunks(self, chunks: Iterable[bytes], on_stage: StageCallback = ignore_stage) -> bool:
+        try:
+            with self._open() as sink:
+                on_stage('connected')
+                for chunk in chunks:
+                    sink.write(chunk)
+            on_stage('sent')
+            return True
+        except OSError as e:
+            return self._failed(e)
+
+    def send_stream(self, readinto: Callable[[memoryview], int], on_stage: StageCallback = ignore_stage) -> bool:
+        buffer = memoryview(bytearray(STREAM_CHUNK_SIZE))
+        try:
+            with self._open() as sink:
+                on_stage('connected')
+                while True:
+                    count = readinto(buffer)
+                    if not count:
+                        on_stage('sent')
+                        return True
+                    sink.write(buffer[:count])
+        except OSError as e:
+            return self._failed(e)
+
+    def available(self) -> bool:
+        return os.path.isdir(os.path.dirname(self.address))
+
+
+def _bytes_reader(data: bytes) -> Callable[[memoryview], int]:
+    """readinto-style callable over an in-memory buffer"""
+    view = memoryview(data)
+    position = 0
+
+    def readinto(buffer: memoryview) -> int:
+        nonlocal position
+        count = min(len(buffer), len(view) - position)
+        buffer[:count] = view[position:position + count]
+        position += count
+        return count
+
+    return readinto
+
+
+def is_ip_address(address: str) -> bool:
+    """Check if string is a valid IPv4 address or IPv6 address (bracketed or not)"""
+    if IP_PATTERN.match(address):
+        return all(0 <= int(part) <= 255 for part in address.split('.'))
+    if ':' not in address:
+        return False
+    if address.startswith('[') and address.endswith(']'):
+        address = address[1:-1]
+    try:
+        return ipaddress.ip_address(address).version == 6
+    except ValueError:
+        return False
+
+
+def is_hostname(address: str) -> bool:
+    """Check if string looks like a printer hostname, e.g. kitchen-printer.local"""
+    return bool(HOSTNAME_PATTERN.match(address))
+
+
+def is_network_address(address: str) -> bool:
+    """Check if string is a TCP printer address: IPv4, IPv6 or hostname"""
+    return is_ip_address(address) or is_hostname(address)
+
+
+def _sink_path(path: str) -> Optional[str]:
+    """Resolve a sink path, None if it falls outside SINK_DIR"""
+    if not SINK_DIR:
+        return None
+    root = os.path.realpath(SINK_DIR)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        return None
+    return resolved
+
+
+def parse_target(target: str) -> Optional[Transport]:
+    """
+    Build a transport for a printer target, None if it isn't one
+
+    Targets:
+        192.168.1.50            TCP printer on port 9100
+        fd00::50, [fd00::50]    TCP printer by IPv6 address
+        kitchen-printer.local   TCP printer by hostname, resolved through the resolver cache
+        usb:/dev/usb/lp0        USB line printer device
+        file:kitchen.bin        File or named pipe under EZDINE_SINK_DIR
+    """
+    if is_network_address(target):
+        return TcpTransport(target)
+    if target.startswith('usb:') and DEVICE_PATTERN.match(target[4:]):
+        return DeviceTransport(target[4:])
+    if target.startswith('file:'):
+        path = _sink_path(target[5:])
+        if path:
+            return FileTransport(path)
+    return None
+
+
+_transports: 'OrderedDict[str, Transport]' = OrderedDict()
+_transports_lock = threading.Lock()
+
+
+def get_transport(target: str) -> Optional[Transport]:
+    """Shared transport for a target that is being printed to, so device handles persist across jobs"""
+    evicted = None
+    with _transports_lock:
+        transport = _transports.get(target)
+        if transport is None:
+            transport = parse_target(target)
+            if transport is not None:
+                _transports[target] = transport
+                if len(_transports) > MAX_TRANSPORTS:
+                    _, evicted = _transports.popitem(last=False)
+        else:
+            _transports.move_to_end(target)
+    if evicted is not None:
+        # Outside the lock, as a device may be mid-job
+        evicted.close()
+    return transport
+
+
+def lookup_transport(target: str) -> Optional[Transport]:
+    """The shared transport for a target if it has one, else an unshared one, for checks that send nothing"""
+    with _transports_lock:
+        transport = _transports.get(target)
+    return transport if transport is not None else parse_target(target)
+
+
+def describe_target(target: str) -> str:
+    """Human readable name for a printer target, e.g. 'IP printer 192.168.1.50'"""
+    transport = lookup_transport(target)
+    return transport.describe() if transport else f"printer {target}"
@@ -22,6 +22,10 @@ npm run pkg
 cp dist/ezdine-print-bridge-macos ../apps/desktop/bridge/
 cp dist/ezdine-print-bridge-win.exe ../apps/desktop/bridge/
 
+# 2b. Pack the Python bridge shipped in print-bridge/dist (fails if it starts too slowly)
+echo "🐍 Building ezdine-print-bridge.pyz..."
+python3 ../print-server/build_bridge.py
+
 # 3. Build Web POS (optional but good to ensure dist is ready)
 # cd ../apps/web && pnpm build && cd ..
 